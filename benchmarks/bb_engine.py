@@ -0,0 +1,98 @@
+"""Benchmark BBCode engines on dispatch-sized texts.
+
+Run from the repository root:
+
+    python -m benchmarks.bb_engine
+"""
+
+import argparse
+import random
+import timeit
+
+from nsadm import bb_parser
+
+
+SIMPLE_FORMATTER_PATH = 'tests/resources/bb_simple_formatters.toml'
+COMPLEX_FORMATTER_PATH = 'tests/resources/bb_complex_formatters.py'
+COMPLEX_FORMATTER_CONFIG_PATH = 'tests/resources/bb_complex_formatter_config.toml'
+
+# Paragraphs of a dispatch: mostly NSCode with some custom tags.
+PARAGRAPHS = ['[b]Section[/b]\n[list][*]Item one[*]Item two[/list]\n',
+              '[url=https://www.nationstates.net/nation=example]Example[/url] text. ',
+              '[table][tr][td][simple1]Cell[/simple1][/td][td]Value[/td][/tr][/table]\n',
+              '[complex]Complex [simple2]nested[/simple2][/complex] and plain text. ',
+              '[complexopt opt=value]Option[/complexopt] [i]italic[/i]\n',
+              '[complexctx]Context[/complexctx] [anchor=top]Anchor[/anchor]\n',
+              'Plain paragraph without tags that goes on for a while to pad the text out.\n']
+
+
+def make_dispatch(size, seed=0):
+    """Make a dispatch text of about a size.
+
+    Args:
+        size (int): Number of characters
+        seed (int): Random seed
+
+    Returns:
+        str: Text
+    """
+
+    rand = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        part = rand.choice(PARAGRAPHS)
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+
+def make_context(var_count):
+    """Make a render context with many variables like a loaded var file.
+
+    Args:
+        var_count (int): Number of variables
+
+    Returns:
+        dict: Context
+    """
+
+    context = {'var{}'.format(i): i for i in range(var_count)}
+    context['example'] = {'foo': 'bar'}
+    return context
+
+
+def make_parser(engine):
+    parser = bb_parser.BBParser(SIMPLE_FORMATTER_PATH, COMPLEX_FORMATTER_PATH,
+                                COMPLEX_FORMATTER_CONFIG_PATH, engine=engine)
+    parser.load_formatters()
+    return parser
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark BBCode engines.')
+    arg_parser.add_argument('--size', type=int, default=150000, help='Dispatch size in characters')
+    arg_parser.add_argument('--vars', type=int, default=1000, help='Number of context variables')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Number of runs per engine')
+    args = arg_parser.parse_args()
+
+    text = make_dispatch(args.size)
+    context = make_context(args.vars)
+
+    outputs = {}
+    timings = {}
+    for engine in bb_parser.ENGINES:
+        parser = make_parser(engine)
+        outputs[engine] = parser.format_with_context(text, context)
+        timings[engine] = min(timeit.repeat(lambda: parser.format_with_context(text, context),
+                                            number=1, repeat=args.repeat))
+
+    print('Dispatch of {} characters with {} context variables'.format(len(text), args.vars))
+    for engine, elapsed in timings.items():
+        print('{:8} {:10.2f} ms'.format(engine, elapsed * 1000))
+    print('Speedup: {:.1f}x'.format(timings['bbcode'] / timings['nsadm']))
+    print('Same output: {}'.format(len(set(outputs.values())) == 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
-"""Complex BBCode formatter API.
+"""Complex BBCode formatter and filter cache API.
 """
 
 from nsadm.bb_parser import BBRegistry as BBCode
+from nsadm.filter_cache import cached_filter
@@ -1,7 +1,10 @@
 """NationStates Automatic Dispatch Manager."""
 
 import os
+import pathlib
 import argparse
+import asyncio
+import concurrent.futures
 import logging
 import logging.config
 
@@ -13,7 +16,15 @@ import nationstates
 
 from nsadm import exceptions
 from nsadm import api_adapter
+from nsadm import bb_parser
+from nsadm import deps
+from nsadm import filter_cache
+from nsadm import fragment_cache
+from nsadm import journal
+from nsadm import async_api_adapter
 from nsadm import loader
+from nsadm import pipeline
+from nsadm import profiler
 from nsadm import renderer
 from nsadm import updater
 from nsadm import utils
@@ -27,11 +38,33 @@ class NSADM():
 
     Args:
         config (dict): Configuration
+        render_profiler (nsadm.profiler.RenderProfiler): Profiler to record renders in
     """
 
-    def __init__(self, config):
-        ns_api = nationstates.Nationstates(user_agent=config['general']['user_agent'])
-        dispatch_api = api_adapter.DispatchAPI(ns_api)
+    def __init__(self, config, render_profiler=None):
+        self.config = config
+        self.profiler = render_profiler
+        self.user_agent = config['general']['user_agent']
+        self.ns_api = nationstates.Nationstates(user_agent=self.user_agent)
+        # One rate limiter paces all API sessions since limits are per client.
+        self.rate_limiter = api_adapter.RateLimiter(**config.get('rate_limit', {}))
+        dispatch_api = api_adapter.DispatchAPI(self.ns_api, self.rate_limiter)
+
+        # Number of nations to update concurrently.
+        self.workers = config['general'].get('workers', 1)
+        # Use blocking pynationstates ("sync") or pooled aiohttp client ("async").
+        self.api_backend = config['general'].get('api_backend', 'sync')
+        # Maximum number of pooled connections of the async backend.
+        self.max_connections = config['general'].get('max_connections',
+                                                     async_api_adapter.DEFAULT_MAX_CONNECTIONS)
+        # Number of processes to render dispatches ahead of pushing them.
+        # Zero means render each dispatch just before pushing it.
+        self.render_workers = config['general'].get('render_workers', 0)
+        # Maximum number of rendered dispatches waiting to be pushed.
+        self.render_ahead = config['general'].get('render_ahead', 8)
+        if render_profiler is not None and self.render_workers > 0:
+            logger.info('Render pipeline is disabled while profiling to profile all renders.')
+            self.render_workers = 0
 
         plugin_options = config['plugins']
         loader_config = config['loader_config']
@@ -40,55 +73,357 @@ class NSADM():
         self.var_loader = loader.VarLoader(plugin_options['var_loader'], loader_config)
 
         self.dispatch_config = None
+        # Dispatch config before dispatches skipped by an update are removed from it
+        self.loaded_dispatch_config = None
 
         bb_config = config['bbcode']
+        bb_config.setdefault('cache_path', str(info.DATA_DIR / bb_parser.OUTPUT_CACHE_DIRNAME))
         template_config= config['template_renderer']
+        # Render processes read the same config so they share this cache.
+        template_config.setdefault('bytecode_cache_path',
+                                   str(info.DATA_DIR / renderer.BYTECODE_CACHE_DIRNAME))
+        template_config.setdefault('fragment_cache_path',
+                                   str(info.DATA_DIR / fragment_cache.FRAGMENT_CACHE_DIRNAME))
         self.renderer = renderer.DispatchRenderer(self.dispatch_loader, self.var_loader,
-                                                  bb_config, template_config)
+                                                  bb_config, template_config, render_profiler)
+
+        filter_cache.default_cache.max_size = template_config.get('filter_cache_size',
+                                                                  filter_cache.DEFAULT_MAX_SIZE)
+        # Empty path disables keeping cached filter results between runs.
+        # Render processes load the same file and send their results back.
+        self.filter_cache_path = template_config.setdefault(
+            'filter_cache_path', str(info.DATA_DIR / filter_cache.FILTER_CACHE_FILENAME))
 
         self.cred_loader = loader.CredLoader(plugin_options['cred_loader'], loader_config)
         self.creds = utils.CredManager(self.cred_loader, dispatch_api)
+        self.sessions = utils.SessionCache(self.cred_loader,
+                                           config['general'].get('session_max_age', 0))
+
+        journal_path = config['general'].get('journal_path',
+                                             info.DATA_DIR / journal.JOURNAL_FILENAME)
+        self.journal = journal.UpdateJournal(journal_path)
 
-        self.updater = updater.DispatchUpdater(dispatch_api, self.creds,
-                                               self.renderer, self.dispatch_loader)
+        deps_path = config['general'].get('deps_path', info.DATA_DIR / deps.DEPS_FILENAME)
+        self.deps = deps.DependencyStore(deps_path)
 
-    def load(self, only_cred=False):
+    def load(self, only_cred=False, no_cred=False, dispatches=None):
         """Load all loaders and the renderer.
 
         Args:
             only_cred (bool): Only load credential loader
+            no_cred (bool): Do not load credential loader
+            dispatches (list): Dispatch names to render. Empty list means all.
+            None means unknown.
         """
 
-        self.cred_loader.load_loader()
+        if not no_cred:
+            self.cred_loader.load_loader()
         if only_cred:
             return
 
         self.dispatch_loader.load_loader()
         self.dispatch_config = self.dispatch_loader.get_dispatch_config()
+        # Dispatch configs are shared so that changes made by journal replay are seen.
+        self.loaded_dispatch_config = {owner_nation: dict(nation_dispatch_config)
+                                       for owner_nation, nation_dispatch_config
+                                       in self.dispatch_config.items()}
 
-        self.creds.load_creds()
+        if not no_cred:
+            self.creds.load_creds()
 
         self.var_loader.load_loader()
-        self.renderer.load(self.dispatch_config)
+        if self.filter_cache_path:
+            filter_cache.default_cache.load(self.filter_cache_path)
+        self.renderer.load(self.dispatch_config, dispatches)
 
-    def update_dispatches(self, dispatches):
-        """Update dispatches. Empty list means update all.
+        self.deps.load()
+
+    def update_nation_dispatches(self, owner_nation, dispatch_config, dispatches,
+                                 force=False, render_pipeline=None):
+        """Log into a nation and update its dispatches.
+        Each nation gets its own API session and updater
+        so that many nations can be updated at once.
 
         Args:
-            dispatches (list): Dispatch names.
+            owner_nation (str): Nation name
+            dispatch_config (dict): Nation's dispatch config
+            dispatches (list): Dispatch names. Empty list means update all.
+            force (bool): Edit dispatches even if their content is unchanged
+            render_pipeline (nsadm.pipeline.RenderPipeline): Render pipeline to get texts from
+
+        Returns:
+            dict|None: Dispatch names and whether they were updated successfully.
+            None if could not log into the nation.
         """
 
-        for owner_nation, dispatch_config in self.dispatch_config.items():
+        dispatch_api = api_adapter.DispatchAPI(self.ns_api, self.rate_limiter)
+        nation_updater = updater.DispatchUpdater(dispatch_api, self.creds,
+                                                 render_pipeline or self.renderer,
+                                                 self.dispatch_loader, force=force,
+                                                 sessions=self.sessions,
+                                                 journal=self.journal)
+
+        try:
             try:
-                self.updater.login_owner_nation(owner_nation, dispatch_config)
+                nation_updater.login_owner_nation(owner_nation, dispatch_config)
                 logger.info('Logged in nation "%s".', owner_nation)
             except exceptions.NationLoginError:
                 logger.error('Could not log into nation "%s".', owner_nation)
-                continue
+                return None
 
+            results = {}
             for name in dispatch_config.keys():
                 if not dispatches or name in dispatches:
-                    self.updater.update_dispatch(name)
+                    results[name] = nation_updater.update_dispatch(name)
+            # A reused session may have expired and been replaced during the updates.
+            nation_updater.refresh_session()
+
+            return results
+        finally:
+            if render_pipeline is not None:
+                render_pipeline.finish_nation(owner_nation)
+
+    async def update_nation_dispatches_async(self, session, owner_nation, dispatch_config,
+                                             dispatches, force=False, render_pipeline=None):
+        """Log into a nation and update its dispatches with the async API backend.
+
+        Args:
+            session (aiohttp.ClientSession): Client session shared by all nations
+            Others are the same as update_nation_dispatches
+
+        Returns:
+            dict|None: Same as update_nation_dispatches
+        """
+
+        dispatch_api = async_api_adapter.AsyncDispatchAPI(session, self.rate_limiter)
+        nation_updater = updater.AsyncDispatchUpdater(dispatch_api, self.creds,
+                                                      render_pipeline or self.renderer,
+                                                      self.dispatch_loader, force=force,
+                                                      sessions=self.sessions,
+                                                      journal=self.journal)
+
+        try:
+            try:
+                await nation_updater.login_owner_nation(owner_nation, dispatch_config)
+                logger.info('Logged in nation "%s".', owner_nation)
+            except exceptions.NationLoginError:
+                logger.error('Could not log into nation "%s".', owner_nation)
+                return None
+
+            results = {}
+            for name in dispatch_config.keys():
+                if not dispatches or name in dispatches:
+                    results[name] = await nation_updater.update_dispatch(name)
+            # A reused session may have expired and been replaced during the updates.
+            nation_updater.refresh_session()
+
+            return results
+        finally:
+            if render_pipeline is not None:
+                render_pipeline.finish_nation(owner_nation)
+
+    async def update_dispatches_async(self, dispatches, force=False, render_pipeline=None):
+        """Update dispatches of all nations from one event loop.
+        Number of nations updated at once is limited by the worker count.
+
+        Args:
+            dispatches (list): Dispatch names. Empty list means update all.
+            force (bool): Edit dispatches even if their content is unchanged
+            render_pipeline (nsadm.pipeline.RenderPipeline): Render pipeline to get texts from
+
+        Returns:
+            dict: Update results of each nation
+        """
+
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def update_nation(owner_nation, dispatch_config):
+            async with semaphore:
+                return await self.update_nation_dispatches_async(session, owner_nation,
+                                                                 dispatch_config, dispatches,
+                                                                 force, render_pipeline)
+
+        async with async_api_adapter.create_session(self.user_agent,
+                                                    self.max_connections) as session:
+            nations = list(self.dispatch_config.items())
+            nation_results = await asyncio.gather(*[update_nation(owner_nation, dispatch_config)
+                                                    for owner_nation, dispatch_config in nations])
+
+        return {owner_nation: result
+                for (owner_nation, _), result in zip(nations, nation_results)}
+
+    def replay_journal(self, resume=False):
+        """Recover new dispatch IDs and content hashes recorded by interrupted runs
+        so that their dispatches are not created again.
+
+        Args:
+            resume (bool): Also skip dispatches the interrupted runs already updated
+        """
+
+        entries = self.journal.load()
+        if entries:
+            logger.info('Found %d completed updates of an interrupted run.', len(entries))
+
+        for owner_nation in list(self.dispatch_config.keys()):
+            nation_dispatch_config = self.dispatch_config[owner_nation]
+            for name in list(nation_dispatch_config.keys()):
+                entry = entries.get(name)
+                if entry is None:
+                    continue
+
+                this_dispatch_config = nation_dispatch_config[name]
+                if entry['action'] == 'create':
+                    self.dispatch_loader.add_dispatch_id(name, entry['id'])
+                    this_dispatch_config['ns_id'] = entry['id']
+                    if this_dispatch_config.get('action') == 'create':
+                        this_dispatch_config['action'] = 'edit'
+                if entry['hash'] is not None:
+                    self.dispatch_loader.set_dispatch_hash(name, entry['hash'])
+
+                if resume:
+                    del nation_dispatch_config[name]
+                    logger.info('Dispatch "%s" was already updated. Skipped.', name)
+
+            # Avoid useless login
+            if not nation_dispatch_config:
+                del self.dispatch_config[owner_nation]
+
+        self.journal.open()
+
+    def skip_unchanged_inputs(self, dispatches, force=False):
+        """Skip editing dispatches whose render inputs have not changed since last pushed.
+
+        Args:
+            dispatches (list): Dispatch names. Empty list means all.
+            force (bool): Do not skip any dispatch
+
+        Returns:
+            dict: Dispatch names and their input hashes to record once updated
+        """
+
+        input_hashes = {}
+        for owner_nation in list(self.dispatch_config.keys()):
+            nation_dispatch_config = self.dispatch_config[owner_nation]
+            for name in list(nation_dispatch_config.keys()):
+                this_dispatch_config = nation_dispatch_config[name]
+                if dispatches and name not in dispatches:
+                    continue
+                if this_dispatch_config.get('action') not in ('create', 'edit'):
+                    continue
+
+                input_hash = self.renderer.get_input_hash(name, this_dispatch_config)
+                if (not force and this_dispatch_config['action'] == 'edit'
+                        and self.deps.is_unchanged(name, input_hash)):
+                    del nation_dispatch_config[name]
+                    logger.info('Inputs of dispatch "%s" are unchanged. Skipped.', name)
+                    continue
+                input_hashes[name] = input_hash
+
+            # Avoid useless login
+            if not nation_dispatch_config:
+                del self.dispatch_config[owner_nation]
+
+        return input_hashes
+
+    def update_dispatches(self, dispatches, force=False, resume=False):
+        """Update dispatches. Empty list means update all.
+
+        Args:
+            dispatches (list): Dispatch names.
+            force (bool): Edit dispatches even if their content is unchanged
+            resume (bool): Skip dispatches an interrupted run already updated
+
+        Returns:
+            dict: Update results of each nation
+        """
+
+        self.replay_journal(resume)
+        input_hashes = self.skip_unchanged_inputs(dispatches, force)
+
+        render_pipeline = None
+        if self.render_workers > 0:
+            render_pipeline = pipeline.RenderPipeline(self.config, self.render_workers,
+                                                      self.render_ahead)
+            render_pipeline.start(self.dispatch_config, dispatches, self.loaded_dispatch_config)
+
+        results = {}
+        try:
+            if self.api_backend == 'async':
+                results = asyncio.run(self.update_dispatches_async(dispatches, force,
+                                                                   render_pipeline))
+            elif self.workers > 1:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    futures = {executor.submit(self.update_nation_dispatches, owner_nation,
+                                               dispatch_config, dispatches, force,
+                                               render_pipeline): owner_nation
+                               for owner_nation, dispatch_config in self.dispatch_config.items()}
+                    for future in concurrent.futures.as_completed(futures):
+                        results[futures[future]] = future.result()
+            else:
+                for owner_nation, dispatch_config in self.dispatch_config.items():
+                    results[owner_nation] = self.update_nation_dispatches(owner_nation,
+                                                                          dispatch_config,
+                                                                          dispatches, force,
+                                                                          render_pipeline)
+        finally:
+            if render_pipeline is not None:
+                render_pipeline.close()
+
+        for nation_results in results.values():
+            for name, success in (nation_results or {}).items():
+                if success and name in input_hashes:
+                    self.deps.set_input_hash(name, input_hashes[name])
+
+        utils.log_update_results(results)
+        return results
+
+    def render_dispatches(self, dispatches, output_dir):
+        """Render dispatches into files without pushing them. Empty list means render all.
+
+        Args:
+            dispatches (list): Dispatch names.
+            output_dir (str): Directory to write rendered dispatches to
+
+        Returns:
+            dict: Dispatch names and their render stage timings and output size.
+            None if could not render the dispatch.
+        """
+
+        output_dir = pathlib.Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        results = {}
+        for _, name in pipeline.get_render_jobs(self.dispatch_config, dispatches):
+            timings = {}
+            try:
+                text = self.renderer.render(name, timings)
+            except exceptions.DispatchRenderingError:
+                logger.error('Could not render dispatch "%s".', name)
+                results[name] = None
+                continue
+
+            with open(output_dir / '{}.txt'.format(name), 'w', encoding='utf-8') as f:
+                f.write(text)
+            timings['size'] = len(text)
+            results[name] = timings
+            logger.info('Rendered dispatch "%s" into "%s".', name, output_dir)
+
+        return results
+
+    def compile_templates(self, output_dir):
+        """Precompile templates of all dispatches and templates they use.
+
+        Args:
+            output_dir (str): Directory to write compiled template modules to
+
+        Returns:
+            int: Number of compiled templates
+        """
+
+        names = [name for _, name in pipeline.get_render_jobs(self.dispatch_config, [])]
+        count = self.renderer.template_renderer.compile_templates(names, output_dir)
+        logger.info('Compiled %d templates into "%s".', count, output_dir)
+        return count
 
     def add_nation_cred(self, nation_name, password):
         """Add a new credential.
@@ -113,8 +448,19 @@ class NSADM():
         """Cleanup.
         """
 
+        self.renderer.bb_parser.close()
         self.dispatch_loader.cleanup_loader()
         self.cred_loader.cleanup_loader()
+        if self.dispatch_config is not None:
+            filter_cache.default_cache.log_stats()
+            self.renderer.bb_parser.log_formatter_cache_stats()
+            if self.renderer.bb_parser.cache is not None:
+                self.renderer.bb_parser.cache.log_stats()
+            if self.filter_cache_path:
+                filter_cache.default_cache.save(self.filter_cache_path)
+        self.deps.save()
+        # Loaders saved everything the journal recorded.
+        self.journal.finish()
 
 def cli():
     """Process command line arguments."""
@@ -131,6 +477,27 @@ def cli():
     update_command = subparsers.add_parser('update', help='Update dispatches')
     update_command.add_argument('dispatches', nargs='*', metavar='N',
                                 help='Names of dispatches to update (Leave blank means all)')
+    update_command.add_argument('--force', action='store_true',
+                                help='Update dispatches even if their content is unchanged')
+    update_command.add_argument('--resume', action='store_true',
+                                help='Skip dispatches an interrupted run already updated')
+    update_command.add_argument('--profile', metavar='REPORT',
+                                help='Profile filters and BBCode formatters into a JSON report')
+
+    render_command = subparsers.add_parser('render',
+                                           help='Render dispatches into files without updating them')
+    render_command.add_argument('render_dispatches', nargs='*', metavar='N',
+                                help='Names of dispatches to render (Leave blank means all)')
+    render_command.add_argument('--output', default='rendered_dispatches', metavar='DIR',
+                                help='Directory to write rendered dispatches to')
+    render_command.add_argument('--profile', metavar='REPORT',
+                                help='Profile filters and BBCode formatters into a JSON report')
+
+    compile_command = subparsers.add_parser('compile',
+                                            help='Precompile templates into Python modules')
+    compile_command.add_argument('--output', dest='compile_output', metavar='DIR',
+                                 help=('Directory to write compiled templates to '
+                                       '(Defaults to template_renderer.compiled_path)'))
 
     return parser.parse_args()
 
@@ -149,9 +516,24 @@ def run(app, inputs):
     elif hasattr(inputs, 'remove'):
         app.load(only_cred=True)
         app.remove_nation_cred(inputs.remove[0])
+    elif hasattr(inputs, 'compile_output'):
+        output_dir = inputs.compile_output or app.config['template_renderer'].get('compiled_path')
+        if output_dir is None:
+            print('No output directory. Use --output or set template_renderer.compiled_path.')
+            return
+        app.load(no_cred=True)
+        app.compile_templates(output_dir)
+    elif hasattr(inputs, 'render_dispatches'):
+        app.load(no_cred=True, dispatches=inputs.render_dispatches)
+        results = app.render_dispatches(inputs.render_dispatches, inputs.output)
+        print(utils.format_render_timings(results))
     else:
-        app.load()
-        app.update_dispatches(inputs.dispatches)
+        app.load(dispatches=inputs.dispatches)
+        app.update_dispatches(inputs.dispatches, force=inputs.force, resume=inputs.resume)
+
+    if app.profiler is not None:
+        app.profiler.save_report(inputs.profile)
+        print(app.profiler.format_summary())
 
 
 def main():
@@ -176,7 +558,10 @@ def main():
     info.LOGGING_DIR.mkdir(exist_ok=True)
 
     try:
-        app = NSADM(config)
+        render_profiler = None
+        if getattr(inputs, 'profile', None) is not None:
+            render_profiler = profiler.RenderProfiler()
+        app = NSADM(config, render_profiler)
         run(app, inputs)
         app.close()
     except Exception as err:
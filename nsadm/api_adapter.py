@@ -2,12 +2,30 @@
 """
 
 import re
+import time
+import logging
+import threading
 
 import nationstates
 
 from nsadm import exceptions
 
 
+logger = logging.getLogger(__name__)
+
+
+# NationStates allows 50 requests per 30 seconds.
+# Stay below it like pynationstates does.
+DEFAULT_REQUEST_LIMIT = 40
+DEFAULT_REQUEST_WINDOW = 30
+# Dispatch writes are throttled more strictly.
+DEFAULT_DISPATCH_LIMIT = 1
+DEFAULT_DISPATCH_WINDOW = 5
+# Each dispatch write is a prepare and an execute request.
+DISPATCH_WRITE_REQUESTS = 2
+DEFAULT_MAX_RETRIES = 3
+
+
 def reraise_exception(err):
     """Reraise appropriate exceptions.
     """
@@ -20,16 +38,271 @@ def reraise_exception(err):
     raise exceptions.DispatchAPIError from err
 
 
+def get_retry_after(err):
+    """Get seconds to wait from a rate limit error.
+
+    Args:
+        err (nationstates.exceptions.APIRateLimitBan): Rate limit error
+
+    Returns:
+        float|None: Seconds to wait or None if not given
+    """
+
+    match = re.search('Retry-After: (\\d+)', str(err))
+    if match is None:
+        return None
+
+    return float(match.group(1))
+
+
+class TokenBucket():
+    """Token bucket to pace calls. Safe to share between threads.
+
+    Args:
+        limit (int): Maximum number of calls in a window
+        window (float): Window length in seconds
+        clock (func): Current time in seconds
+        sleep (func): Sleep function
+    """
+
+    def __init__(self, limit, window, clock=time.monotonic, sleep=time.sleep):
+        self.base_rate = limit / window
+        self.rate = self.base_rate
+        self.capacity = limit
+        self.tokens = limit
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        # Time tokens were last refilled. Is in the future when paused.
+        self.updated = clock()
+
+    def refill(self, now):
+        """Refill tokens since last refill. Lock must be held.
+
+        Args:
+            now (float): Current time
+        """
+
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def reserve(self, tokens=1):
+        """Take tokens without waiting.
+
+        Args:
+            tokens (int): Number of tokens
+
+        Returns:
+            float: Seconds to wait until the tokens are available
+        """
+
+        with self.lock:
+            now = self.clock()
+            self.refill(now)
+            self.tokens -= tokens
+            return max(0, self.updated - now) + max(0, -self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Take tokens and wait until they are available.
+
+        Args:
+            tokens (int): Number of tokens
+        """
+
+        wait = self.reserve(tokens)
+        if wait > 0:
+            logger.debug('Rate limiter waits %.2f seconds', wait)
+            self.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop giving out tokens for a while.
+
+        Args:
+            seconds (float): Pause length
+        """
+
+        with self.lock:
+            now = self.clock()
+            self.refill(now)
+            self.tokens = min(self.tokens, 0)
+            self.updated = max(self.updated, now + seconds)
+
+    def set_available(self, tokens):
+        """Lower available tokens to what the server reports.
+
+        Args:
+            tokens (int): Number of tokens
+        """
+
+        with self.lock:
+            self.refill(self.clock())
+            self.tokens = min(self.tokens, tokens)
+
+    def slow_down(self):
+        """Halve the rate after being throttled.
+        """
+
+        with self.lock:
+            self.rate = max(self.rate / 2, self.base_rate / 16)
+            logger.debug('Rate limiter slowed down to %.3f calls per second', self.rate)
+
+    def speed_up(self):
+        """Recover the rate gradually after a successful call.
+        """
+
+        with self.lock:
+            self.rate = min(self.rate + self.base_rate / 20, self.base_rate)
+
+
+class RateLimiter():
+    """Pace NationStates API calls under the request and dispatch write limits.
+    Share one instance between all DispatchAPI objects since limits are per client.
+
+    Args:
+        request_limit (int): Maximum number of requests in a window
+        request_window (float): Request window length in seconds
+        dispatch_limit (int): Maximum number of dispatch writes in a window
+        dispatch_window (float): Dispatch write window length in seconds
+        max_retries (int): Times to retry a throttled call
+    """
+
+    def __init__(self, request_limit=DEFAULT_REQUEST_LIMIT,
+                 request_window=DEFAULT_REQUEST_WINDOW,
+                 dispatch_limit=DEFAULT_DISPATCH_LIMIT,
+                 dispatch_window=DEFAULT_DISPATCH_WINDOW,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        self.request_bucket = TokenBucket(request_limit, request_window)
+        self.dispatch_bucket = TokenBucket(dispatch_limit, dispatch_window)
+        self.request_window = request_window
+        self.dispatch_window = dispatch_window
+        self.max_retries = max_retries
+
+    def wait(self, dispatch_write=False):
+        """Wait until a call can be made.
+
+        Args:
+            dispatch_write (bool): Call writes a dispatch
+        """
+
+        if dispatch_write:
+            self.dispatch_bucket.acquire()
+            self.request_bucket.acquire(DISPATCH_WRITE_REQUESTS)
+        else:
+            self.request_bucket.acquire()
+
+    def reserve(self, dispatch_write=False):
+        """Reserve a call without waiting, for callers that wait on their own.
+
+        Args:
+            dispatch_write (bool): Call writes a dispatch
+
+        Returns:
+            float: Seconds to wait before making the call
+        """
+
+        if dispatch_write:
+            return max(self.dispatch_bucket.reserve(),
+                       self.request_bucket.reserve(DISPATCH_WRITE_REQUESTS))
+
+        return self.request_bucket.reserve()
+
+    def succeeded(self, dispatch_write=False):
+        """Record a successful call.
+
+        Args:
+            dispatch_write (bool): Call writes a dispatch
+        """
+
+        self.request_bucket.speed_up()
+        if dispatch_write:
+            self.dispatch_bucket.speed_up()
+
+    def throttled(self, retry_after=None, dispatch_write=False):
+        """Back off after being throttled.
+
+        Args:
+            retry_after (float|None): Seconds the server asked to wait
+            dispatch_write (bool): Only dispatch writes were throttled
+        """
+
+        if dispatch_write:
+            bucket, window = self.dispatch_bucket, self.dispatch_window
+        else:
+            bucket, window = self.request_bucket, self.request_window
+
+        bucket.slow_down()
+        bucket.pause(window if retry_after is None else retry_after)
+
+    def observe_headers(self, headers):
+        """Adjust pacing to rate limit headers of a response.
+
+        Args:
+            headers (dict): Response headers
+        """
+
+        retry_after = headers.get('Retry-After')
+        if retry_after is not None:
+            self.request_bucket.pause(float(retry_after))
+
+        remaining = headers.get('RateLimit-Remaining')
+        if remaining is not None:
+            remaining = int(remaining)
+            if remaining <= 0:
+                self.request_bucket.pause(float(headers.get('RateLimit-Reset', self.request_window)))
+            else:
+                self.request_bucket.set_available(remaining)
+
+
 class DispatchAPI():
     """pynationstates wrapper for dispatch functions.
 
     Args:
         ns_api (nationstates.Nationstates): Real API object
+        rate_limiter (RateLimiter): Rate limiter shared by all API objects
     """
 
-    def __init__(self, ns_api):
+    def __init__(self, ns_api, rate_limiter=None):
         self.api = ns_api
         self.owner_nation = None
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter
+
+    def call(self, func, *args, dispatch_write=False, **kwargs):
+        """Call an API function paced by the rate limiter and retry when throttled.
+
+        Args:
+            func (func): API function
+            dispatch_write (bool): Call writes a dispatch
+
+        Raises:
+            exceptions.RateLimitError: Still throttled after retrying
+
+        Returns:
+            Result of API function
+        """
+
+        for _ in range(self.rate_limiter.max_retries + 1):
+            self.rate_limiter.wait(dispatch_write)
+            try:
+                resp = func(*args, **kwargs)
+            except nationstates.exceptions.APIRateLimitBan as err:
+                logger.warning('Rate limited by NationStates: %s', err)
+                self.rate_limiter.throttled(get_retry_after(err))
+                last_err = err
+                continue
+            except nationstates.exceptions.DispatchTooRecent as err:
+                logger.warning('Dispatch writes throttled by NationStates')
+                self.rate_limiter.throttled(dispatch_write=True)
+                last_err = err
+                continue
+
+            self.rate_limiter.succeeded(dispatch_write)
+            return resp
+
+        raise exceptions.RateLimitError from last_err
 
     def login(self, nation_name, password=None, autologin=None):
         """Get nation and test login.
@@ -48,10 +321,13 @@ class DispatchAPI():
             self.owner_nation = self.api.nation(nation_name, autologin=autologin)
 
         try:
-            resp_headers = self.owner_nation.get_shards('ping', full_response=True)['headers']
+            resp_headers = self.call(self.owner_nation.get_shards,
+                                     'ping', full_response=True)['headers']
         except nationstates.exceptions.Forbidden as err:
             raise exceptions.NationLoginError from err
 
+        self.rate_limiter.observe_headers(resp_headers)
+
         if password is not None:
             if 'X-Autologin' not in resp_headers:
                 raise exceptions.NationLoginError
@@ -60,6 +336,42 @@ class DispatchAPI():
 
         return None
 
+    def resume_session(self, nation_name, autologin, pin):
+        """Use a cached login session without a login request.
+        Logs in with autologin again if the session has expired.
+
+        Args:
+            nation_name (str): Nation name
+            autologin (str): Nation X-Autologin
+            pin (str): Session pin
+        """
+
+        self.owner_nation = self.api.nation(nation_name, autologin=autologin)
+        self.owner_nation.current_api.pin = pin
+
+    def get_pin(self):
+        """Get pin of current login session.
+
+        Returns:
+            str|None: Session pin
+        """
+
+        return getattr(self.owner_nation.current_api, 'pin', None)
+
+    def write_dispatch(self, func, **kwargs):
+        """Call a dispatch write function and adjust pacing to its response headers.
+
+        Args:
+            func (func): API function
+
+        Returns:
+            dict: Response data of the nation
+        """
+
+        resp = self.call(func, full_response=True, dispatch_write=True, **kwargs)
+        self.rate_limiter.observe_headers(resp['headers'])
+        return resp['data'][self.owner_nation.api_name]
+
     def create_dispatch(self, title, text, category, subcategory):
         """Create a dispatch.
 
@@ -72,10 +384,14 @@ class DispatchAPI():
             str: New dispatch ID
         """
 
-        resp = self.owner_nation.create_dispatch(title=title,
-                                                 text=text,
-                                                 category=category,
-                                                 subcategory=subcategory)
+        try:
+            resp = self.write_dispatch(self.owner_nation.create_dispatch,
+                                       title=title,
+                                       text=text,
+                                       category=category,
+                                       subcategory=subcategory)
+        except nationstates.exceptions.Forbidden as err:
+            raise exceptions.NationLoginError from err
 
         new_dispatch_id = re.search('id=(\\d+)', resp['success']).group(1)
         return new_dispatch_id
@@ -92,13 +408,16 @@ class DispatchAPI():
         """
 
         try:
-            self.owner_nation.edit_dispatch(dispatch_id=dispatch_id,
-                                            title=title,
-                                            text=text,
-                                            category=category,
-                                            subcategory=subcategory)
+            self.write_dispatch(self.owner_nation.edit_dispatch,
+                                dispatch_id=dispatch_id,
+                                title=title,
+                                text=text,
+                                category=category,
+                                subcategory=subcategory)
         except nationstates.exceptions.APIUsageError as err:
             reraise_exception(err)
+        except nationstates.exceptions.Forbidden as err:
+            raise exceptions.NationLoginError from err
 
     def remove_dispatch(self, dispatch_id):
         """Delete a dispatch.
@@ -108,6 +427,9 @@ class DispatchAPI():
         """
 
         try:
-            self.owner_nation.remove_dispatch(dispatch_id=dispatch_id)
+            self.write_dispatch(self.owner_nation.remove_dispatch,
+                                dispatch_id=dispatch_id)
         except nationstates.exceptions.APIUsageError as err:
             reraise_exception(err)
+        except nationstates.exceptions.Forbidden as err:
+            raise exceptions.NationLoginError from err
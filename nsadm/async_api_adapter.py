@@ -0,0 +1,345 @@
+"""Asynchronous dispatch API over a pooled aiohttp client.
+"""
+
+import re
+import asyncio
+import logging
+import xml.etree.ElementTree as ET
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from nsadm import exceptions
+from nsadm import api_adapter
+
+
+API_URL = 'https://www.nationstates.net/cgi-bin/api.cgi'
+API_VERSION = '11'
+DEFAULT_MAX_CONNECTIONS = 10
+
+# Error NationStates gives when dispatch writes are throttled.
+DISPATCH_TOO_RECENT = 'attempting to issue many announcements in a short period of time'
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_session(user_agent, max_connections=DEFAULT_MAX_CONNECTIONS):
+    """Create a keep-alive HTTP client session to share between API objects.
+    Must be called inside a running event loop.
+
+    Args:
+        user_agent (str): User agent
+        max_connections (int): Maximum number of pooled connections
+
+    Raises:
+        exceptions.ConfigError: aiohttp is not installed
+
+    Returns:
+        aiohttp.ClientSession: Client session
+    """
+
+    if aiohttp is None:
+        raise exceptions.ConfigError('Async API backend requires aiohttp. '
+                                     'Install it with "pip install nsadm[async]".')
+
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    return aiohttp.ClientSession(connector=connector, headers={'User-Agent': user_agent})
+
+
+def parse_response(xml_text):
+    """Get result text of a nation API response.
+
+    Args:
+        xml_text (str): Response XML
+
+    Raises:
+        exceptions.DispatchAPIError: Response is not valid XML
+
+    Returns:
+        tuple: Whether the request succeeded and its result or error text
+    """
+
+    try:
+        root = ET.fromstring(xml_text)
+    except ET.ParseError as err:
+        raise exceptions.DispatchAPIError from err
+
+    error = root.find('ERROR')
+    if error is not None:
+        return False, error.text or ''
+
+    success = root.find('SUCCESS')
+    if success is not None:
+        return True, success.text or ''
+
+    return True, ''
+
+
+def raise_dispatch_error(error):
+    """Raise appropriate exception for a dispatch command error.
+
+    Args:
+        error (str): Error text
+    """
+
+    if 'Unknown dispatch' in error:
+        raise exceptions.UnknownDispatchError
+    if 'not the author of this dispatch' in error:
+        raise exceptions.NotOwnerDispatchError
+
+    raise exceptions.DispatchAPIError(error)
+
+
+class DispatchTooRecent(Exception):
+    """Dispatch write was throttled. Only used for retrying.
+    """
+
+
+class RateLimited(Exception):
+    """Request was throttled. Only used for retrying.
+
+    Args:
+        retry_after (float|None): Seconds the server asked to wait
+    """
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__()
+
+
+class AsyncDispatchAPI():
+    """Asynchronous version of nsadm.api_adapter.DispatchAPI.
+    Share one client session between all instances so that their connections are pooled.
+
+    Args:
+        session (aiohttp.ClientSession): Client session
+        rate_limiter (nsadm.api_adapter.RateLimiter): Rate limiter shared by all API objects
+        api_url (str): API URL
+    """
+
+    def __init__(self, session, rate_limiter=None, api_url=API_URL):
+        self.session = session
+        self.api_url = api_url
+        if rate_limiter is None:
+            rate_limiter = api_adapter.RateLimiter()
+        self.rate_limiter = rate_limiter
+        self.owner_nation = None
+        self.autologin = None
+        self.password = None
+        self.pin = None
+
+    def get_auth_headers(self):
+        """Get login headers of current nation.
+
+        Returns:
+            dict: Headers
+        """
+
+        if self.pin is not None:
+            return {'X-Pin': self.pin}
+        if self.autologin is not None:
+            return {'X-Autologin': self.autologin}
+        return {'X-Password': self.password}
+
+    async def request(self, data, dispatch_write=False):
+        """Send a request as current nation, paced by the rate limiter.
+
+        Args:
+            data (dict): Request parameters
+            dispatch_write (bool): Request writes a dispatch
+
+        Raises:
+            exceptions.NationLoginError: Could not log in
+            exceptions.RateLimitError: Still throttled after retrying
+
+        Returns:
+            tuple: Response headers and XML text
+        """
+
+        data = dict(data, nation=self.owner_nation, v=API_VERSION)
+        for _ in range(self.rate_limiter.max_retries + 1):
+            await asyncio.sleep(self.rate_limiter.reserve(dispatch_write))
+            try:
+                return await self.send(data)
+            except RateLimited as err:
+                logger.warning('Rate limited by NationStates')
+                self.rate_limiter.throttled(err.retry_after)
+
+        raise exceptions.RateLimitError
+
+    async def send(self, data):
+        """Send a request once.
+
+        Args:
+            data (dict): Request parameters
+
+        Returns:
+            tuple: Response headers and XML text
+        """
+
+        async with self.session.post(self.api_url, data=data,
+                                     headers=self.get_auth_headers()) as resp:
+            text = await resp.text()
+            status = resp.status
+            headers = resp.headers
+
+        self.rate_limiter.observe_headers(headers)
+
+        if status == 429:
+            retry_after = headers.get('X-Retry-After', headers.get('Retry-After'))
+            raise RateLimited(None if retry_after is None else float(retry_after))
+
+        if status == 403:
+            # Pin expired so log in again.
+            if self.pin is not None:
+                self.pin = None
+                return await self.send(data)
+            raise exceptions.NationLoginError
+
+        if status >= 400:
+            raise exceptions.DispatchAPIError('HTTP status {}'.format(status))
+
+        if 'X-Pin' in headers:
+            self.pin = headers['X-Pin']
+
+        return headers, text
+
+    async def login(self, nation_name, password=None, autologin=None):
+        """Get nation and test login.
+
+        Args:
+            nation_name (str): Nation name
+            password (str): Nation password
+            autologin (str): Nation X-Autologin
+
+        Returns:
+            str or None: X-Autologin or None if doesn't login via password
+        """
+
+        self.owner_nation = nation_name
+        self.password = password
+        self.autologin = autologin
+        self.pin = None
+
+        resp_headers, _ = await self.request({'q': 'ping'})
+
+        if password is not None:
+            if 'X-Autologin' not in resp_headers:
+                raise exceptions.NationLoginError
+
+            return resp_headers['X-Autologin']
+
+        return None
+
+    def resume_session(self, nation_name, autologin, pin):
+        """Use a cached login session without a login request.
+        Logs in with autologin again if the session has expired.
+
+        Args:
+            nation_name (str): Nation name
+            autologin (str): Nation X-Autologin
+            pin (str): Session pin
+        """
+
+        self.owner_nation = nation_name
+        self.password = None
+        self.autologin = autologin
+        self.pin = pin
+
+    def get_pin(self):
+        """Get pin of current login session.
+
+        Returns:
+            str|None: Session pin
+        """
+
+        return self.pin
+
+    async def dispatch_command(self, **kwargs):
+        """Run a dispatch command with its prepare and execute steps.
+
+        Returns:
+            str: Result text
+        """
+
+        for _ in range(self.rate_limiter.max_retries + 1):
+            try:
+                return await self.dispatch_command_once(**kwargs)
+            except DispatchTooRecent:
+                logger.warning('Dispatch writes throttled by NationStates')
+                self.rate_limiter.throttled(dispatch_write=True)
+            except RateLimited as err:
+                logger.warning('Rate limited by NationStates')
+                self.rate_limiter.throttled(err.retry_after)
+
+        raise exceptions.RateLimitError
+
+    async def dispatch_command_once(self, **kwargs):
+        """Run a dispatch command once.
+
+        Returns:
+            str: Result text
+        """
+
+        data = dict(kwargs, c='dispatch', mode='prepare')
+        _, text = await self.request(data, dispatch_write=True)
+        success, token = parse_response(text)
+        if not success:
+            if DISPATCH_TOO_RECENT in token:
+                raise DispatchTooRecent
+            raise_dispatch_error(token)
+
+        data.update(mode='execute', token=token)
+        # The rate limiter already counted this request with the prepare step.
+        _, text = await self.send(data)
+        success, result = parse_response(text)
+        if not success:
+            if DISPATCH_TOO_RECENT in result:
+                raise DispatchTooRecent
+            raise_dispatch_error(result)
+
+        self.rate_limiter.succeeded(dispatch_write=True)
+        return result
+
+    async def create_dispatch(self, title, text, category, subcategory):
+        """Create a dispatch.
+
+        Args:
+            title (str): Dispatch title
+            text (str): Dispatch text
+            category (str): Dispatch category number
+            subcategory (str): Dispatch subcategory number
+        Returns:
+            str: New dispatch ID
+        """
+
+        resp = await self.dispatch_command(dispatch='add', title=title, text=text,
+                                           category=category, subcategory=subcategory)
+
+        return re.search('id=(\\d+)', resp).group(1)
+
+    async def edit_dispatch(self, dispatch_id, title, text, category, subcategory):
+        """Edit a dispatch.
+
+        Args:
+            dispatch_id (str): Dispatch ID
+            title (str): Dispatch title
+            text (str): Dispatch text
+            category (str): Dispatch category number
+            subcategory (str): Dispatch subcategory number
+        """
+
+        await self.dispatch_command(dispatch='edit', dispatchid=dispatch_id, title=title,
+                                    text=text, category=category, subcategory=subcategory)
+
+    async def remove_dispatch(self, dispatch_id):
+        """Delete a dispatch.
+
+        Args:
+            dispatch_id (str): Dispatch ID
+        """
+
+        await self.dispatch_command(dispatch='remove', dispatchid=dispatch_id)
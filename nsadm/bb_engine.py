@@ -0,0 +1,558 @@
+"""BBCode engine for custom tags. Produces the same output as bbcode.Parser
+without HTML features, which NSCode output has no use for.
+"""
+
+import re
+import sys
+
+import bbcode
+
+
+TOKEN_TAG_START = 1
+TOKEN_TAG_END = 2
+TOKEN_NEWLINE = 3
+TOKEN_DATA = 4
+
+VALUE_PLACEHOLDER = '%(value)s'
+
+# Tag options of bbcode.Parser for HTML output. The engine always has them disabled.
+HTML_OPTIONS = ('escape_html', 'replace_links', 'replace_cosmetic')
+
+# Rest of a tag up to where its extent ends if it has no quotes
+PLAIN_EXTENT_PATTERN = re.compile(r'[^\[\]"\']*([\[\]])')
+# Characters that can end a tag extent or start a quoted option value
+EXTENT_CHAR_PATTERN = re.compile(r'[\[\]="\']')
+# Option value quote a tag extent could contain. Without one, every extent
+# ends at the next bracket.
+QUOTED_VALUE_PATTERN = re.compile(r'=[^\[\]]*["\']')
+
+
+def get_tag_extent(data, start):
+    """Find where a tag starting at a position ends, like bbcode.Parser._tag_extent.
+    A tag ends at its closer, or just before another opener outside quoted option values.
+
+    Args:
+        data (str): Text
+        start (int): Position of tag opener
+
+    Returns:
+        tuple: End position and whether the tag is closed
+    """
+
+    match = PLAIN_EXTENT_PATTERN.match(data, start + 1)
+    if match is not None:
+        if match.group(1) == ']':
+            return match.end(), True
+        return match.end() - 1, False
+
+    in_quote = False
+    quotable = False
+    pos = start + 1
+    while True:
+        match = EXTENT_CHAR_PATTERN.search(data, pos)
+        if match is None:
+            return len(data), False
+
+        i = match.start()
+        ch = data[i]
+        if ch == '=':
+            quotable = True
+        elif ch in ('"', "'"):
+            if quotable and not in_quote:
+                in_quote = ch
+            elif in_quote == ch:
+                in_quote = False
+                quotable = False
+        elif not in_quote:
+            if ch == '[':
+                return i, False
+            return i + 1, True
+        pos = i + 1
+
+
+def compile_tag_pattern(tag_names):
+    """Compile a pattern to find openers and closers of tags with any of the names.
+
+    Args:
+        tag_names (collections.abc.Iterable): Tag names
+
+    Returns:
+        re.Pattern: Pattern
+    """
+
+    names = sorted(tag_names, key=len, reverse=True)
+    return re.compile(r'\[\s*/?\s*(?:{})(?=[\s=\]])'.format(
+        '|'.join(re.escape(name) for name in names)), re.IGNORECASE)
+
+
+def parse_options(data):
+    """Parse tag name and options out of a tag, like bbcode.Parser._parse_opts.
+
+    Args:
+        data (str): Tag text without brackets
+
+    Returns:
+        tuple: Tag name and options
+    """
+
+    name = None
+    opts = bbcode.CaseInsensitiveDict()
+    in_value = False
+    in_quote = False
+    attr = ''
+    value = ''
+    attr_done = False
+    stripped = data.strip()
+    length = len(stripped)
+    pos = 0
+    while pos < length:
+        ch = stripped[pos]
+        if in_value:
+            if in_quote:
+                if ch == '\\' and length > pos + 1 and stripped[pos + 1] in ('\\', '"', "'"):
+                    value += stripped[pos + 1]
+                    pos += 1
+                elif ch == in_quote:
+                    in_quote = False
+                    in_value = False
+                    if attr:
+                        opts[attr] = value.strip()
+                    attr = ''
+                    value = ''
+                else:
+                    value += ch
+            else:
+                if ch in ('"', "'"):
+                    in_quote = ch
+                elif ch == ' ' and data.find('=', pos + 1) > 0:
+                    opts[attr] = value.strip()
+                    attr = ''
+                    value = ''
+                    in_value = False
+                else:
+                    value += ch
+        else:
+            if ch == '=':
+                in_value = True
+                if name is None:
+                    name = attr
+            elif ch == ' ':
+                attr_done = True
+            else:
+                if attr_done:
+                    if attr:
+                        if name is None:
+                            name = attr
+                        else:
+                            opts[attr] = ''
+                    attr = ''
+                    attr_done = False
+                attr += ch
+        pos += 1
+
+    if attr:
+        if name is None:
+            name = attr
+        opts[attr] = value.strip()
+
+    return name.lower(), opts
+
+
+def parse_tag(tag):
+    """Parse a tag, like bbcode.Parser._parse_tag.
+
+    Args:
+        tag (str): Tag text with brackets
+
+    Returns:
+        tuple: Whether tag is valid, tag name, whether it is a closing tag, and options
+    """
+
+    if '\n' in tag:
+        return False, tag, False, None
+
+    tag_name = tag[1:-1].strip()
+    if not tag_name:
+        return False, tag, False, None
+
+    closer = False
+    opts = {}
+    if tag_name[0] == '/':
+        tag_name = tag_name[1:]
+        closer = True
+    if not closer and ('=' in tag_name or ' ' in tag_name):
+        tag_name, opts = parse_options(tag_name)
+
+    return True, tag_name.strip().lower(), closer, opts
+
+
+def compile_simple_formatter(format_string):
+    """Make a render function of a simple formatter's format string.
+    Format strings with only the value placeholder are rendered by joining
+    instead of %-formatting an options dict on every call.
+
+    Args:
+        format_string (str): Format string
+
+    Returns:
+        func: Render function
+    """
+
+    parts = format_string.split(VALUE_PLACEHOLDER)
+    if not any('%' in part for part in parts):
+        def render_value(tag_name, value, options, parent, context):
+            return str(value).join(parts)
+
+        return render_value
+
+    def render(tag_name, value, options, parent, context):
+        fmt = {}
+        if options:
+            fmt.update(options)
+        fmt['value'] = value
+        return format_string % fmt
+
+    return render
+
+
+def tokenize_text(data, tokens):
+    """Add data and newline tokens of tag-free text.
+
+    Args:
+        data (str): Text
+        tokens (list): Tokens to add to
+    """
+
+    if '\n' not in data:
+        if data:
+            tokens.append((TOKEN_DATA, None, None, data))
+        return
+
+    lines = data.split('\n')
+    last = len(lines) - 1
+    for num, line in enumerate(lines):
+        if line:
+            tokens.append((TOKEN_DATA, None, None, line))
+        if num < last:
+            tokens.append((TOKEN_NEWLINE, None, None, '\n'))
+
+
+class BBEngine():
+    """BBCode engine with the formatter interface of bbcode.Parser.
+    Tags are found with one pattern of all registered tag names,
+    so unknown tags such as NSCode ones pass through as text.
+    Formatters get the context mapping by reference.
+
+    Args:
+        newline (str): Text to replace newlines with
+        profiler (nsadm.profiler.RenderProfiler): Profiler to record formatter calls in
+    """
+
+    def __init__(self, newline='\n', profiler=None):
+        self.newline = newline
+        self.profiler = profiler
+        self.max_tag_depth = sys.getrecursionlimit()
+        # Tag name and its render function and tag options
+        self.recognized_tags = {}
+        # Pattern of openers of registered tags. Built on first format.
+        self.tag_pattern = None
+
+    def add_formatter(self, tag_name, render_func, **kwargs):
+        """Add a formatter.
+
+        Args:
+            tag_name (str): Tag name
+            render_func (func): Render function
+
+        Raises:
+            ValueError: HTML tag option is enabled
+        """
+
+        for option in HTML_OPTIONS:
+            if kwargs.get(option, False):
+                raise ValueError('Tag option "{}" is not supported'.format(option))
+
+        if self.profiler is not None:
+            render_func = self.profiler.wrap('bbcode', tag_name, render_func)
+
+        kwargs.update(dict.fromkeys(HTML_OPTIONS, False))
+        options = bbcode.TagOptions(tag_name.strip().lower(), **kwargs)
+        self.recognized_tags[options.tag_name] = (render_func, options)
+        self.tag_pattern = None
+
+    def add_simple_formatter(self, tag_name, format_string, **kwargs):
+        """Add a simple formatter.
+
+        Args:
+            tag_name (str): Tag name
+            format_string (str): Format string with %(value)s and option placeholders
+        """
+
+        self.add_formatter(tag_name, compile_simple_formatter(format_string), **kwargs)
+
+    def get_tag_pattern(self):
+        """Get pattern to find openers of tags that may be registered ones.
+
+        Returns:
+            re.Pattern|None: Pattern or None if no tag is registered
+        """
+
+        if self.tag_pattern is None and self.recognized_tags:
+            self.tag_pattern = compile_tag_pattern(self.recognized_tags)
+
+        return self.tag_pattern
+
+    def tokenize(self, data, start=0):
+        """Tokenize text into the same tokens as bbcode.Parser.tokenize,
+        except that adjacent text is kept in one data token.
+
+        Args:
+            data (str): Text
+            start (int): Position of the first tag that may be registered.
+            Text before it is not scanned unless a tag there could extend past it.
+
+        Returns:
+            list: Tokens
+        """
+
+        tag_pattern = self.get_tag_pattern()
+        tokens = []
+        if tag_pattern is None:
+            tokenize_text(data, tokens)
+            return tokens
+
+        # Start of text not yet tokenized
+        text_start = 0
+        pos = 0
+        if start > 0 and QUOTED_VALUE_PATTERN.search(data, 0, start) is None:
+            pos = start
+        while True:
+            start = data.find('[', pos)
+            if start < 0:
+                break
+
+            end, found_close = get_tag_extent(data, start)
+            if found_close and tag_pattern.match(data, start) is not None:
+                valid, tag_name, closer, opts = parse_tag(data[start:end])
+                if valid and tag_name in self.recognized_tags:
+                    tokenize_text(data[text_start:start], tokens)
+                    if closer:
+                        tokens.append((TOKEN_TAG_END, tag_name, None, data[start:end]))
+                    else:
+                        tokens.append((TOKEN_TAG_START, tag_name, opts, data[start:end]))
+                    text_start = end
+            pos = end
+
+        tokenize_text(data[text_start:], tokens)
+        return tokens
+
+    def find_closing_token(self, tag, tokens, pos):
+        """Find the token closing a tag, like bbcode.Parser._find_closing_token.
+
+        Args:
+            tag (bbcode.TagOptions): Tag options
+            tokens (list): Tokens
+            pos (int): Position of token after the opening tag
+
+        Returns:
+            tuple: Position of closing token and whether to consume it
+        """
+
+        embed_count = 0
+        block_count = 0
+        token_count = len(tokens)
+        while pos < token_count:
+            token_type, tag_name, _, _ = tokens[pos]
+            if token_type == TOKEN_DATA:
+                pos += 1
+                continue
+
+            if tag.newline_closes and token_type in (TOKEN_TAG_START, TOKEN_TAG_END):
+                inner_tag = self.recognized_tags[tag_name][1]
+                if not inner_tag.transform_newlines:
+                    if token_type == TOKEN_TAG_START:
+                        block_count += 1
+                    else:
+                        block_count -= 1
+
+            if token_type == TOKEN_NEWLINE and tag.newline_closes and block_count == 0:
+                return pos, True
+            elif token_type == TOKEN_TAG_START and tag_name == tag.tag_name:
+                if tag.same_tag_closes:
+                    return pos, False
+                if tag.render_embedded:
+                    embed_count += 1
+            elif token_type == TOKEN_TAG_END and tag_name == tag.tag_name:
+                if embed_count > 0:
+                    embed_count -= 1
+                else:
+                    return pos, True
+            pos += 1
+
+        return pos, True
+
+    def format_tokens(self, tokens, parent, context, depth=1):
+        """Render tokens, like bbcode.Parser._format_tokens.
+        Newlines to transform are marked with carriage returns.
+
+        Args:
+            tokens (list): Tokens
+            parent (bbcode.TagOptions): Options of the enclosing tag or None at top level
+            context (collections.abc.Mapping): Context for formatters
+            depth (int): Tag nesting depth
+
+        Returns:
+            str: Rendered text
+        """
+
+        formatted = []
+        idx = 0
+        token_count = len(tokens)
+        while idx < token_count:
+            token_type, tag_name, tag_opts, token_text = tokens[idx]
+            if token_type == TOKEN_DATA:
+                formatted.append(token_text)
+            elif token_type == TOKEN_NEWLINE:
+                formatted.append('\r' if parent is None or parent.transform_newlines else token_text)
+            elif token_type == TOKEN_TAG_START:
+                render_func, tag = self.recognized_tags[tag_name]
+                if tag.standalone:
+                    formatted.append(render_func(tag_name, None, tag_opts, parent, context))
+                else:
+                    end, consume = self.find_closing_token(tag, tokens, idx + 1)
+                    subtokens = tokens[idx + 1:end]
+                    if not consume:
+                        end = end - 1
+
+                    if tag.render_embedded and depth < self.max_tag_depth:
+                        inner = self.format_tokens(subtokens, tag, context, depth + 1)
+                    else:
+                        inner = ''.join([token[3] for token in subtokens])
+                        if tag.transform_newlines:
+                            inner = inner.replace('\n', '\r')
+
+                    if tag.strip:
+                        inner = inner.strip()
+
+                    formatted.append(render_func(tag_name, inner, tag_opts, parent, context))
+
+                    if tag.swallow_trailing_newline:
+                        next_pos = end + 1
+                        if next_pos < token_count and tokens[next_pos][0] == TOKEN_NEWLINE:
+                            end = next_pos
+                    idx = end
+            idx += 1
+
+        return ''.join(formatted)
+
+    def get_top_level_ends(self, tokens):
+        """Get where each top-level piece of tokens ends. Pieces are formatted
+        by format_tokens without looking at tokens outside of them.
+
+        Args:
+            tokens (list): Tokens
+
+        Returns:
+            list: End positions (exclusive)
+        """
+
+        ends = []
+        idx = 0
+        token_count = len(tokens)
+        while idx < token_count:
+            token_type, tag_name, _, _ = tokens[idx]
+            if token_type == TOKEN_TAG_START:
+                tag = self.recognized_tags[tag_name][1]
+                if not tag.standalone:
+                    end, consume = self.find_closing_token(tag, tokens, idx + 1)
+                    if not consume:
+                        end = end - 1
+                    if tag.swallow_trailing_newline:
+                        next_pos = end + 1
+                        if next_pos < token_count and tokens[next_pos][0] == TOKEN_NEWLINE:
+                            end = next_pos
+                    idx = end
+            idx += 1
+            ends.append(min(idx, token_count))
+
+        return ends
+
+    def split_tokens(self, tokens, count):
+        """Split tokens at top-level boundaries into segments of about the same text length.
+        Formatting each segment with format_segment and joining the results
+        is the same as formatting all tokens.
+
+        Args:
+            tokens (list): Tokens
+            count (int): Maximum number of segments
+
+        Returns:
+            list: Token lists
+        """
+
+        segment_size = sum(len(token[3]) for token in tokens) / count
+        segments = []
+        start = 0
+        pos = 0
+        size = 0
+        for end in self.get_top_level_ends(tokens):
+            for token in tokens[pos:end]:
+                size += len(token[3])
+            pos = end
+            if size >= segment_size and len(segments) < count - 1:
+                segments.append(tokens[start:end])
+                start = end
+                size = 0
+        if start < len(tokens):
+            segments.append(tokens[start:])
+
+        return segments
+
+    def format_segment(self, tokens, context):
+        """Format a top-level segment of tokens.
+
+        Args:
+            tokens (list): Tokens
+            context (collections.abc.Mapping): Context for formatters
+
+        Returns:
+            str: Formatted text
+        """
+
+        formatted = self.format_tokens(tokens, None, context)
+        if '\r' in formatted:
+            formatted = formatted.replace('\r', self.newline)
+        return formatted
+
+    def format_with_context(self, data, context, start=0):
+        """Format text and give formatters a context mapping.
+
+        Args:
+            data (str): Text to format
+            context (collections.abc.Mapping): Context for formatters
+            start (int): Position of the first tag that may be registered in text
+            with normalized newlines
+
+        Returns:
+            str: Formatted text
+        """
+
+        if '\r' in data:
+            data = data.replace('\r\n', '\n').replace('\r', '\n')
+            start = 0
+        formatted = self.format_tokens(self.tokenize(data, start), None, context)
+        if '\r' in formatted:
+            formatted = formatted.replace('\r', self.newline)
+        return formatted
+
+    def format(self, data, **context):
+        """Format text.
+
+        Args:
+            data (str): Text to format
+
+        Returns:
+            str: Formatted text
+        """
+
+        return self.format_with_context(data, context)
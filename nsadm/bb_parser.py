@@ -1,26 +1,55 @@
 """Parse BBCode tags.
 """
 
+import concurrent.futures
+import hashlib
 import logging
+import os
+import pickle
+import threading
 
 import toml
 import bbcode
 
+from nsadm import bb_engine
+from nsadm import filter_cache
+from nsadm import fragment_cache
 from nsadm import utils
 
 
+# BBCode engine names. "nsadm" is nsadm.bb_engine and "bbcode" is the bbcode library.
+ENGINES = ('nsadm', 'bbcode')
+DEFAULT_ENGINE = 'nsadm'
+
+OUTPUT_CACHE_DIRNAME = 'bbcode_cache'
+
+# Minimum text length in characters to format in parallel
+DEFAULT_PARALLEL_MIN_SIZE = 100000
+
+
 logger = logging.getLogger(__name__)
 
 
 class BBRegistry():
-    """Complex formatter registry.
+    """Complex formatter registry. Formatters are created once per formatter file
+    and config and reused by every parser that loads them from the same registry.
     """
 
+    # Formatters registered by the complex formatter file being loaded
     complex_formatters = []
+    # Lock for loading complex formatter files since registration is class-level
+    load_lock = threading.Lock()
+
+    def __init__(self):
+        # Initialized formatters by formatter file path, file version and config hash
+        self.formatters = {}
+        self.lock = threading.Lock()
 
     @classmethod
     def register(cls, tag_name, **kwargs):
-        """[summary]
+        """Register a complex formatter class.
+        Options are those of simple formatters, plus cacheable=True to memoize results
+        and context_keys=[...] to name context values the results depend on.
 
         Args:
             tag_name (str): Tag name.
@@ -36,23 +65,57 @@ class BBRegistry():
 
         return decorator
 
-    @classmethod
-    def init_complex_formatters(cls, path, config):
+    def init_complex_formatters(self, path, config):
         """Initialize complex formatters and give them config.
+        Formatters already initialized from the same file and config are reused.
 
         Args:
             path (str): Path to complex formatter file.
             config (dict): Complex formatter config.
+
+        Returns:
+            list: Formatters. Each one is a new dict so callers can change them.
         """
 
         try:
-            utils.load_module(path)
-            logger.debug('Loaded complex formatter file at "%s"', path)
-        except FileNotFoundError as err:
-            raise FileNotFoundError('Could not find complex formatter file at "{}"'.format(path)) from err
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        key = (os.path.abspath(path), stat and (stat.st_mtime_ns, stat.st_size),
+               utils.get_data_hash(config))
+
+        with self.lock:
+            if key not in self.formatters:
+                self.formatters[key] = self.load_complex_formatters(path, config)
+            else:
+                logger.debug('Reused complex formatters from "%s"', path)
+
+            return [dict(formatter) for formatter in self.formatters[key]]
+
+    @classmethod
+    def load_complex_formatters(cls, path, config):
+        """Load complex formatter file and initialize its formatters.
+
+        Args:
+            path (str): Path to complex formatter file.
+            config (dict): Complex formatter config.
+
+        Returns:
+            list: Formatters
+        """
+
+        with cls.load_lock:
+            try:
+                utils.load_module(path)
+                logger.debug('Loaded complex formatter file at "%s"', path)
+            except FileNotFoundError as err:
+                raise FileNotFoundError('Could not find complex formatter file at "{}"'.format(path)) from err
+            finally:
+                registered = cls.complex_formatters
+                cls.complex_formatters = []
 
         inited_formatters = []
-        for formatter in cls.complex_formatters:
+        for formatter in registered:
             tag_name = formatter['tag_name']
             if tag_name in config:
                 formatter['obj'].config = config[tag_name]
@@ -62,10 +125,13 @@ class BBRegistry():
             inited_formatters.append(formatter)
             logger.debug('Loaded complex formatter "%s"', tag_name)
 
-        cls.complex_formatters = []
         return inited_formatters
 
 
+# Registry shared by parsers in this process
+default_registry = BBRegistry()
+
+
 class BBFormatters():
     """Abstract class for formatter managers.
     """
@@ -110,15 +176,20 @@ class BBSimpleFormatters(BBFormatters):
 
 class BBComplexFormatters(BBFormatters):
     """Manager for complex formatters.
-
-    Args:
-        bb_registry (BBRegistry): BBCode complex formatter registry.
+    Pickling keeps only the formatter file path and config.
+    Unpickling initializes the formatters again from the default registry of the process.
     """
 
+    def __init__(self):
+        super().__init__()
+        self.load_path = None
+        self.config = {}
+
     def load_formatters(self, bb_registry, load_path, config_path):
         """Load complex formatters.
 
         Args:
+            bb_registry (BBRegistry): BBCode complex formatter registry.
             load_path (str): File path to load complex formatters from.
             config_path (str): Path to complex formatter config file.
         """
@@ -133,28 +204,131 @@ class BBComplexFormatters(BBFormatters):
             except FileNotFoundError:
                 logger.error('Complex formatter config file not found at "%s"', config_path)
 
+        self.init_formatters(bb_registry, load_path, config)
+
+    def init_formatters(self, bb_registry, load_path, config):
+        """Initialize complex formatters with loaded config.
+
+        Args:
+            bb_registry (BBRegistry): BBCode complex formatter registry.
+            load_path (str): File path to load complex formatters from.
+            config (dict): Complex formatter config.
+        """
+
+        self.load_path = load_path
+        self.config = config
         formatters = bb_registry.init_complex_formatters(load_path, config)
 
         for formatter in formatters:
-            render_func = formatter.pop('obj').format
-            formatter['func'] = render_func
+            formatter['func'] = formatter['obj'].format
             self.formatters.append(formatter)
 
+    def __getstate__(self):
+        return {'load_path': self.load_path, 'config': self.config}
+
+    def __setstate__(self, state):
+        self.__init__()
+        if state['load_path'] is not None:
+            self.init_formatters(default_registry, state['load_path'], state['config'])
+
+
+class ContextParser(bbcode.Parser):
+    """BBCode parser that can give formatters one context mapping by reference.
+    bbcode.Parser rebuilds its context from keyword arguments for every tag and text token.
+    """
+
+    def __init__(self, profiler=None, **kwargs):
+        super().__init__(**kwargs)
+        # Context of the render running on each thread
+        self.local = threading.local()
+        self.profiler = profiler
+
+    def add_formatter(self, tag_name, render_func, **kwargs):
+        if self.profiler is not None:
+            render_func = self.profiler.wrap('bbcode', tag_name, render_func)
+
+        def render_with_context(name, value, options, parent, context):
+            context = getattr(self.local, 'context', context)
+            return render_func(name, value, options, parent, context)
+
+        super().add_formatter(tag_name, render_with_context, **kwargs)
+
+    def format_with_context(self, data, context, start=0):
+        """Format text and give formatters a context mapping.
+
+        Args:
+            data (str): Text to format
+            context (collections.abc.Mapping): Context for formatters
+            start (int): Position of the first tag that may be registered.
+            Unused since bbcode.Parser always tokenizes the whole text.
+
+        Returns:
+            str: Formatted text
+        """
+
+        self.local.context = context
+        try:
+            return self.format(data)
+        finally:
+            del self.local.context
+
+
+class TagPrefilter():
+    """Find the first tag that may be a registered one
+    to skip the parser for text without any.
+
+    Args:
+        tag_names (collections.abc.Iterable): Registered tag names
+    """
+
+    def __init__(self, tag_names):
+        tag_names = list(tag_names)
+        self.tag_pattern = bb_engine.compile_tag_pattern(tag_names) if tag_names else None
+
+    def find(self, text):
+        """Find the position of the first tag that may be a registered one.
+
+        Args:
+            text (str): Text with normalized newlines
+
+        Returns:
+            int: Position or -1 if there is no such tag
+        """
+
+        if self.tag_pattern is None:
+            return -1
+
+        match = self.tag_pattern.search(text)
+        if match is None:
+            return -1
+
+        return match.start()
+
 
 class BBParserAdapter():
-    """Adapter for third-party BBCode parser.
+    """Adapter for BBCode engines.
 
        Args:
-            bb_config (dict): BBCode formatter configuration.
-            custom_vars (dict): Custom variables to pass to formatters.
+            profiler (nsadm.profiler.RenderProfiler): Profiler to record formatter calls in.
+            engine (str): BBCode engine name
     """
 
-    def __init__(self):
-        self.parser = bbcode.Parser(newline='\n',
-                                    install_defaults=False,
-                                    escape_html=False,
-                                    replace_links=False,
-                                    replace_cosmetic=False)
+    def __init__(self, profiler=None, engine=DEFAULT_ENGINE):
+        if engine == 'nsadm':
+            self.parser = bb_engine.BBEngine(newline='\n', profiler=profiler)
+        elif engine == 'bbcode':
+            self.parser = ContextParser(profiler=profiler,
+                                        newline='\n',
+                                        install_defaults=False,
+                                        escape_html=False,
+                                        replace_links=False,
+                                        replace_cosmetic=False)
+        else:
+            raise ValueError('Unknown BBCode engine "{}". Choose from: {}'.format(
+                engine, ', '.join(ENGINES)))
+
+        # Set by BBParserLoader after all formatters are added
+        self.prefilter = None
 
     def add_simple_formatter(self, tag_name, template, **kwargs):
         """Add a simple formatter.
@@ -190,18 +364,199 @@ class BBParserAdapter():
             str: Formatted text
         """
 
+        if self.prefilter is not None:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+            if self.prefilter.find(text) == -1:
+                return text
+
         return self.parser.format(text, **kwargs)
 
+    def has_tags(self, text):
+        """Tell whether text may have a registered tag.
+        Formatting returns text without any as it is apart from newlines.
+
+        Args:
+            text (str): Text
+
+        Returns:
+            bool
+        """
+
+        return self.prefilter is None or self.prefilter.find(text) != -1
+
+    def format_with_context(self, text, context):
+        """Call parser to format with a context mapping shared by reference.
+
+        Args:
+            text (str): Text to format
+            context (collections.abc.Mapping): Context for formatters
+
+        Returns:
+            str: Formatted text
+        """
+
+        if self.prefilter is None:
+            return self.parser.format_with_context(text, context)
+
+        # Parsers turn every newline into "\n" even in text without tags.
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        start = self.prefilter.find(text)
+        if start == -1:
+            return text
+
+        return self.parser.format_with_context(text, context, start)
+
+    def split(self, text, count):
+        """Split text into token segments that can be formatted separately.
+        Only the nsadm engine can split text.
+
+        Args:
+            text (str): Text to format
+            count (int): Maximum number of segments
+
+        Returns:
+            list|None: Token lists or None if text cannot be split
+        """
+
+        if not isinstance(self.parser, bb_engine.BBEngine):
+            return None
+
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        start = 0
+        if self.prefilter is not None:
+            start = self.prefilter.find(text)
+            if start == -1:
+                return None
+
+        return self.parser.split_tokens(self.parser.tokenize(text, start), count)
+
+    def format_segment(self, tokens, context):
+        """Format a token segment made by split.
+
+        Args:
+            tokens (list): Tokens
+            context (collections.abc.Mapping): Context for formatters
+
+        Returns:
+            str: Formatted text
+        """
+
+        return self.parser.format_segment(tokens, context)
+
+
+class BBOutputCache():
+    """Disk cache of formatted texts keyed by their content,
+    with least recently used ones evicted over a maximum size.
+
+    Args:
+        directory (str): Cache directory
+        max_size (int): Maximum total size in bytes of cached texts
+    """
+
+    def __init__(self, directory, max_size=fragment_cache.DEFAULT_MAX_SIZE):
+        self.store = fragment_cache.FragmentCache(directory, max_size)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(text, fingerprint):
+        """Get cache key of a text.
+
+        Args:
+            text (str): Text to format
+            fingerprint (str): Hash of everything else formatting depends on
+
+        Returns:
+            str: Key
+        """
+
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return '{}:{}'.format(fingerprint, text_hash)
+
+    def get(self, key):
+        """Get a formatted text.
+
+        Args:
+            key (str): Key
+
+        Returns:
+            str|None: Formatted text or None if not cached
+        """
+
+        formatted = self.store.get(key)
+        with self.lock:
+            if formatted is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return formatted
+
+    def set(self, key, formatted):
+        """Cache a formatted text.
+
+        Args:
+            key (str): Key
+            formatted (str): Formatted text
+        """
+
+        self.store.set(key, formatted)
+
+    def log_stats(self):
+        """Log hit rate.
+        """
+
+        with self.lock:
+            total = self.hits + self.misses
+            if total:
+                logger.info('BBCode output cache: %d/%d hits (%.0f%%)',
+                            self.hits, total, self.hits / total * 100)
+
+
+def cache_formatter(render_func, name, context_keys, cache):
+    """Memoize a complex formatter render function.
+
+    Args:
+        render_func (func): Render function
+        name (str): Registered tag name
+        context_keys (list): Keys of context values the formatter depends on
+        cache (nsadm.filter_cache.FilterCache): Cache to keep results in
+
+    Returns:
+        func: Memoized render function
+    """
+
+    context_keys = tuple(context_keys)
+
+    def cached_render_func(tag_name, value, options, parent, context):
+        key = filter_cache.make_key(name, (tag_name, value,
+                                           tuple(sorted(options.items())) if options else None,
+                                           parent.tag_name if parent is not None else None,
+                                           tuple(context.get(key) for key in context_keys)), {})
+        if key is None:
+            return render_func(tag_name, value, options, parent, context)
+        try:
+            return cache.get(key)
+        except KeyError:
+            formatted = render_func(tag_name, value, options, parent, context)
+            cache.set(key, formatted)
+            return formatted
+
+    return cached_render_func
+
 
 class BBParserLoader():
     """Load BBCode parser with formatters.
 
         Args:
             parser (BBParserCore): BBCode parser adapter.
+            formatter_cache (nsadm.filter_cache.FilterCache): Cache for results of
+            formatters registered with cacheable=True. None disables it.
     """
 
-    def __init__(self, parser):
+    def __init__(self, parser, formatter_cache=None):
         self.parser = parser
+        self.formatter_cache = formatter_cache
 
     def load_parser(self, simple_formatters, complex_formatters):
         """Load and get loaded parser,
@@ -215,16 +570,21 @@ class BBParserLoader():
         """
 
 
-        self.load_simple_formatters(simple_formatters)
-        self.load_complex_formatters(complex_formatters)
+        tag_names = self.load_simple_formatters(simple_formatters)
+        tag_names += self.load_complex_formatters(complex_formatters)
+        self.parser.prefilter = TagPrefilter(tag_names)
         logger.info('Loaded all BBCode formatters')
 
         return self.parser
 
     def load_simple_formatters(self, simple_formatters):
         """Load all simple formatters into parser.
+
+        Returns:
+            list: Names of loaded tags
         """
 
+        tag_names = []
         for formatter in simple_formatters.get_formatters():
             if 'template' not in formatter:
                 logger.error("Simple formatter '%s' doesn't have template", formatter['tag_name'])
@@ -243,16 +603,28 @@ class BBParserLoader():
                 strip=formatter.get('strip', False),
                 swallow_trailing_newline=formatter.get('swallow_trailing_newline', False))
 
+            tag_names.append(formatter['tag_name'])
             logger.debug('Loaded simple BBCode formatter: %r', formatter)
 
+        return tag_names
+
     def load_complex_formatters(self, complex_formatters):
         """Load all complex formatters into parser.
+
+        Returns:
+            list: Names of loaded tags
         """
 
+        tag_names = []
         for formatter in complex_formatters.get_formatters():
+            render_func = formatter['func']
+            if formatter.get('cacheable', False) and self.formatter_cache is not None:
+                render_func = cache_formatter(render_func, formatter['tag_name'],
+                                              formatter.get('context_keys', []), self.formatter_cache)
+
             self.parser.add_complex_formatter(
                 tag_name=formatter['tag_name'],
-                render_func=formatter['func'],
+                render_func=render_func,
                 escape_html=False,
                 replace_links=False,
                 replace_cosmetic=False,
@@ -262,8 +634,48 @@ class BBParserLoader():
                 render_embedded=formatter.get('render_embedded', True),
                 strip=formatter.get('strip', False),
                 swallow_trailing_newline=formatter.get('swallow_trailing_newline', False))
+            tag_names.append(formatter['tag_name'])
             logger.debug('Loaded complex formatter "%s"', formatter['tag_name'])
 
+        return tag_names
+
+
+# Parser of this format worker process
+_worker_parser = None
+
+
+def init_format_worker(simple_formatter_path, complex_formatter_path,
+                       complex_formatter_config_path, formatter_cache_size):
+    """Build and load a BBCode parser in a format worker process.
+
+    Args:
+        simple_formatter_path (str): Simple formatter file path
+        complex_formatter_path (str): Complex formatter file path
+        complex_formatter_config_path (str): Complex formatter config file path
+        formatter_cache_size (int): Maximum number of cached results of cacheable complex formatters
+    """
+
+    global _worker_parser
+
+    _worker_parser = BBParser(simple_formatter_path, complex_formatter_path,
+                              complex_formatter_config_path, engine='nsadm',
+                              formatter_cache_size=formatter_cache_size)
+    _worker_parser.load_formatters()
+
+
+def format_in_worker(tokens, context_data):
+    """Format a token segment with this worker process's parser.
+
+    Args:
+        tokens (list): Tokens
+        context_data (bytes): Pickled context for formatters
+
+    Returns:
+        str: Formatted text
+    """
+
+    return _worker_parser.parser.format_segment(tokens, pickle.loads(context_data))
+
 
 class BBParser():
     """Render NSCode tags from custom BBCode tags.
@@ -272,18 +684,53 @@ class BBParser():
         simple_formatter_path (str): Simple formatter file path
         complex_formatter_path (str): Complex formatter file path
         complex_formatter_config_path (str): Complex formatter config file path
+        profiler (nsadm.profiler.RenderProfiler): Profiler to record formatter calls in
+        engine (str): BBCode engine name
+        cache_path (str): Directory to cache formatted texts in. None disables the cache.
+        cache_size (int): Maximum total size in bytes of cached texts
+        registry (BBRegistry): Complex formatter registry. Defaults to the one shared in the process.
+        formatter_cache_size (int): Maximum number of cached results of cacheable complex formatters
+        parallel_workers (int): Number of worker processes to format long texts in.
+        0 or 1 formats every text in the calling thread. Ignored while profiling.
+        parallel_min_size (int): Minimum text length in characters to format in parallel
     """
 
     def __init__(self, simple_formatter_path,
                  complex_formatter_path,
-                 complex_formatter_config_path):
+                 complex_formatter_config_path,
+                 profiler=None,
+                 engine=DEFAULT_ENGINE,
+                 cache_path=None,
+                 cache_size=fragment_cache.DEFAULT_MAX_SIZE,
+                 registry=None,
+                 formatter_cache_size=filter_cache.DEFAULT_MAX_SIZE,
+                 parallel_workers=0,
+                 parallel_min_size=DEFAULT_PARALLEL_MIN_SIZE):
         self.simple_formatter_path = simple_formatter_path
         self.complex_formatter_path = complex_formatter_path
         self.complex_formatter_config_path = complex_formatter_config_path
 
-        self.parser = BBParserAdapter()
+        self.cache = None
+        if cache_path:
+            self.cache = BBOutputCache(cache_path, cache_size)
+        # Hash of formatter files
+        self.formatter_hash = None
+        # Results of complex formatters registered with cacheable=True
+        self.formatter_cache = filter_cache.FilterCache(formatter_cache_size)
+
+        if profiler is not None and parallel_workers > 1:
+            logger.info('Parallel BBCode formatting is disabled while profiling '
+                        'to profile all formatters.')
+            parallel_workers = 0
+        self.parallel_workers = parallel_workers
+        self.parallel_min_size = parallel_min_size
+        # Format worker processes, started on first use
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+        self.parser = BBParserAdapter(profiler, engine)
         self.simple_formatters = BBSimpleFormatters()
-        self.registry = BBRegistry()
+        self.registry = default_registry if registry is None else registry
         self.complex_formatters = BBComplexFormatters()
 
     def load_formatters(self):
@@ -294,8 +741,21 @@ class BBParser():
         self.complex_formatters.load_formatters(self.registry, self.complex_formatter_path,
                                                 self.complex_formatter_config_path)
 
-        loader = BBParserLoader(self.parser)
+        loader = BBParserLoader(self.parser, self.formatter_cache)
         self.parser = loader.load_parser(self.simple_formatters, self.complex_formatters)
+        self.formatter_hash = utils.get_files_hash([self.simple_formatter_path,
+                                                    self.complex_formatter_path,
+                                                    self.complex_formatter_config_path])
+
+    def log_formatter_cache_stats(self):
+        """Log hit and miss counts of cacheable complex formatters.
+        """
+
+        with self.formatter_cache.lock:
+            stats = sorted(self.formatter_cache.stats.items())
+        for tag_name, tag_stats in stats:
+            logger.debug('Complex formatter cache of "%s": %d hits, %d misses',
+                         tag_name, tag_stats['hits'], tag_stats['misses'])
 
     def format(self, text, **kwargs):
         """Format BBCode text.
@@ -305,3 +765,99 @@ class BBParser():
         """
 
         return self.parser.format(text=text, **kwargs)
+
+    def format_with_context(self, text, context, context_hash=None):
+        """Format BBCode text with a context mapping shared by reference.
+        Formatted texts are cached if the cache is enabled and a context hash is given.
+
+        Args:
+            text (str): Text
+            context (collections.abc.Mapping): Context for formatters
+            context_hash (str): Hash of the context since formatters may read it
+        """
+
+        # Text without tags is not hashed, cached or split, so it is not copied.
+        if self.cache is None or context_hash is None or not self.parser.has_tags(text):
+            return self.format_text(text, context)
+
+        key = self.cache.get_key(text, '{}:{}'.format(self.formatter_hash, context_hash))
+        formatted = self.cache.get(key)
+        if formatted is None:
+            formatted = self.format_text(text, context)
+            self.cache.set(key, formatted)
+        return formatted
+
+    def format_text(self, text, context):
+        """Format BBCode text, in parallel if it is long enough.
+
+        Args:
+            text (str): Text
+            context (collections.abc.Mapping): Context for formatters
+
+        Returns:
+            str: Formatted text
+        """
+
+        if (self.parallel_workers > 1 and len(text) >= self.parallel_min_size
+                and self.parser.has_tags(text)):
+            formatted = self.format_parallel(text, context)
+            if formatted is not None:
+                return formatted
+
+        return self.parser.format_with_context(text, context)
+
+    def format_parallel(self, text, context):
+        """Format top-level segments of text in worker processes and join them.
+
+        Args:
+            text (str): Text
+            context (collections.abc.Mapping): Context for formatters
+
+        Returns:
+            str|None: Formatted text or None if text cannot be formatted in parallel
+        """
+
+        segments = self.parser.split(text, self.parallel_workers)
+        if segments is None:
+            logger.debug('BBCode text can only be formatted in parallel by the nsadm engine')
+            return None
+        if len(segments) < 2:
+            return None
+
+        try:
+            # Pickle once instead of for every segment
+            context_data = pickle.dumps(dict(context))
+        except (pickle.PicklingError, TypeError, AttributeError) as err:
+            logger.warning('Could not format BBCode in parallel since the context '
+                           'cannot be pickled: %s', err)
+            return None
+
+        pool = self.get_pool()
+        futures = [pool.submit(format_in_worker, segment, context_data) for segment in segments]
+        logger.debug('Formatting BBCode text in %d segments', len(futures))
+        return ''.join(future.result() for future in futures)
+
+    def get_pool(self):
+        """Get format worker processes and start them if needed.
+
+        Returns:
+            concurrent.futures.ProcessPoolExecutor: Worker pool
+        """
+
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.parallel_workers,
+                    initializer=init_format_worker,
+                    initargs=(self.simple_formatter_path, self.complex_formatter_path,
+                              self.complex_formatter_config_path, self.formatter_cache.max_size))
+            return self.pool
+
+    def close(self):
+        """Stop format worker processes.
+        """
+
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
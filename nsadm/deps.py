@@ -0,0 +1,76 @@
+"""Track render inputs of dispatches to only rebuild dispatches whose inputs changed.
+"""
+
+import json
+import logging
+import pathlib
+
+
+DEPS_FILENAME = 'dispatch_deps.json'
+
+
+logger = logging.getLogger(__name__)
+
+
+class DependencyStore():
+    """Store input hashes of the last successfully pushed render of dispatches.
+
+    Args:
+        path (str): Path to store file
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.input_hashes = {}
+        self.saved = True
+
+    def load(self):
+        """Load input hashes from file.
+        """
+
+        try:
+            with open(self.path) as f:
+                self.input_hashes = json.load(f)
+                logger.debug('Loaded dependency store: %r', self.input_hashes)
+        except FileNotFoundError:
+            pass
+
+    def is_unchanged(self, name, input_hash):
+        """Check if a dispatch has the same inputs as its last pushed render.
+
+        Args:
+            name (str): Dispatch name
+            input_hash (str|None): Hash of current inputs
+
+        Returns:
+            bool
+        """
+
+        return input_hash is not None and self.input_hashes.get(name) == input_hash
+
+    def set_input_hash(self, name, input_hash):
+        """Record input hash of a pushed dispatch.
+
+        Args:
+            name (str): Dispatch name
+            input_hash (str|None): Input hash. None forgets the dispatch.
+        """
+
+        if input_hash is None:
+            self.input_hashes.pop(name, None)
+        else:
+            self.input_hashes[name] = input_hash
+        self.saved = False
+
+    def save(self):
+        """Save input hashes into file.
+        """
+
+        if self.saved:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.input_hashes, f)
+        self.saved = True
+        logger.debug('Saved dependency store: %r', self.input_hashes)
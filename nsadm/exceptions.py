@@ -45,6 +45,11 @@ class NationLoginError(DispatchAPIError):
     """
 
 
+class RateLimitError(DispatchAPIError):
+    """Still rate limited by NationStates after retrying.
+    """
+
+
 class DispatchUpdatingError(NSADMError):
     """Dispatch update error.
     """
@@ -65,6 +70,17 @@ class DispatchRenderingError(NSADMError):
     """
 
 
+class DispatchTooLargeError(DispatchRenderingError):
+    """Rendered dispatch is longer than NationStates allows.
+    """
+
+    def __init__(self, size, max_size):
+        self.size = size
+        self.max_size = max_size
+        # Arguments are kept so that the error can be pickled back from render processes.
+        super().__init__(size, max_size)
+
+
 class BBParsingError(DispatchRenderingError):
     """BBCode parsing errors.
     """
@@ -0,0 +1,291 @@
+"""Memoize custom Jinja filters in an LRU cache shared for the whole run.
+"""
+
+import collections
+import functools
+import inspect
+import logging
+import pickle
+import threading
+import time
+
+
+DEFAULT_MAX_SIZE = 1024
+FILTER_CACHE_FILENAME = 'filter_cache.pickle'
+
+
+logger = logging.getLogger(__name__)
+
+
+def freeze(value):
+    """Turn a value into a hashable one that is only equal to frozen equal values.
+    Lists, tuples, dicts and sets are frozen item by item.
+
+    Args:
+        value: Value
+
+    Raises:
+        TypeError: Value is unhashable or only hashed by identity
+
+    Returns:
+        Hashable value
+    """
+
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(freeze(item) for item in value))
+    if isinstance(value, dict):
+        return ('dict', frozenset((freeze(key), freeze(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return (type(value).__name__, frozenset(freeze(item) for item in value))
+    if value is not None and type(value).__hash__ is object.__hash__:
+        # Such objects are equal only to themselves and their IDs are reused.
+        raise TypeError('{} is hashed by identity'.format(type(value).__name__))
+
+    hash(value)
+    return value
+
+
+def make_key(name, args, kwargs):
+    """Make cache key of a filter call.
+
+    Args:
+        name (str): Filter name
+        args (tuple): Arguments
+        kwargs (dict): Keyword arguments
+
+    Returns:
+        tuple|None: Key or None if the arguments cannot be keyed by value
+    """
+
+    try:
+        return (name, freeze(args), freeze(kwargs))
+    except TypeError:
+        return None
+
+
+def is_picklable(value):
+    """Check if a value can be pickled.
+
+    Args:
+        value: Value
+
+    Returns:
+        bool: True if picklable
+    """
+
+    try:
+        pickle.dumps(value)
+    except Exception:
+        return False
+    return True
+
+
+class FilterCache():
+    """Bounded LRU cache of filter results.
+
+    Args:
+        max_size (int): Maximum number of cached results
+        clock (func): Current time in seconds
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self.lock = threading.Lock()
+        # Key and its result, creation time, and whether to persist it
+        self.entries = collections.OrderedDict()
+        # Filter name and its hit and miss count
+        self.stats = {}
+        # Key and result and creation time of persistent results cached since
+        # changes were last taken. None means changes are not tracked.
+        self.changes = None
+
+    def get(self, key, ttl=None):
+        """Get a cached result.
+
+        Args:
+            key (tuple): Key
+            ttl (float): Seconds a result stays valid. None means forever.
+
+        Raises:
+            KeyError: Result is not cached or has expired
+
+        Returns:
+            Result
+        """
+
+        with self.lock:
+            stats = self.stats.setdefault(key[0], {'hits': 0, 'misses': 0})
+            entry = self.entries.get(key)
+            if entry is None or (ttl is not None and self.clock() - entry[1] > ttl):
+                stats['misses'] += 1
+                raise KeyError(key)
+
+            self.entries.move_to_end(key)
+            stats['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value, persist=False):
+        """Cache a result and evict the least recently used one if full.
+
+        Args:
+            key (tuple): Key
+            value: Result
+            persist (bool): Save result to disk
+        """
+
+        with self.lock:
+            created = self.clock()
+            self.entries[key] = (value, created, persist)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            if persist and self.changes is not None:
+                self.changes[key] = (value, created)
+
+    def track_changes(self):
+        """Start tracking persistent results and hit and miss counts
+        so that render processes can send them to the main process.
+        """
+
+        with self.lock:
+            self.changes = {}
+            self.stats = {}
+
+    def take_changes(self):
+        """Take persistent results and hit and miss counts since changes were last taken.
+
+        Returns:
+            tuple: Keys and their picklable results and creation time,
+            and filter names and their hit and miss counts
+        """
+
+        with self.lock:
+            changes, self.changes = self.changes or {}, {}
+            stats, self.stats = self.stats, {}
+
+        entries = {key: entry for key, entry in changes.items() if is_picklable(entry[0])}
+        return entries, stats
+
+    def merge(self, entries, stats):
+        """Add persistent results and hit and miss counts taken from another cache.
+
+        Args:
+            entries (dict): Keys and their results and creation time
+            stats (dict): Filter names and their hit and miss counts
+        """
+
+        with self.lock:
+            for key, (value, created) in entries.items():
+                self.entries[key] = (value, created, True)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+            for name, other_stats in stats.items():
+                this_stats = self.stats.setdefault(name, {'hits': 0, 'misses': 0})
+                this_stats['hits'] += other_stats['hits']
+                this_stats['misses'] += other_stats['misses']
+
+    def load(self, path):
+        """Load results saved by previous runs.
+
+        Args:
+            path (str): Cache file path
+        """
+
+        try:
+            with open(path, 'rb') as f:
+                entries = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as err:
+            logger.warning('Could not load filter cache at "%s": %s', path, err)
+            return
+
+        with self.lock:
+            for key, (value, created) in entries.items():
+                if key not in self.entries:
+                    self.entries[key] = (value, created, True)
+                    self.entries.move_to_end(key, last=False)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        logger.debug('Loaded %d filter cache entries', len(entries))
+
+    def save(self, path):
+        """Save results of persistent filters.
+
+        Args:
+            path (str): Cache file path
+        """
+
+        entries = {}
+        with self.lock:
+            for key, (value, created, persist) in self.entries.items():
+                if persist and is_picklable(value):
+                    entries[key] = (value, created)
+
+        with open(path, 'wb') as f:
+            pickle.dump(entries, f)
+        logger.debug('Saved %d filter cache entries', len(entries))
+
+    def log_stats(self):
+        """Log hit and miss counts of cached filters.
+        """
+
+        with self.lock:
+            for name, stats in sorted(self.stats.items()):
+                logger.info('Filter cache of "%s": %d hits, %d misses',
+                            name, stats['hits'], stats['misses'])
+
+
+# Cache shared by all cached filters
+default_cache = FilterCache()
+
+
+def cached_filter(func=None, ttl=None, persist=False):
+    """Decorator to memoize a filter in the shared filter cache.
+    Use as @cached_filter or @cached_filter(ttl=60, persist=True).
+
+    Args:
+        func (func): Filter
+        ttl (float): Seconds a result stays valid. None means for the whole run.
+        persist (bool): Keep results on disk between runs
+
+    Returns:
+        func: Memoized filter
+    """
+
+    if func is None:
+        return functools.partial(cached_filter, ttl=ttl, persist=persist)
+
+    name = '{}.{}'.format(func.__module__, func.__qualname__)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def cached_coroutine(*args, **kwargs):
+            key = make_key(name, args, kwargs)
+            if key is None:
+                return await func(*args, **kwargs)
+            try:
+                return default_cache.get(key, ttl)
+            except KeyError:
+                value = await func(*args, **kwargs)
+                default_cache.set(key, value, persist)
+                return value
+
+        return cached_coroutine
+
+    @functools.wraps(func)
+    def cached(*args, **kwargs):
+        key = make_key(name, args, kwargs)
+        if key is None:
+            return func(*args, **kwargs)
+        try:
+            return default_cache.get(key, ttl)
+        except KeyError:
+            value = func(*args, **kwargs)
+            default_cache.set(key, value, persist)
+            return value
+
+    return cached
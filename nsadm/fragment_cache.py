@@ -0,0 +1,205 @@
+"""Cache rendered template fragments on disk with the {% cache %} tag.
+"""
+
+import hashlib
+import inspect
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+
+import jinja2.ext
+import jinja2.nodes
+
+from nsadm import utils
+
+
+FRAGMENT_CACHE_DIRNAME = 'fragment_cache'
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+FRAGMENT_EXTENSION = '.fragment'
+
+
+logger = logging.getLogger(__name__)
+
+
+class FragmentCache():
+    """Directory of rendered fragments. Least recently used fragments
+    are evicted when their total size exceeds the maximum size.
+    The total size is kept in memory and the directory is only scanned
+    on the first write and when the total goes over the maximum size.
+
+    Args:
+        directory (str): Cache directory
+        max_size (int): Maximum total size in bytes of fragments
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Total size in bytes of fragments as of the last scan plus fragments written since.
+        # None means the directory has not been scanned yet.
+        self.size = None
+
+    def get_path(self, key):
+        """Get file path of a fragment.
+
+        Args:
+            key (str): Fragment key
+
+        Returns:
+            pathlib.Path: Path
+        """
+
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.directory / (digest + FRAGMENT_EXTENSION)
+
+    def get(self, key):
+        """Get a rendered fragment.
+
+        Args:
+            key (str): Fragment key
+
+        Returns:
+            str|None: Fragment or None if not cached
+        """
+
+        path = self.get_path(key)
+        try:
+            fragment = path.read_text(encoding='utf-8')
+            # Mark as recently used for eviction.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return fragment
+
+    def set(self, key, fragment):
+        """Cache a rendered fragment and evict old ones if the cache is full.
+        Files are replaced atomically so that render processes sharing
+        the cache never read a partly written fragment.
+
+        Args:
+            key (str): Fragment key
+            fragment (str): Fragment
+        """
+
+        path = self.get_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(fragment)
+                f.flush()
+                size = os.fstat(f.fileno()).st_size
+            try:
+                old_size = path.stat().st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self.lock:
+            if self.size is not None:
+                self.size += size - old_size
+            is_full = self.size is None or self.size > self.max_size
+
+        if is_full:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used fragments until the cache fits its maximum size.
+        Scanning also counts fragments other processes wrote.
+        """
+
+        files = []
+        total = 0
+        for path in self.directory.glob('*' + FRAGMENT_EXTENSION):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug('Evicted cached fragment "%s"', path.name)
+
+        with self.lock:
+            self.size = total
+
+
+class FragmentCacheExtension(jinja2.ext.Extension):
+    """Jinja extension to cache the output of a block
+    under a key and the values of the variables it names.
+
+    {% cache "rankings", region %}...{% endcache %}
+
+    The block source is part of the key, so editing it invalidates the cache.
+    Without a fragment cache on the environment, blocks are always rendered.
+    If the environment has a fragment_cache_writable function, blocks are only
+    cached when it returns True, such as when their output has no placeholders.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_writable=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        var_values = []
+        while parser.stream.skip_if('comma'):
+            var_values.append(parser.parse_expression())
+        args.append(jinja2.nodes.List(var_values))
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        body_hash = hashlib.sha256(repr(body).encode('utf-8')).hexdigest()
+        args.append(jinja2.nodes.Const(body_hash))
+
+        call = self.call_method('_render_cached', args)
+        return jinja2.nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, name, var_values, body_hash, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        key = '{}:{}:{}'.format(name, body_hash, utils.get_data_hash(var_values))
+        fragment = cache.get(key)
+        if fragment is not None:
+            logger.debug('Reused cached fragment "%s"', name)
+            return fragment
+
+        fragment = caller()
+        if inspect.isawaitable(fragment):
+            return self._store_async(cache, key, fragment)
+
+        self._store(cache, key, fragment)
+        return fragment
+
+    async def _store_async(self, cache, key, pending_fragment):
+        fragment = await pending_fragment
+        self._store(cache, key, fragment)
+        return fragment
+
+    def _store(self, cache, key, fragment):
+        writable = self.environment.fragment_cache_writable
+        if writable is not None and not writable():
+            logger.debug('Did not cache fragment with placeholder output')
+            return
+
+        cache.set(key, fragment)
@@ -0,0 +1,99 @@
+"""Append-only journal of completed dispatch updates for resuming interrupted runs.
+"""
+
+import json
+import logging
+import os
+import pathlib
+import threading
+
+
+JOURNAL_FILENAME = 'update_journal.jsonl'
+
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateJournal():
+    """Journal of dispatch updates done since loaders last saved their data.
+    Each entry is synced to disk as soon as it is written so that it survives crashes.
+
+    Args:
+        path (str): Path to journal file
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.lock = threading.Lock()
+        self.file = None
+
+    def load(self):
+        """Load updates done by interrupted runs.
+
+        Returns:
+            dict: Dispatch names and their latest journal entry
+        """
+
+        entries = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning('Skipped incomplete journal entry: %r', line)
+                        continue
+                    entries[entry['name']] = entry
+        except FileNotFoundError:
+            pass
+
+        logger.debug('Loaded update journal: %r', entries)
+        return entries
+
+    def open(self):
+        """Open journal for appending new entries.
+        """
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'a+', encoding='utf-8')
+
+        # Terminate an entry cut off by a crash so the next one stays readable.
+        if self.file.tell() > 0:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != '\n':
+                self.file.write('\n')
+
+    def record(self, name, action, dispatch_id, dispatch_hash=None):
+        """Record a completed dispatch update.
+
+        Args:
+            name (str): Dispatch name
+            action (str): Action done
+            dispatch_id (str): Dispatch ID
+            dispatch_hash (str): Hash of pushed content
+        """
+
+        if self.file is None:
+            return
+
+        line = json.dumps({'name': name, 'action': action,
+                           'id': dispatch_id, 'hash': dispatch_hash}) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def finish(self):
+        """Delete journal after loaders saved everything it recorded.
+        """
+
+        if self.file is None:
+            return
+
+        self.file.close()
+        self.file = None
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        logger.debug('Deleted update journal')
@@ -87,8 +87,8 @@ class VarLoader(Loader):
     def __init__(self, names, loader_config):
         super().__init__(info.VAR_LOADER_PROJ, names, loader_config)
 
-    def get_all_vars(self):
-        vars_list = self.manager.hook.get_vars(config=self.loader_config)
+    def get_all_vars(self, names=None):
+        vars_list = self.manager.hook.get_vars(config=self.loader_config, names=names)
         merged_vars_dict = dict(collections.ChainMap(*vars_list))
         return merged_vars_dict
 
@@ -120,6 +120,17 @@ class DispatchLoader(PersistentLoader):
                                                  name=name,
                                                  dispatch_id=dispatch_id)
 
+    def get_dispatch_version(self, name):
+        return self.manager.hook.get_dispatch_version(loader=self._loader, name=name)
+
+    def get_dispatch_hash(self, name):
+        return self.manager.hook.get_dispatch_hash(loader=self._loader, name=name)
+
+    def set_dispatch_hash(self, name, dispatch_hash):
+        return self.manager.hook.set_dispatch_hash(loader=self._loader,
+                                                   name=name,
+                                                   dispatch_hash=dispatch_hash)
+
 
 class CredLoader(PersistentLoader):
     """Load nation login credentials.
@@ -146,3 +157,10 @@ class CredLoader(PersistentLoader):
 
     def remove_cred(self, name):
         return self.manager.hook.remove_cred(loader=self._loader, name=name)
+
+    def get_session(self, name):
+        return self.manager.hook.get_session(loader=self._loader, name=name)
+
+    def add_session(self, name, pin, timestamp):
+        return self.manager.hook.add_session(loader=self._loader, name=name,
+                                             pin=pin, timestamp=timestamp)
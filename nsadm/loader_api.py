@@ -63,6 +63,44 @@ def add_dispatch_id(loader, name, dispatch_id):
     """
 
 
+@dispatch_loader_specs(firstresult=True)
+def get_dispatch_hash(loader, name):
+    """Get hash of the last successfully pushed content of a dispatch.
+
+    Args:
+        loader: Loader
+        name (str): Dispatch name
+
+    Return:
+        str|None: Hash or None if unknown
+    """
+
+
+@dispatch_loader_specs(firstresult=True)
+def set_dispatch_hash(loader, name, dispatch_hash):
+    """Record hash of the successfully pushed content of a dispatch.
+
+    Args:
+        loader: Loader
+        name (str): Dispatch name
+        dispatch_hash (str): Hash
+    """
+
+
+@dispatch_loader_specs(firstresult=True)
+def get_dispatch_version(loader, name):
+    """Get version of a dispatch's content text such as its modification time.
+    Used to recompile templates only when they change.
+
+    Args:
+        loader: Loader
+        name (str): Dispatch name
+
+    Return:
+        Comparable version or None if unknown
+    """
+
+
 @dispatch_loader_specs(firstresult=True)
 def cleanup_dispatch_loader(loader):
     """Cleanup loader and close it.
@@ -73,11 +111,13 @@ def cleanup_dispatch_loader(loader):
 
 
 @var_loader_specs
-def get_vars(config):
+def get_vars(config, names):
     """Get all variables as a dict.
 
     Args:
         config (dict): Loaders' configuration
+        names (set|None): Names of top-level variables templates use.
+        Loaders may skip sources without any of them. None means all are used.
 
     Return:
         dict: Variables
@@ -129,6 +169,31 @@ def remove_cred(loader, name):
     """
 
 
+@cred_loader_specs(firstresult=True)
+def get_session(loader, name):
+    """Get a nation's cached login session.
+
+    Args:
+        loader: Loader
+        name (str): Nation name
+
+    Return:
+        dict|None: Session pin and its creation timestamp
+    """
+
+
+@cred_loader_specs(firstresult=True)
+def add_session(loader, name, pin, timestamp):
+    """Cache a nation's login session.
+
+    Args:
+        loader: Loader
+        name (str): Nation name
+        pin (str): Session pin
+        timestamp (float): Session creation timestamp
+    """
+
+
 @cred_loader_specs(firstresult=True)
 def cleanup_cred_loader(loader):
     """Cleanup loader and close it.
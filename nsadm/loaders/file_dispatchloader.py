@@ -12,40 +12,78 @@ from nsadm import exceptions
 from nsadm import loader_api
 
 DEFAULT_ID_STORE_FILENAME = 'dispatch_id.json'
+DEFAULT_MANIFEST_FILENAME = 'dispatch_manifest.json'
 DEFAULT_EXT = '.txt'
 
 logger = logging.getLogger(__name__)
 
 
-class IDStore(collections.UserDict):
-    """Store dispatch IDs on disk.
+class JSONStore(collections.UserDict):
+    """Store a dict on disk as a JSON file.
 
     Args:
-        id_store_path (str): Path to store file.
+        path (pathlib.Path): Path to store file.
     """
 
-    def __init__(self, id_store_path):
-        if id_store_path is None:
-            self.id_store_path = pathlib.Path(info.DATA_DIR, DEFAULT_ID_STORE_FILENAME)
-        else:
-            self.id_store_path = pathlib.Path(id_store_path)
+    # Name of this store for logging.
+    store_name = 'store'
+
+    def __init__(self, path):
+        self.path = path
         self.saved = False
         super().__init__()
 
     def load_from_json(self):
-        """Load dispatch IDs from configured JSON file.
+        """Load data from the JSON file.
         """
 
-        if self.id_store_path is None:
+        if self.path is None:
             return
 
         try:
-            with open(self.id_store_path) as f:
+            with open(self.path) as f:
                 self.data = json.load(f)
-                logger.debug('Loaded id store: %r', self.data)
+                logger.debug('Loaded %s: %r', self.store_name, self.data)
         except FileNotFoundError:
             self.save()
-            logger.debug('Created id store at "%s"', self.id_store_path)
+            logger.debug('Created %s at "%s"', self.store_name, self.path)
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.saved = False
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.saved = False
+
+    def save(self):
+        """Save store into file.
+        """
+
+        if self.saved:
+            return
+
+        with open(self.path, 'w') as f:
+            json.dump(self.data, f)
+            self.saved = True
+            logger.debug('Saved %s: %r', self.store_name, self.data)
+
+
+class IDStore(JSONStore):
+    """Store dispatch IDs on disk.
+
+    Args:
+        id_store_path (str): Path to store file.
+    """
+
+    store_name = 'id store'
+
+    def __init__(self, id_store_path):
+        if id_store_path is None:
+            id_store_path = pathlib.Path(info.DATA_DIR, DEFAULT_ID_STORE_FILENAME)
+        else:
+            id_store_path = pathlib.Path(id_store_path)
+        super().__init__(id_store_path)
 
     def load_from_dispatch_config(self, dispatch_config):
         """Load dispatch IDs from dispatch configurations.
@@ -66,28 +104,23 @@ class IDStore(collections.UserDict):
 
         self.saved = False
 
-    def __setitem__(self, name, dispatch_id):
-        """Add new dispatch ID.
 
-        Args:
-            name (str): Dispatch file name.
-            dispatch_id (int): Dispatch ID.
-        """
-
-        self.data[name] = dispatch_id
-        self.saved = False
+class DispatchManifest(JSONStore):
+    """Store hashes of the last successfully pushed content of dispatches.
 
-    def save(self):
-        """Save ID store into file.
-        """
+    Args:
+        manifest_path (str): Path to manifest file.
+        default_dir (pathlib.Path): Directory to put the manifest in if its path is not set.
+    """
 
-        if self.saved:
-            return
+    store_name = 'dispatch manifest'
 
-        with open(self.id_store_path, 'w') as f:
-            json.dump(self.data, f)
-            self.saved = True
-            logger.debug('Saved id store: %r', self.data)
+    def __init__(self, manifest_path, default_dir):
+        if manifest_path is None:
+            manifest_path = pathlib.Path(default_dir, DEFAULT_MANIFEST_FILENAME)
+        else:
+            manifest_path = pathlib.Path(manifest_path)
+        super().__init__(manifest_path)
 
 
 def define_action(name, config, id_dont_exist):
@@ -197,13 +230,15 @@ class FileDispatchLoader():
         id_store: Dispatch id store
         dispatch_config (dict): Dispatch config
         file_ext (str): Dispatch file extension
+        manifest: Dispatch content hash manifest
     """
 
-    def __init__(self, id_store, dispatch_config, template_path, file_ext):
+    def __init__(self, id_store, dispatch_config, template_path, file_ext, manifest=None):
         self.id_store = id_store
         self.dispatch_config = dispatch_config
         self.template_path = template_path
         self.file_ext = file_ext
+        self.manifest = manifest
 
     def get_dispatch_text(self, name):
         """Get a dispatch's text content.
@@ -225,6 +260,22 @@ class FileDispatchLoader():
             logger.error('Could not find dispatch template file "%s".', file_path)
             raise exceptions.DispatchTextNotFound from err
 
+    def get_dispatch_version(self, name):
+        """Get modification time of a dispatch's file.
+
+        Args:
+            name (str): Dispatch name
+
+        Returns:
+            int|None: Modification time in nanoseconds or None if the file does not exist
+        """
+
+        file_path = pathlib.Path(self.template_path, name).with_suffix(self.file_ext)
+        try:
+            return file_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
     def add_new_dispatch_id(self, name, dispatch_id):
         """Add id of new dispatch into id store.
 
@@ -235,12 +286,45 @@ class FileDispatchLoader():
 
         self.id_store[name] = dispatch_id
 
+    def get_dispatch_hash(self, name):
+        """Get hash of the last pushed content of a dispatch.
+
+        Args:
+            name (str): Dispatch name
+
+        Returns:
+            str|None: Hash
+        """
+
+        if self.manifest is None:
+            return None
+
+        return self.manifest.get(name)
+
+    def set_dispatch_hash(self, name, dispatch_hash):
+        """Record hash of the pushed content of a dispatch.
+
+        Args:
+            name (str): Dispatch name
+            dispatch_hash (str): Hash
+        """
+
+        if self.manifest is not None:
+            self.manifest[name] = dispatch_hash
+
     def save_id_store(self):
         """Save all changes to id store.
         """
 
         self.id_store.save()
 
+    def save_manifest(self):
+        """Save all changes to manifest.
+        """
+
+        if self.manifest is not None:
+            self.manifest.save()
+
 
 @loader_api.dispatch_loader
 def init_dispatch_loader(config):
@@ -263,9 +347,13 @@ def init_dispatch_loader(config):
     if this_config.get('save_config_defined_id', False):
         id_store.load_from_dispatch_config(dispatch_config)
 
+    manifest = DispatchManifest(this_config.get('manifest_path'), id_store.path.parent)
+    manifest.load_from_json()
+
     loader = FileDispatchLoader(id_store, dispatch_config,
                                 this_config['template_path'],
-                                this_config.get('file_ext', DEFAULT_EXT))
+                                this_config.get('file_ext', DEFAULT_EXT),
+                                manifest)
 
     return loader
 
@@ -280,11 +368,27 @@ def get_dispatch_text(loader, name):
     return loader.get_dispatch_text(name)
 
 
+@loader_api.dispatch_loader
+def get_dispatch_version(loader, name):
+    return loader.get_dispatch_version(name)
+
+
 @loader_api.dispatch_loader
 def add_dispatch_id(loader, name, dispatch_id):
     return loader.add_new_dispatch_id(name, dispatch_id)
 
 
+@loader_api.dispatch_loader
+def get_dispatch_hash(loader, name):
+    return loader.get_dispatch_hash(name)
+
+
+@loader_api.dispatch_loader
+def set_dispatch_hash(loader, name, dispatch_hash):
+    return loader.set_dispatch_hash(name, dispatch_hash)
+
+
 @loader_api.dispatch_loader
 def cleanup_dispatch_loader(loader):
     loader.save_id_store()
+    loader.save_manifest()
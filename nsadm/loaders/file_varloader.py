@@ -1,16 +1,98 @@
 """Load variables from TOML files.
 """
 
+import json
 import logging
+import os
+import pathlib
 
 import toml
 
+from nsadm import info
 from nsadm import loader_api
 
 
+DEFAULT_VAR_KEYS_FILENAME = 'var_keys.json'
+
+
 logger = logging.getLogger(__name__)
 
 
+class VarKeyIndex():
+    """Top-level variable names of var files, kept between runs
+    to skip loading files without needed variables. An entry is
+    only trusted while its file has the same modification time and size.
+
+    Args:
+        path (pathlib.Path): Path to index file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Var file path and its modification time, size, and variable names
+        self.data = {}
+        self.changed = False
+
+    def load(self):
+        """Load index from file.
+        """
+
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logger.warning('Var key index at "%s" is corrupted. Rebuilding it.', self.path)
+
+    def save(self):
+        """Save index to file if it changed.
+        """
+
+        if not self.changed:
+            return
+
+        pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.data, f)
+        self.changed = False
+
+    @staticmethod
+    def get_signature(var_path):
+        stat = os.stat(var_path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def get_keys(self, var_path):
+        """Get variable names of an unchanged var file.
+
+        Args:
+            var_path (str): Var file path
+
+        Returns:
+            set|None: Variable names or None if unknown
+        """
+
+        entry = self.data.get(str(var_path))
+        try:
+            if entry is None or entry[0] != self.get_signature(var_path):
+                return None
+        except FileNotFoundError:
+            return None
+
+        return set(entry[1])
+
+    def set_keys(self, var_path, keys):
+        """Record variable names of a var file.
+
+        Args:
+            var_path (str): Var file path
+            keys (iterable): Variable names
+        """
+
+        self.data[str(var_path)] = [self.get_signature(var_path), sorted(keys)]
+        self.changed = True
+
+
 def load_vars_from_file(path):
     """Load variables from a TOML file.
 
@@ -32,11 +114,13 @@ def load_vars_from_file(path):
         return None
 
 
-def get_all_vars(paths):
+def get_all_vars(paths, names=None, key_index=None):
     """Get variables from file(s).
 
     Args:
         paths (str|list): File path(s)
+        names (set): Names of needed variables. None means all.
+        key_index (VarKeyIndex): Index to skip files without needed variables
 
     Returns:
         dict: Variables
@@ -48,9 +132,17 @@ def get_all_vars(paths):
         logger.debug('No var file found')
     elif isinstance(paths, list):
         for path in paths:
+            if names is not None and key_index is not None:
+                keys = key_index.get_keys(path)
+                if keys is not None and not keys & names:
+                    logger.debug('Skipped var file "%s" with no needed variables', path)
+                    continue
+
             file_vars = load_vars_from_file(path)
             if file_vars is not None:
                 loaded_vars.update(file_vars)
+                if key_index is not None:
+                    key_index.set_keys(path, file_vars.keys())
     else:
         loaded_vars = load_vars_from_file(paths)
 
@@ -58,6 +150,14 @@ def get_all_vars(paths):
 
 
 @loader_api.var_loader
-def get_vars(config):
-    var_paths = config['file_varloader']['var_paths']
-    return get_all_vars(var_paths)
+def get_vars(config, names):
+    this_config = config['file_varloader']
+    if names is None:
+        return get_all_vars(this_config['var_paths'])
+
+    key_index = VarKeyIndex(this_config.get('var_keys_path',
+                                            info.DATA_DIR / DEFAULT_VAR_KEYS_FILENAME))
+    key_index.load()
+    loaded_vars = get_all_vars(this_config['var_paths'], names, key_index)
+    key_index.save()
+    return loaded_vars
@@ -4,12 +4,14 @@
 import collections
 import json
 import logging
+import pathlib
 
 from nsadm import info
 from nsadm import loader_api
 
 
 CRED_FILENAME = 'creds.json'
+SESSION_FILENAME = 'sessions.json'
 
 
 logger = logging.getLogger(__name__)
@@ -21,12 +23,18 @@ class JSONCredLoader(collections.UserDict):
     Args:
         config (dict): Configuration
         json_path (str): Path to JSON file
+        session_path (str): Path to JSON file of cached login sessions
     """
 
-    def __init__(self, json_path):
+    def __init__(self, json_path, session_path=None):
         super().__init__()
         self.json_path = json_path
         self.saved = True
+        if session_path is None:
+            session_path = pathlib.Path(json_path).parent / SESSION_FILENAME
+        self.session_path = session_path
+        self.sessions = {}
+        self.sessions_saved = True
 
     def load_creds(self):
         """Get all login credentials
@@ -41,6 +49,12 @@ class JSONCredLoader(collections.UserDict):
         except FileNotFoundError:
             pass
 
+        try:
+            with open(self.session_path) as f:
+                self.sessions = json.load(f)
+        except FileNotFoundError:
+            pass
+
     def __setitem__(self, name, x_autologin):
         """Add a new credential into file.
 
@@ -61,6 +75,20 @@ class JSONCredLoader(collections.UserDict):
 
         del self.data[name]
         self.saved = False
+        if self.sessions.pop(name, None) is not None:
+            self.sessions_saved = False
+
+    def add_session(self, name, pin, timestamp):
+        """Cache a login session.
+
+        Args:
+            name (str): Nation name
+            pin (str): Session pin
+            timestamp (float): Session creation timestamp
+        """
+
+        self.sessions[name] = {'pin': pin, 'timestamp': timestamp}
+        self.sessions_saved = False
 
     def save(self):
         """Save creds to JSON file.
@@ -69,6 +97,12 @@ class JSONCredLoader(collections.UserDict):
         if not self.saved:
             with open(self.json_path, 'w') as f:
                 json.dump(self.data, f)
+            self.saved = True
+
+        if not self.sessions_saved:
+            with open(self.session_path, 'w') as f:
+                json.dump(self.sessions, f)
+            self.sessions_saved = True
 
 
 @loader_api.cred_loader
@@ -79,7 +113,11 @@ def init_cred_loader(config):
     else:
         json_path = config['cred_path']
 
-    loader = JSONCredLoader(json_path)
+    session_path = None
+    if config is not None:
+        session_path = config.get('session_path')
+
+    loader = JSONCredLoader(json_path, session_path)
     loader.load_creds()
 
     return loader
@@ -100,6 +138,16 @@ def remove_cred(loader, name):
     del loader[name]
 
 
+@loader_api.cred_loader
+def get_session(loader, name):
+    return loader.sessions.get(name)
+
+
+@loader_api.cred_loader
+def add_session(loader, name, pin, timestamp):
+    loader.add_session(name, pin, timestamp)
+
+
 @loader_api.cred_loader
 def cleanup_cred_loader(loader):
     loader.save()
@@ -0,0 +1,280 @@
+"""Render dispatches ahead in worker processes while others are being pushed.
+"""
+
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import logging
+import threading
+
+from nsadm import exceptions
+from nsadm import filter_cache
+from nsadm import loader
+from nsadm import renderer
+
+
+logger = logging.getLogger(__name__)
+
+
+# Renderer of this worker process.
+_worker_renderer = None
+
+
+def init_render_worker(config, dispatch_config, dispatches=None):
+    """Build and load a dispatch renderer in a worker process.
+
+    Args:
+        config (dict): NSADM configuration
+        dispatch_config (dict): Dispatch config
+        dispatches (list): Dispatch names to render. Empty list means all.
+    """
+
+    global _worker_renderer
+
+    plugin_options = config['plugins']
+    loader_config = config['loader_config']
+
+    dispatch_loader = loader.DispatchLoader(plugin_options['dispatch_loader'], loader_config)
+    dispatch_loader.load_loader()
+    var_loader = loader.VarLoader(plugin_options['var_loader'], loader_config)
+    var_loader.load_loader()
+
+    template_config = config['template_renderer']
+    filter_cache.default_cache.max_size = template_config.get('filter_cache_size',
+                                                              filter_cache.DEFAULT_MAX_SIZE)
+    if template_config.get('filter_cache_path'):
+        filter_cache.default_cache.load(template_config['filter_cache_path'])
+    # The main process merges and saves cache changes of all workers.
+    filter_cache.default_cache.track_changes()
+
+    # Dispatches already render in parallel here, so BBCode is formatted sequentially
+    # instead of each render process starting its own format processes.
+    if config['bbcode'].get('parallel_workers', 0) > 1:
+        logger.debug('Parallel BBCode formatting is disabled in render processes.')
+    bb_config = dict(config['bbcode'], parallel_workers=0)
+    _worker_renderer = renderer.DispatchRenderer(dispatch_loader, var_loader,
+                                                 bb_config, template_config)
+    _worker_renderer.load(dispatch_config, dispatches)
+
+
+def render_in_worker(name):
+    """Render a dispatch with this worker process's renderer.
+
+    Args:
+        name (str): Dispatch name
+
+    Returns:
+        tuple: Rendered dispatch, and filter cache changes since the last render
+    """
+
+    return _worker_renderer.render(name), filter_cache.default_cache.take_changes()
+
+
+def get_render_jobs(dispatch_config, dispatches):
+    """Get dispatches that need rendering in the order they will be pushed.
+
+    Args:
+        dispatch_config (dict): Dispatch config
+        dispatches (list): Dispatch names. Empty list means all.
+
+    Returns:
+        list: Owner nation and dispatch name pairs
+    """
+
+    jobs = []
+    for owner_nation, nation_dispatch_config in dispatch_config.items():
+        for name, config in nation_dispatch_config.items():
+            if dispatches and name not in dispatches:
+                continue
+            if config.get('action') in ('create', 'edit'):
+                jobs.append((owner_nation, name))
+
+    return jobs
+
+
+class RenderPipeline():
+    """Render dispatches in a process pool ahead of the API stage.
+    Used in place of the dispatch renderer by dispatch updaters.
+
+    Args:
+        config (dict): NSADM configuration to build renderers in workers
+        workers (int): Number of render processes
+        max_ahead (int): Maximum number of rendered dispatches waiting to be pushed
+    """
+
+    def __init__(self, config, workers, max_ahead):
+        self.config = config
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(max_ahead)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.producer = None
+        # Dispatch name and future of its rendered text
+        self.results = {}
+        # Owner nation and names of its dispatches still in pipeline
+        self.nation_jobs = {}
+        # Dispatch name and its owner nation
+        self.owners = {}
+
+    def start(self, dispatch_config, dispatches, loaded_dispatch_config=None):
+        """Start rendering dispatches.
+
+        Args:
+            dispatch_config (dict): Dispatch config of dispatches to update
+            dispatches (list): Dispatch names. Empty list means all.
+            loaded_dispatch_config (dict): Dispatch config before skipped dispatches
+            were removed, so that dispatch_info is the same as in the main process.
+            None means dispatch_config.
+        """
+
+        if loaded_dispatch_config is None:
+            loaded_dispatch_config = dispatch_config
+
+        jobs = get_render_jobs(dispatch_config, dispatches)
+        for owner_nation, name in jobs:
+            self.results[name] = concurrent.futures.Future()
+            self.nation_jobs.setdefault(owner_nation, []).append(name)
+            self.owners[name] = owner_nation
+
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                               initializer=init_render_worker,
+                                                               initargs=(self.config,
+                                                                         loaded_dispatch_config,
+                                                                         dispatches))
+        self.producer = threading.Thread(target=self.produce, args=(jobs,), daemon=True)
+        self.producer.start()
+        logger.debug('Started render pipeline with %d jobs', len(jobs))
+
+    def produce(self, jobs):
+        """Submit render jobs to the process pool as buffer slots free up.
+
+        Args:
+            jobs (list): Owner nation and dispatch name pairs
+        """
+
+        for _, name in jobs:
+            self.slots.acquire()
+            with self.lock:
+                result = self.results.get(name)
+                # Owner nation is done with this dispatch without waiting for it.
+                if result is None or not result.set_running_or_notify_cancel():
+                    self.slots.release()
+                    continue
+                render_future = self.executor.submit(render_in_worker, name)
+
+            render_future.add_done_callback(
+                lambda future, result=result: finish_render(future, result))
+
+    def render(self, name):
+        """Wait for a dispatch to be rendered.
+
+        Args:
+            name (str): Dispatch name
+
+        Returns:
+            str: Rendered dispatch
+        """
+
+        with self.lock:
+            result = self.results.get(name)
+            if result is not None:
+                self.drop_skipped(name)
+
+        if result is None:
+            logger.error('Dispatch "%s" was not scheduled for rendering.', name)
+            raise exceptions.DispatchRenderingError
+
+        try:
+            return result.result()
+        except concurrent.futures.process.BrokenProcessPool as err:
+            logger.error('Render process of dispatch "%s" died.', name)
+            raise exceptions.DispatchRenderingError from err
+        finally:
+            with self.lock:
+                if self.results.pop(name, None) is not None:
+                    self.slots.release()
+
+    async def render_async(self, name):
+        """Wait for a dispatch to be rendered without blocking the event loop.
+
+        Args:
+            name (str): Dispatch name
+
+        Returns:
+            str: Rendered dispatch
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.render, name)
+
+    def finish_nation(self, owner_nation):
+        """Drop rendered dispatches a nation did not use, such as when it could not log in.
+
+        Args:
+            owner_nation (str): Nation name
+        """
+
+        with self.lock:
+            for name in self.nation_jobs.pop(owner_nation, []):
+                self.drop(name)
+
+    def drop_skipped(self, name):
+        """Drop dispatches of the same nation queued before this one,
+        which the nation skipped without rendering. Lock must be held.
+
+        Args:
+            name (str): Dispatch name
+        """
+
+        owner_nation = self.owners[name]
+        names = self.nation_jobs[owner_nation]
+        index = names.index(name)
+        for skipped_name in names[:index]:
+            self.drop(skipped_name)
+        self.nation_jobs[owner_nation] = names[index:]
+
+    def drop(self, name):
+        """Drop a dispatch from the pipeline and free its buffer slot. Lock must be held.
+
+        Args:
+            name (str): Dispatch name
+        """
+
+        result = self.results.pop(name, None)
+        if result is None:
+            return
+
+        # Not submitted yet so the producer will skip it without taking a slot.
+        if not result.cancel():
+            self.slots.release()
+
+    def close(self):
+        """Wait for the producer and shut down the process pool.
+        """
+
+        for owner_nation in list(self.nation_jobs):
+            self.finish_nation(owner_nation)
+
+        if self.producer is not None:
+            self.producer.join()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def finish_render(source, target):
+    """Copy rendered dispatch or exception of a finished render job into another future,
+    and merge filter cache changes of the job into the main process's cache.
+
+    Args:
+        source (concurrent.futures.Future): Finished render job
+        target (concurrent.futures.Future): Future to set
+    """
+
+    err = source.exception()
+    if err is not None:
+        target.set_exception(err)
+        return
+
+    rendered, cache_changes = source.result()
+    filter_cache.default_cache.merge(*cache_changes)
+    target.set_result(rendered)
@@ -0,0 +1,157 @@
+"""Profile Jinja filters and BBCode formatters during renders.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+from nsadm import utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_output_size(output):
+    """Get size in bytes of a filter or formatter output.
+
+    Args:
+        output: Output
+
+    Returns:
+        int: Size or 0 if output is not text
+    """
+
+    if isinstance(output, str):
+        return len(output.encode('utf-8'))
+    return 0
+
+
+class RenderProfiler():
+    """Record call statistics of filters and formatters, and render stage times of dispatches.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Kind ("filter" or "bbcode") and name, and their call statistics
+        self.stats = {}
+        # Dispatch name and its render stage times
+        self.dispatches = {}
+
+    def record(self, kind, name, elapsed, output):
+        """Record a call.
+
+        Args:
+            kind (str): "filter" or "bbcode"
+            name (str): Filter name or tag name
+            elapsed (float): Seconds the call took
+            output: Call output
+        """
+
+        size = get_output_size(output)
+        with self.lock:
+            stats = self.stats.setdefault((kind, name), {'calls': 0, 'total': 0.0,
+                                                         'max': 0.0, 'bytes': 0})
+            stats['calls'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            stats['bytes'] += size
+
+    def wrap(self, kind, name, func):
+        """Wrap a filter or formatter to record its calls.
+
+        Args:
+            kind (str): "filter" or "bbcode"
+            name (str): Filter name or tag name
+            func (func): Function to wrap
+
+        Returns:
+            func: Wrapped function
+        """
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def profiled_coroutine(*args, **kwargs):
+                start = time.perf_counter()
+                output = await func(*args, **kwargs)
+                self.record(kind, name, time.perf_counter() - start, output)
+                return output
+
+            return profiled_coroutine
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            start = time.perf_counter()
+            output = func(*args, **kwargs)
+            self.record(kind, name, time.perf_counter() - start, output)
+            return output
+
+        return profiled
+
+    def record_dispatch(self, name, timings):
+        """Record render stage times of a dispatch.
+
+        Args:
+            name (str): Dispatch name
+            timings (dict): Seconds spent on Jinja ("template") and BBCode ("bbcode")
+        """
+
+        with self.lock:
+            self.dispatches[name] = {'template': timings['template'],
+                                     'bbcode': timings['bbcode']}
+
+    def get_report(self):
+        """Get all recorded statistics.
+
+        Returns:
+            dict: Report
+        """
+
+        report = {'filter': {}, 'bbcode': {}, 'dispatches': {}}
+        with self.lock:
+            for (kind, name), stats in self.stats.items():
+                report[kind][name] = dict(stats)
+            report['dispatches'] = {name: dict(timings)
+                                    for name, timings in self.dispatches.items()}
+
+        return report
+
+    def save_report(self, path):
+        """Save report as a JSON file.
+
+        Args:
+            path (str): File path
+        """
+
+        with open(path, 'w') as f:
+            json.dump(self.get_report(), f, indent=4)
+        logger.info('Saved render profile at "%s"', path)
+
+    def format_summary(self, limit=20):
+        """Format the slowest filters and formatters and total render stage times into a table.
+
+        Args:
+            limit (int): Maximum number of filters and formatters to show
+
+        Returns:
+            str: Summary
+        """
+
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda item: item[1]['total'], reverse=True)
+            template_time = sum(timings['template'] for timings in self.dispatches.values())
+            bbcode_time = sum(timings['bbcode'] for timings in self.dispatches.values())
+            dispatch_count = len(self.dispatches)
+
+        rows = [('Kind', 'Name', 'Calls', 'Total (ms)', 'Max (ms)', 'Bytes')]
+        for (kind, name), item_stats in stats[:limit]:
+            rows.append((kind, name, str(item_stats['calls']),
+                         '{:.2f}'.format(item_stats['total'] * 1000),
+                         '{:.2f}'.format(item_stats['max'] * 1000),
+                         str(item_stats['bytes'])))
+
+        totals = 'Rendered {} dispatches: Jinja {:.2f} ms, BBCode {:.2f} ms'.format(
+            dispatch_count, template_time * 1000, bbcode_time * 1000)
+        return '{}\n\n{}'.format(utils.format_table(rows, left_columns=2), totals)
@@ -1,18 +1,392 @@
 """Render dispatches from templates.
 """
 
+import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import io
 import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import types
 
 import jinja2
+import jinja2.meta
+import jinja2.nodes
 
 from nsadm import exceptions
 from nsadm import bb_parser
+from nsadm import filter_cache
+from nsadm import fragment_cache
 from nsadm import utils
 
 
+BYTECODE_CACHE_DIRNAME = 'template_cache'
+COMPILED_TEMPLATE_PREFIX = 'tmpl_'
+# Maximum number of characters of a dispatch text NationStates accepts
+DISPATCH_SIZE_LIMIT = 200000
+
+
 logger = logging.getLogger(__name__)
 
 
+# Async filter calls of the render running in the current task
+_filter_calls = contextvars.ContextVar('filter_calls', default=None)
+
+# Render buffer of each thread
+_buffers = threading.local()
+
+
+class RenderBuffer():
+    """Buffer to collect rendered chunks in. Rejects output over a size limit
+    as soon as a chunk exceeds it instead of after the whole output is built.
+    """
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.size = 0
+        self.in_use = False
+
+    def write(self, chunk, max_size=None):
+        """Add a chunk.
+
+        Args:
+            chunk (str): Chunk
+            max_size (int): Maximum number of characters. None means no limit.
+
+        Raises:
+            exceptions.DispatchTooLargeError: Output is over the limit
+        """
+
+        self.size += len(chunk)
+        if max_size is not None and self.size > max_size:
+            raise exceptions.DispatchTooLargeError(self.size, max_size)
+        self.buffer.write(chunk)
+
+    def getvalue(self):
+        """Get output.
+
+        Returns:
+            str: Output
+        """
+
+        return self.buffer.getvalue()
+
+    def clear(self):
+        """Empty the buffer to reuse it and release its memory.
+        """
+
+        # Seeking back would first convert the accumulated output to 4 bytes per character.
+        self.buffer = io.StringIO()
+        self.size = 0
+
+
+@contextlib.contextmanager
+def get_render_buffer():
+    """Get an empty buffer. Renders on a thread reuse its buffer,
+    while nested and concurrent async renders get their own.
+
+    Yields:
+        RenderBuffer: Buffer
+    """
+
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or buffer.in_use:
+        buffer = RenderBuffer()
+        if not hasattr(_buffers, 'buffer'):
+            _buffers.buffer = buffer
+
+    buffer.in_use = True
+    try:
+        yield buffer
+    finally:
+        buffer.clear()
+        buffer.in_use = False
+
+
+def get_config_inputs(this_dispatch_config):
+    """Get config of a dispatch without values that change between runs.
+
+    Args:
+        this_dispatch_config (dict): Dispatch config
+
+    Returns:
+        dict: Dispatch config
+    """
+
+    return {key: value for key, value in this_dispatch_config.items() if key != 'action'}
+
+
+def render_template(template, context, max_size=None):
+    """Render a template with a context mapping without copying it.
+    jinja2.Template.render copies all variables into a new dict on every call.
+    Output is streamed into a reused buffer and rendering stops once it is over max_size.
+
+    Args:
+        template (jinja2.Template): Template.
+        context (collections.abc.Mapping): Context for the template.
+        max_size (int): Maximum number of characters. None means no limit.
+
+    Raises:
+        exceptions.DispatchTooLargeError: Output is over max_size
+
+    Returns:
+        str: Rendered template.
+    """
+
+    template_context = template.new_context(collections.ChainMap(context, template.globals),
+                                            shared=True)
+    with get_render_buffer() as buffer:
+        try:
+            for chunk in template.root_render_func(template_context):
+                buffer.write(chunk, max_size)
+        except exceptions.DispatchTooLargeError:
+            raise
+        except Exception:
+            return template.environment.handle_exception()
+
+        return buffer.getvalue()
+
+
+async def render_template_async_once(template, context, max_size=None):
+    """Async version of render_template for templates of an async environment.
+
+    Args:
+        template (jinja2.Template): Template.
+        context (collections.abc.Mapping): Context for the template.
+        max_size (int): Maximum number of characters. None means no limit.
+
+    Raises:
+        exceptions.DispatchTooLargeError: Output is over max_size
+
+    Returns:
+        str: Rendered template.
+    """
+
+    template_context = template.new_context(collections.ChainMap(context, template.globals),
+                                            shared=True)
+    with get_render_buffer() as buffer:
+        try:
+            async for chunk in template.root_render_func(template_context):
+                buffer.write(chunk, max_size)
+        except exceptions.DispatchTooLargeError:
+            raise
+        except Exception:
+            return template.environment.handle_exception()
+
+        return buffer.getvalue()
+
+
+async def render_template_async(template, context, max_size=None):
+    """Render a template of an async environment with its async filter calls run concurrently.
+    Jinja awaits filters one by one, so a first pass starts all async filter calls
+    without waiting and outputs placeholders for custom filters,
+    then a second pass renders with their results.
+    The second pass is skipped if the template calls no custom filter.
+
+    Args:
+        template (jinja2.Template): Template.
+        context (collections.abc.Mapping): Context for the template.
+        max_size (int): Maximum number of characters. None means no limit.
+
+    Raises:
+        exceptions.DispatchTooLargeError: Output is over max_size
+
+    Returns:
+        str: Rendered template.
+    """
+
+    calls = AsyncFilterCalls()
+    token = _filter_calls.set(calls)
+    try:
+        try:
+            rendered = await render_template_async_once(template, context, max_size)
+            if not calls.placeholders:
+                return rendered
+        except Exception:
+            # Errors before any placeholder is output are not caused by placeholders.
+            if not calls.placeholders:
+                raise
+
+        await asyncio.gather(*[call[3] for call in calls.calls], return_exceptions=True)
+        calls.prefetching = False
+        return await render_template_async_once(template, context, max_size)
+    finally:
+        _filter_calls.reset(token)
+
+
+def is_output_final():
+    """Tell whether the running render outputs real results of custom filters.
+    The first pass of an async render outputs placeholders once it calls one.
+
+    Returns:
+        bool: True if output is final
+    """
+
+    calls = _filter_calls.get()
+    return calls is None or not calls.prefetching or not calls.placeholders
+
+
+class AsyncFilterCalls():
+    """Custom filter calls made while rendering a template.
+    """
+
+    def __init__(self):
+        # Filter name, arguments, keyword arguments, and task of each async call
+        self.calls = []
+        # Whether async calls are started without waiting for them
+        self.prefetching = True
+        # Index of the next async call to take result of
+        self.index = 0
+        # Number of placeholders output while prefetching
+        self.placeholders = 0
+
+    def call(self, name, func, args, kwargs):
+        """Start or get result of an async filter call.
+
+        Args:
+            name (str): Filter name
+            func (func): Coroutine function of filter
+            args (tuple): Arguments
+            kwargs (dict): Keyword arguments
+
+        Returns:
+            Empty string placeholder when prefetching, else an awaitable of the result
+        """
+
+        if self.prefetching:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls.append((name, args, kwargs, task))
+            self.placeholders += 1
+            return ''
+
+        if self.index < len(self.calls):
+            call = self.calls[self.index]
+            self.index += 1
+            if call[:3] == (name, args, kwargs):
+                return call[3]
+
+        # Call differs from the first pass so run it now.
+        return func(*args, **kwargs)
+
+    def call_sync(self, func, args, kwargs):
+        """Run a sync filter call, or output a placeholder for it when prefetching.
+        Its arguments may be placeholders then, so running it would waste time
+        or fail on them.
+
+        Args:
+            func (func): Filter
+            args (tuple): Arguments
+            kwargs (dict): Keyword arguments
+
+        Returns:
+            Empty string placeholder when prefetching, else the result
+        """
+
+        if self.prefetching:
+            self.placeholders += 1
+            return ''
+
+        return func(*args, **kwargs)
+
+
+def wrap_async_filter(name, func):
+    """Make an async filter start concurrently with other async filter calls of a render.
+
+    Args:
+        name (str): Filter name
+        func (func): Coroutine function of filter
+
+    Returns:
+        func: Filter
+    """
+
+    @functools.wraps(func)
+    def prefetching_filter(*args, **kwargs):
+        calls = _filter_calls.get()
+        if calls is None:
+            # Called outside a render when Jinja folds constants at compile time.
+            raise jinja2.nodes.Impossible
+        return calls.call(name, func, args, kwargs)
+
+    return prefetching_filter
+
+
+def wrap_sync_filter(func):
+    """Make a sync filter of an async environment run only in the last render pass.
+
+    Args:
+        func (func): Filter
+
+    Returns:
+        func: Filter
+    """
+
+    @functools.wraps(func)
+    def deferred_filter(*args, **kwargs):
+        calls = _filter_calls.get()
+        if calls is None:
+            return func(*args, **kwargs)
+        return calls.call_sync(func, args, kwargs)
+
+    return deferred_filter
+
+
+def check_size(text):
+    """Reject a rendered dispatch longer than NationStates allows.
+
+    Args:
+        text (str): Rendered dispatch
+
+    Raises:
+        exceptions.DispatchTooLargeError: Text is over the size limit
+    """
+
+    if len(text) > DISPATCH_SIZE_LIMIT:
+        raise exceptions.DispatchTooLargeError(len(text), DISPATCH_SIZE_LIMIT)
+
+
+@contextlib.contextmanager
+def log_size_error(name):
+    """Log dispatches rejected for their size.
+
+    Args:
+        name (str): Dispatch name
+    """
+
+    try:
+        yield
+    except exceptions.DispatchTooLargeError as err:
+        logger.error('Dispatch "%s" is over %d characters. Stopped rendering at %d characters.',
+                     name, err.max_size, err.size)
+        raise
+
+
+def get_compiled_filename(name, source, is_async=False):
+    """Get file name of a precompiled template module.
+    Keyed by template source so that outdated modules are never used.
+
+    Args:
+        name (str): Template name
+        source (str): Template source
+        is_async (bool): Template is compiled for an async environment
+
+    Returns:
+        str: File name
+    """
+
+    key = '{}\0{}\0{}'.format(name, is_async, source)
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return '{}{}.py'.format(COMPILED_TEMPLATE_PREFIX, key)
+
+
 class DispatchJinjaLoader(jinja2.BaseLoader):
     """Wrapper around dispatch loader for Jinja environment.
     """
@@ -21,6 +395,8 @@ class DispatchJinjaLoader(jinja2.BaseLoader):
         self.dispatch_loader = dispatch_loader
 
     def get_source(self, environment, template):
+        # Get version first so that a change while reading text is not missed.
+        version = self.dispatch_loader.get_dispatch_version(template)
         try:
             text = self.dispatch_loader.get_dispatch_text(template)
         except exceptions.DispatchTextNotFound as err:
@@ -28,7 +404,65 @@ class DispatchJinjaLoader(jinja2.BaseLoader):
                 logger.error('Text %s "%s" of dispatch "%s" not found.')
             raise exceptions.DispatchRenderingError from err
 
-        return text, template, lambda: True
+        if version is None:
+            # Loader cannot tell when the text changes.
+            return text, template, lambda: True
+
+        return text, template, lambda: self.dispatch_loader.get_dispatch_version(template) == version
+
+
+class PrecompiledJinjaLoader(DispatchJinjaLoader):
+    """Dispatch loader wrapper that imports templates precompiled by "nsadm compile"
+    instead of parsing their sources. Falls back to sources of templates
+    that are not precompiled or changed since.
+
+    Args:
+        dispatch_loader: Dispatch loader
+        compiled_path (str): Directory of precompiled template modules
+    """
+
+    def __init__(self, dispatch_loader, compiled_path):
+        super().__init__(dispatch_loader)
+        self.compiled_path = pathlib.Path(compiled_path)
+
+    def load(self, environment, name, globals=None):
+        source, _, uptodate = self.get_source(environment, name)
+        filename = get_compiled_filename(name, source, environment.is_async)
+        module_path = self.compiled_path / filename
+        if not module_path.exists():
+            logger.debug('Template "%s" is not precompiled. Compile its source.', name)
+            return super().load(environment, name, globals)
+
+        module = utils.load_module(module_path, filename[:-len('.py')])
+        template = environment.template_class.from_module_dict(environment, vars(module), globals)
+        # Templates from modules are always up to date by default.
+        template._uptodate = uptodate
+        logger.debug('Loaded precompiled template "%s"', name)
+        return template
+
+
+class AtomicBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """Filesystem bytecode cache that replaces cache files atomically
+    so that render processes sharing it never read a partly written file.
+
+    Args:
+        directory (str): Cache directory
+    """
+
+    def __init__(self, directory):
+        pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+        super().__init__(str(directory))
+
+    def dump_bytecode(self, bucket):
+        cache_path = self._get_cache_filename(bucket)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
 
 class TemplateRenderer():
@@ -37,14 +471,46 @@ class TemplateRenderer():
         Args:
             dispatch_loader (str): Dispatch loader plugin.
             filter_path (str): Path to filters file.
+            bytecode_cache_path (str): Directory to cache compiled templates in.
+            None disables the cache.
+            compiled_path (str): Directory of templates precompiled by "nsadm compile".
+            enable_async (bool): Render in Jinja async mode which allows async filters.
+            profiler (nsadm.profiler.RenderProfiler): Profiler to record filter calls in.
+            fragment_cache_path (str): Directory to cache {% cache %} blocks in.
+            None disables the cache.
+            fragment_cache_size (int): Maximum total size in bytes of cached blocks.
+            max_size (int): Maximum number of characters of rendered templates.
+            None means no limit.
     """
 
-    def __init__(self, dispatch_loader, filter_path):
+    def __init__(self, dispatch_loader, filter_path, bytecode_cache_path=None, compiled_path=None,
+                 enable_async=False, profiler=None, fragment_cache_path=None,
+                 fragment_cache_size=fragment_cache.DEFAULT_MAX_SIZE, max_size=None):
         self.filter_path = filter_path
-        template_loader = DispatchJinjaLoader(dispatch_loader)
+        self.max_size = max_size
+        self.profiler = profiler
+        if compiled_path:
+            template_loader = PrecompiledJinjaLoader(dispatch_loader, compiled_path)
+        else:
+            template_loader = DispatchJinjaLoader(dispatch_loader)
         # Make access to undefined context variables generate logs.
         undef = jinja2.make_logging_undefined(logger=logger)
-        self.env = jinja2.Environment(loader=template_loader, trim_blocks=True, undefined=undef)
+        bytecode_cache = None
+        if bytecode_cache_path:
+            # Jinja does not tell async and sync bytecode apart.
+            if enable_async:
+                bytecode_cache_path = pathlib.Path(bytecode_cache_path, 'async')
+            bytecode_cache = AtomicBytecodeCache(bytecode_cache_path)
+        self.env = jinja2.Environment(loader=template_loader, trim_blocks=True, undefined=undef,
+                                      bytecode_cache=bytecode_cache, enable_async=enable_async,
+                                      extensions=[fragment_cache.FragmentCacheExtension])
+        if fragment_cache_path:
+            self.env.fragment_cache = fragment_cache.FragmentCache(fragment_cache_path,
+                                                                   fragment_cache_size)
+            # Blocks rendered with placeholders in the first pass of async renders are not cached.
+            self.env.fragment_cache_writable = is_output_final
+        # Template name and its source hash, referenced variables and referenced templates
+        self.template_deps = {}
 
     def load_filters(self):
         """Load all filters if filter path is set.
@@ -56,24 +522,201 @@ class TemplateRenderer():
                 logger.info('Filter file not found!')
             else:
                 loaded_filters = {}
-                for jinja_filter in filters:
-                    loaded_filters[jinja_filter[0]] = jinja_filter[1]
-                    logger.debug('Loaded filter "%s"', jinja_filter[0])
+                for name, func in filters:
+                    if self.profiler is not None:
+                        func = self.profiler.wrap('filter', name, func)
+                    if inspect.iscoroutinefunction(func):
+                        if not self.env.is_async:
+                            logger.error('Async filter "%s" needs enable_async.', name)
+                            continue
+                        func = wrap_async_filter(name, func)
+                    elif self.env.is_async:
+                        func = wrap_sync_filter(func)
+                    loaded_filters[name] = func
+                    logger.debug('Loaded filter "%s"', name)
                 self.env.filters.update(loaded_filters)
                 logger.debug('Loaded all custom filters')
 
+    def get_template_deps(self, name):
+        """Get source hash and direct dependencies of a template.
+
+        Args:
+            name (str): Template name.
+
+        Returns:
+            tuple: Source hash, referenced variable names, and referenced template names.
+            Dynamically referenced templates are None.
+        """
+
+        if name not in self.template_deps:
+            source, _, _ = self.env.loader.get_source(self.env, name)
+            ast = self.env.parse(source)
+            self.template_deps[name] = (utils.get_data_hash(source),
+                                        jinja2.meta.find_undeclared_variables(ast),
+                                        list(jinja2.meta.find_referenced_templates(ast)))
+
+        return self.template_deps[name]
+
+    def get_dependencies(self, name):
+        """Get all templates a dispatch template includes, imports or extends,
+        and variables they reference.
+
+        Args:
+            name (str): Dispatch template name.
+
+        Returns:
+            tuple|None: Template names and their source hash, and referenced variable names.
+            None if a template is referenced dynamically or cannot be loaded.
+        """
+
+        sources = {}
+        variables = set()
+        pending = [name]
+        while pending:
+            template_name = pending.pop()
+            if template_name in sources:
+                continue
+
+            try:
+                source_hash, template_vars, refs = self.get_template_deps(template_name)
+            except (exceptions.DispatchRenderingError, jinja2.TemplateSyntaxError):
+                return None
+            if None in refs:
+                return None
+
+            sources[template_name] = source_hash
+            variables.update(template_vars)
+            pending.extend(refs)
+
+        return sources, variables
+
+    def get_reachable_templates(self, names):
+        """Get dispatch templates and all templates they statically reference.
+
+        Args:
+            names (list): Dispatch template names.
+
+        Returns:
+            list: Template names.
+        """
+
+        reachable = []
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in reachable:
+                continue
+
+            try:
+                _, _, refs = self.get_template_deps(name)
+            except exceptions.DispatchRenderingError:
+                continue
+            except jinja2.TemplateSyntaxError as err:
+                logger.error('Template "%s" has syntax error: %s', name, err)
+                continue
+
+            reachable.append(name)
+            pending.extend(ref for ref in refs if ref is not None)
+
+        return reachable
+
+    def compile_templates(self, names, target):
+        """Compile dispatch templates and templates they reference into Python modules.
+
+        Args:
+            names (list): Dispatch template names.
+            target (str): Directory to write modules to.
+
+        Returns:
+            int: Number of compiled templates.
+        """
+
+        target = pathlib.Path(target)
+        target.mkdir(parents=True, exist_ok=True)
+
+        filenames = set()
+        for name in self.get_reachable_templates(names):
+            source, filename, _ = self.env.loader.get_source(self.env, name)
+            code = self.env.compile(source, name, filename, raw=True, defer_init=True)
+            compiled_filename = get_compiled_filename(name, source, self.env.is_async)
+            (target / compiled_filename).write_text(code, encoding='utf-8')
+            filenames.add(compiled_filename)
+            logger.debug('Compiled template "%s"', name)
+
+        # Remove modules of templates that have changed or are gone.
+        for module_path in target.glob('{}*.py'.format(COMPILED_TEMPLATE_PREFIX)):
+            if module_path.name not in filenames:
+                module_path.unlink()
+
+        return len(filenames)
+
+    def load_template(self, name):
+        """Load and compile a dispatch template.
+
+        Args:
+            name (str): Dispatch template name.
+
+        Returns:
+            jinja2.Template: Template.
+        """
+
+        return self.env.get_template(name)
+
+    def render_template(self, template, context):
+        """Render a loaded template. Runs an event loop in async mode,
+        so it must not be called from a running one.
+
+        Args:
+            template (jinja2.Template): Template.
+            context (collections.abc.Mapping): Context for the template.
+
+        Raises:
+            exceptions.DispatchTooLargeError: Output is over the size limit
+            RuntimeError: Called from a running event loop in async mode
+
+        Returns:
+            str: Rendered template.
+        """
+
+        if self.env.is_async:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(render_template_async(template, context, self.max_size))
+            raise RuntimeError('Templates with async filters cannot be rendered synchronously '
+                               'from a running event loop. Use render_async instead.')
+
+        return render_template(template, context, self.max_size)
+
     def render(self, name, context):
         """Render a dispatch template.
 
         Args:
             name (str): Dispatch template name.
-            context (dict): Context for the template.
+            context (collections.abc.Mapping): Context for the template.
 
         Returns:
             str: Rendered template.
         """
 
-        return self.env.get_template(name).render(context)
+        return self.render_template(self.load_template(name), context)
+
+    async def render_async(self, name, context):
+        """Render a dispatch template without blocking the event loop on async filters.
+
+        Args:
+            name (str): Dispatch template name.
+            context (collections.abc.Mapping): Context for the template.
+
+        Returns:
+            str: Rendered template.
+        """
+
+        template = self.load_template(name)
+        if self.env.is_async:
+            return await render_template_async(template, context, self.max_size)
+
+        return render_template(template, context, self.max_size)
 
 
 class DispatchRenderer():
@@ -84,48 +727,237 @@ class DispatchRenderer():
         var_loader: Var loader
         bb_config (dict): BBCode parser configuration
         template_config (dict): Template renderer configuration
+        profiler (nsadm.profiler.RenderProfiler): Profiler to record render times in
     """
 
-    def __init__(self, dispatch_loader, var_loader, bb_config, template_config):
+    def __init__(self, dispatch_loader, var_loader, bb_config, template_config, profiler=None):
         self.template_renderer = TemplateRenderer(dispatch_loader,
-                                                  template_config.get('filter_path', None))
+                                                  template_config.get('filter_path', None),
+                                                  template_config.get('bytecode_cache_path', None),
+                                                  template_config.get('compiled_path', None),
+                                                  template_config.get('enable_async', False),
+                                                  profiler,
+                                                  template_config.get('fragment_cache_path', None),
+                                                  template_config.get('fragment_cache_size',
+                                                                      fragment_cache.DEFAULT_MAX_SIZE),
+                                                  template_config.get('max_template_size',
+                                                                      DISPATCH_SIZE_LIMIT))
 
         self.bb_parser = bb_parser.BBParser(bb_config.get('simple_formatter_path', None),
                                             bb_config.get('complex_formatter_path', None),
-                                            bb_config.get('complex_formatter_config_path', None))
+                                            bb_config.get('complex_formatter_config_path', None),
+                                            profiler,
+                                            bb_config.get('engine', bb_parser.DEFAULT_ENGINE),
+                                            bb_config.get('cache_path', None),
+                                            bb_config.get('cache_size',
+                                                          fragment_cache.DEFAULT_MAX_SIZE),
+                                            formatter_cache_size=bb_config.get(
+                                                'formatter_cache_size', filter_cache.DEFAULT_MAX_SIZE),
+                                            parallel_workers=bb_config.get('parallel_workers', 0),
+                                            parallel_min_size=bb_config.get(
+                                                'parallel_min_size', bb_parser.DEFAULT_PARALLEL_MIN_SIZE))
 
         self.var_loader = var_loader
+        self.profiler = profiler
+        # Load only variables templates of the dispatches to render reference.
+        self.load_used_vars_only = template_config.get('load_used_vars_only', False)
+
+        # Context all dispatches will have. Read-only once loaded
+        # so that renders can share it without copying.
+        self.global_context = types.MappingProxyType({})
 
-        # Context all dispatches will have
-        self.global_context = {}
+        # Hash of filter and formatter files
+        self.code_hash = None
+        # Hash of dispatch info without actions
+        self.dispatch_info_hash = None
+        # Hash of loaded variables
+        self.vars_hash = None
 
-    def load(self, dispatch_config):
+    def get_used_vars(self, dispatch_config, dispatches):
+        """Get names of variables templates of dispatches reference.
+
+        Args:
+            dispatch_config (dict): Dispatch config
+            dispatches (list): Dispatch names. Empty list means all.
+
+        Returns:
+            set|None: Variable names or None if a template cannot be analyzed
+        """
+
+        used_vars = set()
+        for nation_dispatch_config in dispatch_config.values():
+            for name in nation_dispatch_config:
+                if dispatches and name not in dispatches:
+                    continue
+                deps = self.template_renderer.get_dependencies(name)
+                if deps is None:
+                    logger.debug('Could not find variables dispatch "%s" uses', name)
+                    return None
+                used_vars.update(deps[1])
+
+        return used_vars
+
+    def load(self, dispatch_config, dispatches=None):
         """Load template renderer filters, BBCode formatters, and setup context.
         Args:
             dispatch_config (dict): Dispatch config
+            dispatches (list): Dispatch names to render. Empty list means all.
+            If given with load_used_vars_only, only variables their templates use are loaded.
         """
 
         self.template_renderer.load_filters()
         self.bb_parser.load_formatters()
 
-        self.global_context = self.var_loader.get_all_vars()
-        self.global_context['dispatch_info'] = utils.get_dispatch_info(dispatch_config)
+        used_vars = None
+        if self.load_used_vars_only and dispatches is not None:
+            used_vars = self.get_used_vars(dispatch_config, dispatches)
+        global_context = self.var_loader.get_all_vars(used_vars)
+        global_context['dispatch_info'] = utils.get_dispatch_info(dispatch_config)
+        self.global_context = types.MappingProxyType(global_context)
+
+        self.code_hash = utils.get_files_hash([self.template_renderer.filter_path,
+                                               self.bb_parser.simple_formatter_path,
+                                               self.bb_parser.complex_formatter_path,
+                                               self.bb_parser.complex_formatter_config_path])
+        self.dispatch_info_hash = None
+        self.vars_hash = None
 
-    def render(self, name):
+    def get_dispatch_info_hash(self):
+        """Get hash of dispatch info without actions.
+        Computed on first use since only input hashes of templates using it need it.
+
+        Returns:
+            str: Hash
+        """
+
+        if self.dispatch_info_hash is None:
+            self.dispatch_info_hash = utils.get_data_hash(
+                {name: get_config_inputs(config)
+                 for name, config in self.global_context['dispatch_info'].items()})
+
+        return self.dispatch_info_hash
+
+    def get_context_hash(self, name):
+        """Get hash of the context BBCode formatters get when rendering a dispatch.
+        None if formatted texts are not cached.
+
+        Args:
+            name (str): Dispatch name.
+
+        Returns:
+            str|None: Hash
+        """
+
+        if self.bb_parser.cache is None:
+            return None
+
+        if self.vars_hash is None:
+            self.vars_hash = utils.get_data_hash({key: value
+                                                  for key, value in self.global_context.items()
+                                                  if key != 'dispatch_info'})
+
+        return utils.get_data_hash([name, self.vars_hash, self.get_dispatch_info_hash()])
+
+    def get_input_hash(self, name, this_dispatch_config):
+        """Get hash of everything rendering a dispatch depends on: its templates,
+        the variables they use, filter and formatter files, and its config.
+
+        Args:
+            name (str): Dispatch name.
+            this_dispatch_config (dict): This dispatch's config.
+
+        Returns:
+            str|None: Hash or None if dependencies cannot be determined.
+        """
+
+        deps = self.template_renderer.get_dependencies(name)
+        if deps is None:
+            return None
+
+        sources, variables = deps
+        used_vars = {}
+        for var in variables:
+            if var == 'dispatch_info':
+                used_vars[var] = self.get_dispatch_info_hash()
+            elif var in self.global_context:
+                used_vars[var] = self.global_context[var]
+
+        return utils.get_data_hash({'templates': sources,
+                                    'vars': used_vars,
+                                    'code': self.code_hash,
+                                    'config': get_config_inputs(this_dispatch_config)})
+
+    def render(self, name, timings=None):
         """Render a dispatch.
 
         Args:
             name (str): Dispatch name.
+            timings (dict): If given, filled with seconds spent on each render stage.
+
+        Raises:
+            exceptions.DispatchTooLargeError: Dispatch is longer than NationStates allows
 
         Returns:
             str: Rendered dispatch.
         """
 
-        context = self.global_context
-        context['current_dispatch'] = name
+        # Per-render values are layered over the shared context instead of copying it.
+        context = collections.ChainMap({'current_dispatch': name}, self.global_context)
+
+        start = time.perf_counter()
+        template = self.template_renderer.load_template(name)
+        loaded = time.perf_counter()
+        with log_size_error(name):
+            rendered = self.template_renderer.render_template(template, context)
+            templated = time.perf_counter()
+            rendered = self.bb_parser.format_with_context(rendered, context,
+                                                          self.get_context_hash(name))
+            formatted = time.perf_counter()
+            check_size(rendered)
+
+        if timings is None:
+            timings = {}
+        timings['load'] = loaded - start
+        timings['template'] = templated - loaded
+        timings['bbcode'] = formatted - templated
+        if self.profiler is not None:
+            self.profiler.record_dispatch(name, timings)
+
+        logger.debug('Rendered dispatch "%s"', name)
+
+        return rendered
+
+    async def render_async(self, name):
+        """Render a dispatch from an event loop. In async mode async filters are awaited
+        on the loop, otherwise the whole render runs in a worker thread.
+
+        Args:
+            name (str): Dispatch name.
+
+        Raises:
+            exceptions.DispatchTooLargeError: Dispatch is longer than NationStates allows
+
+        Returns:
+            str: Rendered dispatch.
+        """
 
-        rendered = self.template_renderer.render(name, context)
-        rendered = self.bb_parser.format(rendered, **context)
+        loop = asyncio.get_running_loop()
+        if not self.template_renderer.env.is_async:
+            return await loop.run_in_executor(None, self.render, name)
+
+        context = collections.ChainMap({'current_dispatch': name}, self.global_context)
+        start = time.perf_counter()
+        with log_size_error(name):
+            rendered = await self.template_renderer.render_async(name, context)
+            templated = time.perf_counter()
+            rendered = await loop.run_in_executor(None, self.bb_parser.format_with_context,
+                                                  rendered, context, self.get_context_hash(name))
+            formatted = time.perf_counter()
+            check_size(rendered)
+
+        if self.profiler is not None:
+            self.profiler.record_dispatch(name, {'template': templated - start,
+                                                 'bbcode': formatted - templated})
 
         logger.debug('Rendered dispatch "%s"', name)
 
@@ -1,6 +1,10 @@
 """Updates dispatches based on dispatch config from dispatch loader.
 """
 
+import contextlib
+import functools
+import hashlib
+import json
 import logging
 
 from nsadm import info
@@ -42,6 +46,113 @@ def get_category_number(category, subcategory):
     return category_num, subcategory_num
 
 
+def get_payload_hash(dispatch_id, params):
+    """Get hash of a dispatch's content to detect unchanged dispatches.
+
+    Args:
+        dispatch_id (str): Dispatch ID
+        params (dict): Dispatch parameters
+
+    Returns:
+        str: Hash
+    """
+
+    payload = json.dumps([str(dispatch_id), params['title'], params['text'],
+                          params['category'], params['subcategory']])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LoggedParams():
+    """Format dispatch parameters for logs with text length in place of the text.
+    Formatting is deferred until a log record is emitted.
+
+    Args:
+        params (dict): Dispatch parameters
+    """
+
+    def __init__(self, params):
+        self.params = params
+
+    def __str__(self):
+        params = {key: value for key, value in self.params.items() if key != 'text'}
+        params['text'] = '<{} characters>'.format(len(self.params.get('text', '')))
+        return repr(params)
+
+
+@contextlib.contextmanager
+def log_api_errors(name, dispatch_id):
+    """Log and suppress dispatch API errors while updating a dispatch.
+
+    Args:
+        name (str): Dispatch name
+        dispatch_id (str): Dispatch ID
+    """
+
+    try:
+        yield
+    except exceptions.UnknownDispatchError:
+        logger.error('Could not find dispatch "%s" with id "%s".', name, dispatch_id)
+    except exceptions.NotOwnerDispatchError:
+        logger.error('Dispatch "%s" is not owned by this nation.', name)
+    except exceptions.RateLimitError:
+        logger.error('Could not update dispatch "%s" due to rate limit.', name)
+    except exceptions.DispatchAPIError:
+        logger.exception('Dispatch API error')
+
+
+def run_steps(steps):
+    """Run update steps, calling the functions they yield for API calls and rendering.
+    Results and exceptions of the functions are sent back into the steps.
+
+    Args:
+        steps (generator): Update steps
+
+    Returns:
+        Return value of the steps
+    """
+
+    result = None
+    error = None
+    while True:
+        try:
+            func = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+
+        result = None
+        error = None
+        try:
+            result = func()
+        except Exception as err:
+            error = err
+
+
+async def run_steps_async(steps):
+    """Run update steps, awaiting the coroutine functions they yield.
+
+    Args:
+        steps (generator): Update steps
+
+    Returns:
+        Return value of the steps
+    """
+
+    result = None
+    error = None
+    while True:
+        try:
+            func = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+
+        result = None
+        error = None
+        try:
+            result = await func()
+        except Exception as err:
+            error = err
+
+
 class DispatchUpdater():
     """Update a dispatch.
 
@@ -50,14 +161,70 @@ class DispatchUpdater():
         creds (dict): Nation login credentials
         renderer (nsadm.renderer.Renderer): Renderer
         dispatch_loader (nsadm.loader.DispatchLoader): Dispatch loader
+        force (bool): Edit dispatches even if their content is unchanged
+        sessions (nsadm.utils.SessionCache): Cached login sessions
+        journal (nsadm.journal.UpdateJournal): Journal to record completed updates in
     """
 
-    def __init__(self, dispatch_api, creds, renderer, dispatch_loader):
+    def __init__(self, dispatch_api, creds, renderer, dispatch_loader,
+                 force=False, sessions=None, journal=None):
         self.dispatch_api = dispatch_api
         self.renderer = renderer
         self.dispatch_loader = dispatch_loader
         self.dispatch_config = None
         self.creds = creds
+        self.force = force
+        self.sessions = sessions
+        self.journal = journal
+        self.owner_nation = None
+        # Pin of the login session last cached or reused
+        self.session_pin = None
+
+    def resume_session(self, owner_nation):
+        """Reuse a cached login session of a nation if possible.
+
+        Args:
+            owner_nation (str): Nation name
+
+        Returns:
+            bool: True if a cached session is reused
+        """
+
+        if self.sessions is None:
+            return False
+
+        pin = self.sessions.get_pin(owner_nation)
+        if pin is None:
+            return False
+
+        self.dispatch_api.resume_session(owner_nation, self.creds[owner_nation], pin)
+        self.session_pin = pin
+        logger.debug('Reused cached session of nation "%s".', owner_nation)
+        return True
+
+    def cache_session(self, owner_nation):
+        """Cache login session of a nation.
+
+        Args:
+            owner_nation (str): Nation name
+        """
+
+        if self.sessions is not None:
+            self.session_pin = self.dispatch_api.get_pin()
+            self.sessions.add(owner_nation, self.session_pin)
+
+    def refresh_session(self):
+        """Cache login session of the owner nation again if the API logged in again
+        since the session was cached, such as after a reused session expired.
+        """
+
+        if self.sessions is None or self.owner_nation is None:
+            return
+
+        pin = self.dispatch_api.get_pin()
+        if pin is not None and pin != self.session_pin:
+            self.cache_session(self.owner_nation)
+            logger.debug('Cached new session of nation "%s".', self.owner_nation)
 
     def login_owner_nation(self, owner_nation, dispatch_config):
         """Log into dispatch owner nation and set its dispatches' info.
@@ -67,38 +234,80 @@ class DispatchUpdater():
             dispatch_config (dict): Nation's dispatch config
         """
 
-        self.dispatch_api.login(owner_nation, autologin=self.creds[owner_nation])
+        run_steps(self.login_steps(owner_nation, dispatch_config))
+
+    def login_steps(self, owner_nation, dispatch_config):
+        """Steps to log into dispatch owner nation and set its dispatches' info.
+
+        Args:
+            owner_nation (str): Nation name
+            dispatch_config (dict): Nation's dispatch config
+        """
+
+        if not self.resume_session(owner_nation):
+            yield functools.partial(self.dispatch_api.login, owner_nation,
+                                    autologin=self.creds[owner_nation])
+            self.cache_session(owner_nation)
+        self.owner_nation = owner_nation
         self.dispatch_config = dispatch_config
 
-    def update_dispatch(self, name):
-        """Update a dispatch.
+    def pop_action(self, name):
+        """Get and remove the action of a dispatch from its config.
 
         Args:
             name (str): Dispatch name
+
+        Returns:
+            str|None: Action or None if the dispatch does not have one
         """
 
-        this_dispatch_config = self.dispatch_config[name]
         try:
-            action = this_dispatch_config.pop('action')
+            return self.dispatch_config[name].pop('action')
         except KeyError as err:
             logger.error('Dispatch "%s" does not have %s.', name, err)
+            return None
 
-        try:
+    def update_dispatch(self, name):
+        """Update a dispatch.
+
+        Args:
+            name (str): Dispatch name
+
+        Returns:
+            bool: True if the dispatch was updated successfully
+        """
+
+        return run_steps(self.update_steps(name))
+
+    def update_steps(self, name):
+        """Steps to update a dispatch.
+
+        Args:
+            name (str): Dispatch name
+
+        Returns:
+            bool: True if the dispatch was updated successfully
+        """
+
+        action = self.pop_action(name)
+        if action is None:
+            return False
+
+        this_dispatch_config = self.dispatch_config[name]
+        dispatch_id = this_dispatch_config.get('ns_id')
+        with log_api_errors(name, dispatch_id):
             if action == 'remove':
-                dispatch_id = this_dispatch_config['ns_id']
                 logger.debug('Remove dispatch "%s" with id "%s".', name, dispatch_id)
-                self.remove_dispatch(dispatch_id)
+                yield functools.partial(self.remove_dispatch, dispatch_id)
                 logger.info('Removed dispatch "%s".', name)
-            elif action in ('edit', 'create'):
-                self.create_or_edit_dispatch(name, action, this_dispatch_config)
-            else:
-                logger.error('Invalid action "%s" on dispatch "%s".', action, name)
-        except exceptions.UnknownDispatchError:
-            logger.error('Could not find dispatch "%s" with id "%s".', name, dispatch_id)
-        except exceptions.NotOwnerDispatchError:
-            logger.error('Dispatch "%s" is not owned by this nation.', name)
-        except exceptions.DispatchAPIError:
-            logger.exception('Dispatch API error')
+                self.record_update(name, action, dispatch_id)
+                return True
+            if action in ('edit', 'create'):
+                return (yield functools.partial(self.create_or_edit_dispatch,
+                                                name, action, this_dispatch_config))
+            logger.error('Invalid action "%s" on dispatch "%s".', action, name)
+
+        return False
 
     def get_dispatch_text(self, name):
         """Get rendered text for a dispatch.
@@ -112,13 +321,15 @@ class DispatchUpdater():
 
         return self.renderer.render(name)
 
-    def create_or_edit_dispatch(self, name, action, this_dispatch_config):
-        """Create or edit a dispatch based on action.
+    def get_dispatch_params(self, name, this_dispatch_config):
+        """Get title and category numbers of a dispatch.
 
         Args:
             name (str): Dispatch name
-            action (str): Action to perform
             this_dispatch_config (dict): This dispatch's info
+
+        Returns:
+            dict|None: Dispatch parameters without text or None if its config is invalid
         """
 
         try:
@@ -127,50 +338,123 @@ class DispatchUpdater():
             title = this_dispatch_config['title']
         except KeyError as err:
             logger.error('Dispatch "%s" does not have %s.', name, err)
-            return
+            return None
 
         try:
             category_num, subcategory_num = get_category_number(category, subcategory)
         except exceptions.NonexistentCategoryError as err:
             logger.error('Text %s "%s" of dispatch "%s" not found.',
                          err.category_type, err.category_value, name)
-            return
+            return None
 
-        try:
-            text = self.get_dispatch_text(name)
-        except exceptions.DispatchRenderingError as err:
-            return
+        return {'title': title,
+                'category': category_num,
+                'subcategory': subcategory_num}
 
-        params = {'title': title,
-                  'text': text,
-                  'category': category_num,
-                  'subcategory': subcategory_num}
+    def is_unchanged(self, name, dispatch_id, params):
+        """Check if a dispatch's content is the same as when it was last pushed.
+
+        Args:
+            name (str): Dispatch name
+            dispatch_id (str): Dispatch ID
+            params (dict): Dispatch parameters
+
+        Returns:
+            bool
+        """
+
+        if self.force:
+            return False
+
+        if self.dispatch_loader.get_dispatch_hash(name) == get_payload_hash(dispatch_id, params):
+            logger.info('Dispatch "%s" is unchanged. Skipped.', name)
+            return True
+
+        return False
+
+    def record_update(self, name, action, dispatch_id, dispatch_hash=None):
+        """Record a completed dispatch update.
+
+        Args:
+            name (str): Dispatch name
+            action (str): Action done
+            dispatch_id (str): Dispatch ID
+            dispatch_hash (str): Hash of pushed content
+        """
+
+        if dispatch_hash is not None:
+            self.dispatch_loader.set_dispatch_hash(name, dispatch_hash)
+        if self.journal is not None:
+            self.journal.record(name, action, dispatch_id, dispatch_hash)
+
+    def create_or_edit_dispatch(self, name, action, this_dispatch_config):
+        """Create or edit a dispatch based on action.
+
+        Args:
+            name (str): Dispatch name
+            action (str): Action to perform
+            this_dispatch_config (dict): This dispatch's info
+
+        Returns:
+            bool: True if the dispatch was created or edited successfully
+        """
+
+        return run_steps(self.create_or_edit_steps(name, action, this_dispatch_config))
+
+    def create_or_edit_steps(self, name, action, this_dispatch_config):
+        """Steps to create or edit a dispatch based on action.
+
+        Args:
+            name (str): Dispatch name
+            action (str): Action to perform
+            this_dispatch_config (dict): This dispatch's info
+
+        Returns:
+            bool: True if the dispatch was created or edited successfully
+        """
+
+        params = self.get_dispatch_params(name, this_dispatch_config)
+        if params is None:
+            return False
+
+        try:
+            params['text'] = yield functools.partial(self.get_dispatch_text, name)
+        except exceptions.DispatchRenderingError:
+            return False
 
         if action == 'create':
-            logger.debug('Create dispatch "%s" with params: %r', name, params)
-            self.create_dispatch(name, params)
+            logger.debug('Create dispatch "%s" with params: %s', name, LoggedParams(params))
+            dispatch_id = yield functools.partial(self.create_dispatch, params)
+            logger.debug('Got id "%s" of new dispatch "%s".', dispatch_id, name)
+            self.dispatch_loader.add_dispatch_id(name, dispatch_id)
             logger.info('Created dispatch "%s".', name)
         elif action == 'edit':
             dispatch_id = this_dispatch_config['ns_id']
-            logger.debug('Edit dispatch "%s" with id "%s" and with params: %r',
-                         name, dispatch_id, params)
-            self.edit_dispatch(dispatch_id, params)
+            if self.is_unchanged(name, dispatch_id, params):
+                return True
+
+            logger.debug('Edit dispatch "%s" with id "%s" and with params: %s',
+                         name, dispatch_id, LoggedParams(params))
+            yield functools.partial(self.edit_dispatch, dispatch_id, params)
             logger.info('Edited dispatch "%s".', name)
 
-    def create_dispatch(self, name, params):
+        self.record_update(name, action, dispatch_id, get_payload_hash(dispatch_id, params))
+        return True
+
+    def create_dispatch(self, params):
         """Create a dispatch.
 
         Args:
-            name (str): Dispatch name
             params (dict): Dispatch parameters
+
+        Returns:
+            str: New dispatch ID
         """
 
-        new_dispatch_id = self.dispatch_api.create_dispatch(title=params['title'],
-                                                            text=params['text'],
-                                                            category=params['category'],
-                                                            subcategory=params['subcategory'])
-        logger.debug('Got id "%s" of new dispatch "%s".', new_dispatch_id, name)
-        self.dispatch_loader.add_dispatch_id(name, new_dispatch_id)
+        return self.dispatch_api.create_dispatch(title=params['title'],
+                                                 text=params['text'],
+                                                 category=params['category'],
+                                                 subcategory=params['subcategory'])
 
     def edit_dispatch(self, dispatch_id, params):
         """Edit a dispatch.
@@ -194,3 +478,99 @@ class DispatchUpdater():
         """
 
         self.dispatch_api.remove_dispatch(dispatch_id)
+
+
+class AsyncDispatchUpdater(DispatchUpdater):
+    """Update a dispatch with an asynchronous dispatch API.
+
+    Args:
+        dispatch_api (nsadm.async_api_adapter.AsyncDispatchAPI): Async dispatch API adapter
+        Others are the same as DispatchUpdater
+    """
+
+    async def login_owner_nation(self, owner_nation, dispatch_config):
+        """Log into dispatch owner nation and set its dispatches' info.
+
+        Args:
+            owner_nation (str): Nation name
+            dispatch_config (dict): Nation's dispatch config
+        """
+
+        await run_steps_async(self.login_steps(owner_nation, dispatch_config))
+
+    async def update_dispatch(self, name):
+        """Update a dispatch.
+
+        Args:
+            name (str): Dispatch name
+
+        Returns:
+            bool: True if the dispatch was updated successfully
+        """
+
+        return await run_steps_async(self.update_steps(name))
+
+    async def get_dispatch_text(self, name):
+        """Get rendered text for a dispatch without blocking the event loop.
+
+        Args:
+            name (str): Dispatch name
+
+        Returns:
+            str: Rendered text
+        """
+
+        return await self.renderer.render_async(name)
+
+    async def create_or_edit_dispatch(self, name, action, this_dispatch_config):
+        """Create or edit a dispatch based on action.
+
+        Args:
+            name (str): Dispatch name
+            action (str): Action to perform
+            this_dispatch_config (dict): This dispatch's info
+
+        Returns:
+            bool: True if the dispatch was created or edited successfully
+        """
+
+        return await run_steps_async(self.create_or_edit_steps(name, action,
+                                                               this_dispatch_config))
+
+    async def create_dispatch(self, params):
+        """Create a dispatch.
+
+        Args:
+            params (dict): Dispatch parameters
+
+        Returns:
+            str: New dispatch ID
+        """
+
+        return await self.dispatch_api.create_dispatch(title=params['title'],
+                                                       text=params['text'],
+                                                       category=params['category'],
+                                                       subcategory=params['subcategory'])
+
+    async def edit_dispatch(self, dispatch_id, params):
+        """Edit a dispatch.
+
+        Args:
+            dispatch_id (str): Dispatch ID
+            params (dict): Dispatch parameters
+        """
+
+        await self.dispatch_api.edit_dispatch(dispatch_id=dispatch_id,
+                                              title=params['title'],
+                                              text=params['text'],
+                                              category=params['category'],
+                                              subcategory=params['subcategory'])
+
+    async def remove_dispatch(self, dispatch_id):
+        """Delete a dispatch.
+
+        Args:
+            dispatch_id (str): Dispatch ID
+        """
+
+        await self.dispatch_api.remove_dispatch(dispatch_id)
@@ -2,10 +2,16 @@
 """
 
 import collections
+import collections.abc
+import hashlib
+import json
+import pathlib
 import shutil
 import inspect
 import logging
 import importlib
+import time
+import types
 
 import toml
 
@@ -55,6 +61,129 @@ class CredManager(collections.UserDict):
         self.cred_loader.remove_cred(nation_name)
 
 
+class SessionCache():
+    """Cache of nation login sessions to skip login requests.
+
+    Args:
+        cred_loader: Credential loader
+        max_age (float): Maximum age in seconds of sessions to reuse. 0 disables reuse.
+        clock (func): Current time in seconds
+    """
+
+    def __init__(self, cred_loader, max_age, clock=time.time):
+        self.cred_loader = cred_loader
+        self.max_age = max_age
+        self.clock = clock
+
+    def get_pin(self, nation_name):
+        """Get pin of a nation's session if it is young enough to reuse.
+
+        Args:
+            nation_name (str): Nation name
+
+        Returns:
+            str|None: Session pin
+        """
+
+        if self.max_age <= 0:
+            return None
+
+        session = self.cred_loader.get_session(nation_name)
+        if session is None or self.clock() - session['timestamp'] > self.max_age:
+            return None
+
+        return session['pin']
+
+    def add(self, nation_name, pin):
+        """Cache a new session of a nation.
+
+        Args:
+            nation_name (str): Nation name
+            pin (str): Session pin
+        """
+
+        if pin is not None:
+            self.cred_loader.add_session(nation_name, pin, self.clock())
+
+
+def get_data_hash(data):
+    """Get hash of JSON-serializable data.
+
+    Args:
+        data: Data
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+
+    serialized = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def get_files_hash(paths):
+    """Get hash of the content of files. Missing files and None paths are hashed as empty.
+
+    Args:
+        paths (list): File paths
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+
+    file_hash = hashlib.sha256()
+    for path in paths:
+        if path is None:
+            continue
+        file_hash.update(str(path).encode('utf-8'))
+        try:
+            file_hash.update(pathlib.Path(path).read_bytes())
+        except FileNotFoundError:
+            pass
+
+    return file_hash.hexdigest()
+
+
+def format_table(rows, left_columns=1):
+    """Format rows into a text table with a line under the header row.
+
+    Args:
+        rows (list): Rows of cell strings. First row is the header.
+        left_columns (int): Number of leading columns to left-align. Others are right-aligned.
+
+    Returns:
+        str: Table
+    """
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ['  '.join(cell.ljust(width) if i < left_columns else cell.rjust(width)
+                       for i, (cell, width) in enumerate(zip(row, widths))).rstrip()
+             for row in rows]
+    lines.insert(1, '-' * len(lines[0]))
+    return '\n'.join(lines)
+
+
+def format_render_timings(results):
+    """Format render stage timings of dispatches into a table.
+
+    Args:
+        results (dict): Dispatch names and their timings from NSADM.render_dispatches
+
+    Returns:
+        str: Table
+    """
+
+    rows = [('Dispatch', 'Load (ms)', 'Template (ms)', 'BBCode (ms)', 'Total (ms)', 'Size')]
+    for name, timings in results.items():
+        if timings is None:
+            rows.append((name, '-', '-', '-', '-', 'failed'))
+            continue
+        stages = [timings['load'], timings['template'], timings['bbcode']]
+        rows.append((name, *['{:.2f}'.format(t * 1000) for t in stages + [sum(stages)]],
+                     str(timings['size'])))
+
+    return format_table(rows)
+
+
 def get_config_from_env(config_path):
     """Get configuration defined in environment.
 
@@ -99,25 +228,89 @@ def get_config_default(config_dir, default_config_path, config_name):
                                       'Created one in {}. Please edit it.').format(config_path)) from err
 
 
-def get_dispatch_info(dispatch_config):
-    """Compose and return dispatch information
+class DispatchInfo(collections.abc.Mapping):
+    """Read-only view of dispatch configs indexed by dispatch name
     for use as context in the template renderer.
+    Entries with their owner nation are resolved on access
+    and the dispatch config is never changed.
+
+    Args:
+        dispatch_config (dict): Dispatch config
+    """
+
+    def __init__(self, dispatch_config):
+        # Dispatch name and its owner nation and config. Holding configs by reference
+        # keeps dispatches removed from the dispatch config later on available.
+        self.index = {name: (nation, config)
+                      for nation, dispatches in dispatch_config.items()
+                      for name, config in dispatches.items()}
+        # Dispatch name and its resolved info
+        self.entries = {}
+
+    def __getitem__(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            nation, config = self.index[name]
+            entry = types.MappingProxyType(collections.ChainMap({'owner_nation': nation}, config))
+            self.entries[name] = entry
+
+        return entry
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getstate__(self):
+        # Resolved entries are read-only proxies, which cannot be pickled.
+        return {'index': self.index, 'entries': {}}
+
+
+def get_dispatch_info(dispatch_config):
+    """Get dispatch information for use as context in the template renderer.
 
     Args:
         dispatch_config (dict): Dispatch configuration.
-        id_store (IDStore): Dispatch ID store.
 
     Returns:
-        dict: Dispatch information.
+        DispatchInfo: Dispatch information.
     """
 
-    dispatch_info = {}
-    for nation, dispatches in dispatch_config.items():
-        for name, config in dispatches.items():
-            config['owner_nation'] = nation
-            dispatch_info[name] = config
+    return DispatchInfo(dispatch_config)
+
+
+def log_update_results(results):
+    """Log a summary of update results across all nations.
+
+    Args:
+        results (dict): Nation names and their dispatch update results.
+        None means the nation could not be logged into.
+
+    Returns:
+        tuple: Number of successful updates, total updates and failed logins.
+    """
 
-    return dispatch_info
+    succeeded = 0
+    total = 0
+    failed_logins = []
+    for nation, dispatch_results in results.items():
+        if dispatch_results is None:
+            failed_logins.append(nation)
+            continue
+
+        for name, success in dispatch_results.items():
+            total += 1
+            if success:
+                succeeded += 1
+            else:
+                logger.warning('Failed to update dispatch "%s" of nation "%s".', name, nation)
+
+    logger.info('Updated %d/%d dispatches of %d nations.', succeeded, total, len(results))
+    if failed_logins:
+        logger.warning('Could not log into nations: %s', ', '.join(failed_logins))
+
+    return succeeded, total, len(failed_logins)
 
 
 def get_funcs(path):
@@ -13,6 +13,8 @@ class DispatchLoaderTest1():
         return {'foo1': 'bar1', 'foo2': 'bar2'}
 
     def get_dispatch_text(self, name):
+        if name in self.config.get('templates', {}):
+            return self.config['templates'][name]
         return 'Dispatch content of {}'.format(name)
 
     def add_dispatch_id(self, name, id):
@@ -48,10 +48,31 @@ class TestDispatchAPI():
         with pytest.raises(exceptions.DispatchAPIError):
             dispatch_api.login('my_nation', 'hunterprime123')
 
+    def test_resume_session(self):
+        mock_nation = mock.Mock()
+        mock_nsapi = mock.Mock(nation=mock.Mock(return_value=mock_nation))
+        dispatch_api = api_adapter.DispatchAPI(mock_nsapi)
+
+        dispatch_api.resume_session('my_nation', '123456', '6789')
+
+        mock_nsapi.nation.assert_called_with('my_nation', autologin='123456')
+        mock_nation.get_shards.assert_not_called()
+        assert dispatch_api.get_pin() == '6789'
+
+    def test_edit_dispatch_forbidden_exception(self):
+        dispatch_api = api_adapter.DispatchAPI(mock.Mock())
+        dispatch_api.owner_nation = mock.Mock(
+            edit_dispatch=mock.Mock(side_effect=nationstates.exceptions.Forbidden))
+
+        with pytest.raises(exceptions.NationLoginError):
+            dispatch_api.edit_dispatch(dispatch_id='1234567', title='test', text='hello world',
+                                       category='1', subcategory='100')
+
     def test_create_dispatch(self):
         resp = 'New factbook posted! <a href="/nation=test/detail=factbook/id=1234567">View Your Factbook</a>'
         dispatch_api = api_adapter.DispatchAPI(mock.Mock())
-        dispatch_api.owner_nation = mock.Mock(create_dispatch=mock.Mock(return_value={'success': resp}))
+        dispatch_api.owner_nation = mock.Mock(api_name='nation', create_dispatch=mock.Mock(
+            return_value={'headers': {}, 'data': {'nation': {'success': resp}}}))
 
         r = dispatch_api.create_dispatch(title='test', text='hello world',
                                          category='1', subcategory='100')
@@ -61,7 +82,8 @@ class TestDispatchAPI():
     def test_edit_dispatch(self):
         resp = 'New factbook edited! <a href="/nation=test/detail=factbook/id=1234567">View Your Factbook</a>'
         dispatch_api = api_adapter.DispatchAPI(mock.Mock())
-        dispatch_api.owner_nation = mock.Mock(edit_dispatch=mock.Mock(return_value={'success': resp}))
+        dispatch_api.owner_nation = mock.Mock(api_name='nation', edit_dispatch=mock.Mock(
+            return_value={'headers': {}, 'data': {'nation': {'success': resp}}}))
 
         dispatch_api.edit_dispatch(dispatch_id='1234567', title='test', text='hello world',
                                    category='1', subcategory='100')
@@ -71,10 +93,108 @@ class TestDispatchAPI():
     def test_remove_dispatch(self):
         resp = 'Remove dispatch "test."'
         dispatch_api = api_adapter.DispatchAPI(mock.Mock())
-        dispatch_api.owner_nation = mock.Mock(remove_dispatch=mock.Mock(return_value={'success': resp}))
+        dispatch_api.owner_nation = mock.Mock(api_name='nation', remove_dispatch=mock.Mock(
+            return_value={'headers': {}, 'data': {'nation': {'success': resp}}}))
 
         dispatch_api.remove_dispatch(dispatch_id='1234567')
 
         assert True
 
+    def test_edit_dispatch_observes_rate_limit_headers(self):
+        headers = {'RateLimit-Remaining': '5'}
+        rate_limiter = mock.Mock(max_retries=3)
+        dispatch_api = api_adapter.DispatchAPI(mock.Mock(), rate_limiter)
+        edit_dispatch = mock.Mock(return_value={'headers': headers,
+                                                'data': {'nation': {'success': 'Edited'}}})
+        dispatch_api.owner_nation = mock.Mock(api_name='nation', edit_dispatch=edit_dispatch)
+
+        dispatch_api.edit_dispatch(dispatch_id='1234567', title='test', text='hello world',
+                                   category='1', subcategory='100')
+
+        assert edit_dispatch.call_args.kwargs['full_response']
+        rate_limiter.observe_headers.assert_called_with(headers)
+
+    def test_create_dispatch_with_rate_limit_ban_then_success(self):
+        resp = 'New factbook posted! <a href="/nation=test/detail=factbook/id=1234567">View Your Factbook</a>'
+        ban = nationstates.exceptions.APIRateLimitBan('Retry-After: 10')
+        create_dispatch = mock.Mock(side_effect=[ban, {'headers': {}, 'data': {'nation': {'success': resp}}}])
+        rate_limiter = mock.Mock(max_retries=3)
+        dispatch_api = api_adapter.DispatchAPI(mock.Mock(), rate_limiter)
+        dispatch_api.owner_nation = mock.Mock(api_name='nation', create_dispatch=create_dispatch)
+
+        r = dispatch_api.create_dispatch(title='test', text='hello world',
+                                         category='1', subcategory='100')
+
+        assert r == '1234567'
+        rate_limiter.throttled.assert_called_with(10.0)
+        rate_limiter.wait.assert_called_with(True)
+
+    def test_edit_dispatch_with_dispatch_too_recent_exhausting_retries(self):
+        too_recent = nationstates.exceptions.DispatchTooRecent('Too recent')
+        edit_dispatch = mock.Mock(side_effect=too_recent)
+        rate_limiter = mock.Mock(max_retries=2)
+        dispatch_api = api_adapter.DispatchAPI(mock.Mock(), rate_limiter)
+        dispatch_api.owner_nation = mock.Mock(edit_dispatch=edit_dispatch)
+
+        with pytest.raises(exceptions.RateLimitError):
+            dispatch_api.edit_dispatch(dispatch_id='1234567', title='test', text='hello world',
+                                       category='1', subcategory='100')
+
+        assert edit_dispatch.call_count == 3
+        rate_limiter.throttled.assert_called_with(dispatch_write=True)
+
+
+class TestTokenBucket():
+    def test_acquire_within_capacity(self):
+        sleep = mock.Mock()
+        ins = api_adapter.TokenBucket(2, 10, clock=mock.Mock(return_value=0), sleep=sleep)
+
+        ins.acquire()
+        ins.acquire()
+
+        sleep.assert_not_called()
+
+    def test_acquire_over_capacity(self):
+        sleep = mock.Mock()
+        ins = api_adapter.TokenBucket(2, 10, clock=mock.Mock(return_value=0), sleep=sleep)
+
+        ins.acquire(3)
+
+        sleep.assert_called_with(5)
+
+    def test_acquire_when_paused(self):
+        sleep = mock.Mock()
+        ins = api_adapter.TokenBucket(2, 10, clock=mock.Mock(return_value=0), sleep=sleep)
+
+        ins.pause(20)
+        ins.acquire()
+
+        sleep.assert_called_with(25)
+
+    def test_slow_down_and_speed_up(self):
+        ins = api_adapter.TokenBucket(2, 10, clock=mock.Mock(return_value=0))
+
+        ins.slow_down()
+        assert ins.rate == 0.1
+
+        for _ in range(20):
+            ins.speed_up()
+        assert ins.rate == 0.2
+
+
+class TestRateLimiter():
+    def test_observe_headers_with_no_remaining_requests(self):
+        ins = api_adapter.RateLimiter()
+        ins.request_bucket = mock.Mock()
+
+        ins.observe_headers({'RateLimit-Remaining': '0', 'RateLimit-Reset': '12'})
+
+        ins.request_bucket.pause.assert_called_with(12.0)
+
+    def test_observe_headers_with_remaining_requests(self):
+        ins = api_adapter.RateLimiter()
+        ins.request_bucket = mock.Mock()
+
+        ins.observe_headers({'RateLimit-Remaining': '5'})
 
+        ins.request_bucket.set_available.assert_called_with(5)
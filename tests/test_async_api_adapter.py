@@ -0,0 +1,113 @@
+import asyncio
+import functools
+from unittest import mock
+
+import pytest
+
+from nsadm import exceptions
+from nsadm import async_api_adapter
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+from aiohttp import test_utils
+
+
+def nation_response(tag, text):
+    return web.Response(text='<NATION id="my_nation"><{0}>{1}</{0}></NATION>'.format(tag, text))
+
+
+async def stand_in_api(request, requests):
+    """Local stand-in for the NationStates API.
+    """
+
+    data = await request.post()
+    requests.append((dict(request.headers), dict(data)))
+
+    if request.headers.get('X-Autologin') == 'wrong':
+        return web.Response(status=403, text='<h1>Forbidden</h1>')
+
+    headers = {'X-Pin': '1111'}
+    if 'X-Password' in request.headers:
+        headers['X-Autologin'] = '123456'
+
+    if data.get('q') == 'ping':
+        return web.Response(text='<NATION id="my_nation"><PING>1</PING></NATION>', headers=headers)
+
+    if data['mode'] == 'prepare':
+        if data.get('dispatchid') == '404':
+            return nation_response('ERROR', 'Unknown dispatch.')
+        return nation_response('SUCCESS', 'token123')
+
+    assert data['token'] == 'token123'
+    return nation_response('SUCCESS', ('New factbook posted! &lt;a href="/nation=my_nation/'
+                                       'detail=factbook/id=1234567"&gt;View&lt;/a&gt;'))
+
+
+def run_with_api(coro_func):
+    """Run a coroutine function with an API object connected to the stand-in server.
+    """
+
+    async def run():
+        requests = []
+        app = web.Application()
+        app.router.add_post('/cgi-bin/api.cgi', functools.partial(stand_in_api, requests=requests))
+        rate_limiter = mock.Mock(max_retries=1, reserve=mock.Mock(return_value=0))
+        async with test_utils.TestServer(app) as server:
+            async with async_api_adapter.create_session('test') as session:
+                api = async_api_adapter.AsyncDispatchAPI(session, rate_limiter,
+                                                         str(server.make_url('/cgi-bin/api.cgi')))
+                result = await coro_func(api)
+        return result, requests
+
+    return asyncio.run(run())
+
+
+class TestParseResponse():
+    def test_success(self):
+        r = async_api_adapter.parse_response('<NATION><SUCCESS>abc</SUCCESS></NATION>')
+
+        assert r == (True, 'abc')
+
+    def test_error(self):
+        r = async_api_adapter.parse_response('<NATION><ERROR>Unknown dispatch.</ERROR></NATION>')
+
+        assert r == (False, 'Unknown dispatch.')
+
+
+class TestAsyncDispatchAPI():
+    def test_login_with_password_and_get_autologin(self):
+        async def login(api):
+            return await api.login('my_nation', password='hunterprime123')
+
+        r, requests = run_with_api(login)
+
+        assert r == '123456'
+        assert requests[0][0]['X-Password'] == 'hunterprime123'
+
+    def test_login_forbidden(self):
+        async def login(api):
+            return await api.login('my_nation', autologin='wrong')
+
+        with pytest.raises(exceptions.NationLoginError):
+            run_with_api(login)
+
+    def test_create_dispatch_reuses_pin(self):
+        async def create(api):
+            await api.login('my_nation', autologin='123456')
+            return await api.create_dispatch(title='test', text='hello world',
+                                             category='1', subcategory='100')
+
+        r, requests = run_with_api(create)
+
+        assert r == '1234567'
+        assert requests[1][0]['X-Pin'] == '1111'
+        assert requests[2][1]['mode'] == 'execute'
+
+    def test_edit_unknown_dispatch(self):
+        async def edit(api):
+            await api.login('my_nation', autologin='123456')
+            await api.edit_dispatch(dispatch_id='404', title='test', text='hello world',
+                                    category='1', subcategory='100')
+
+        with pytest.raises(exceptions.UnknownDispatchError):
+            run_with_api(edit)
@@ -0,0 +1,123 @@
+import random
+from unittest import mock
+
+import bbcode
+import pytest
+
+from nsadm import bb_engine
+
+
+HTML_OFF = {'escape_html': False, 'replace_links': False, 'replace_cosmetic': False}
+
+SIMPLE_FORMATTERS = [('b', '[strong]%(value)s[/strong]', {}),
+                     ('opt', '[opt=%(x)s]%(value)s[/opt]', {}),
+                     ('li', '[*]%(value)s', {'newline_closes': True, 'same_tag_closes': True,
+                                            'strip': True}),
+                     ('raw', '[pre]%(value)s[/pre]', {'render_embedded': False}),
+                     ('hr', '[hr]', {'standalone': True}),
+                     ('box', '[box]%(value)s[/box]', {'swallow_trailing_newline': True,
+                                                      'strip': True}),
+                     ('code', '[code]%(value)s[/code]', {'transform_newlines': False,
+                                                        'render_embedded': False})]
+
+CORPUS = ['', 'No tags', '[b]Bold[/b]', '[B]Upper[/b]', '[ b ]Spaces[/ b]',
+          '[b]Unclosed', 'Stray [/b] closer', '[b][b]Nested[/b][/b]',
+          '[opt x=1]Option[/opt]', '[opt x="a b"]Quoted[/opt]', '[opt x=\'[b]\']Bracket[/opt]',
+          '[li]One\n[li]Two\n', '[raw][b]Raw[/b][/raw]', 'Line[hr]Line', '[box]\nBox\n[/box]\nAfter',
+          '[code]a\nb[/code]', '[li][code]a\nb[/code] item\nnext', 'Windows\r\nnewlines\rhere',
+          '[url=https://www.nationstates.net]NS[/url] [anchor=top]Top[/anchor]',
+          '[foo="[b]"]Quoted unknown[/foo]', '[b x]Invalid[/b x]', '[b=1]Name option[/b]',
+          '[cx a=1 b]Complex[/cx]', '[cx a="x\\"y" c=d e]Escaped[/cx]', '[[b]]', '[b', ']b]']
+
+RANDOM_PIECES = ['[b]', '[/b]', '[ b ]', '[/ B]', '[opt x=1]', '[opt x="a b"]', '[/opt]', '[li]', '[/li]',
+                 '[raw]', '[/raw]', '[hr]', '[box]', '[/box]', '[code]', '[/code]', '[cx a=1 b]',
+                 '[cx=q]', '[/cx]', '[url=x]', '[/url]', '[foo="[b]"]', '\n', '\r\n', 'text', ' ',
+                 '[', ']', '=', '"', "'"]
+
+
+def render_complex(tag_name, value, options, parent, context):
+    return '({}:{}:{}:{})'.format(tag_name, value, sorted(options.items()) if options else options,
+                                  parent.tag_name if parent else None)
+
+
+def add_formatters(parser):
+    for tag_name, format_string, kwargs in SIMPLE_FORMATTERS:
+        parser.add_simple_formatter(tag_name, format_string, **kwargs, **HTML_OFF)
+    parser.add_formatter('cx', render_complex, **HTML_OFF)
+    return parser
+
+
+@pytest.fixture(scope='module')
+def parsers():
+    reference = bbcode.Parser(newline='\n', install_defaults=False, **HTML_OFF)
+    return add_formatters(reference), add_formatters(bb_engine.BBEngine())
+
+
+def get_random_corpus(count):
+    rand = random.Random(0)
+    return [''.join(rand.choice(RANDOM_PIECES) for _ in range(rand.randint(1, 30)))
+            for _ in range(count)]
+
+
+class TestBBEngine():
+    @pytest.mark.parametrize('text', CORPUS)
+    def test_format_same_as_bbcode(self, parsers, text):
+        reference, engine = parsers
+
+        assert engine.format(text) == reference.format(text)
+
+    def test_format_random_text_same_as_bbcode(self, parsers):
+        reference, engine = parsers
+
+        for text in get_random_corpus(2000):
+            assert engine.format(text) == reference.format(text), text
+
+    def test_format_from_first_tag_same_as_bbcode(self, parsers):
+        reference, engine = parsers
+        tag_pattern = bb_engine.compile_tag_pattern(engine.recognized_tags)
+
+        for text in CORPUS + get_random_corpus(2000) + ['a [b] = "x [opt x=1]', "x=' [b] '"]:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+            match = tag_pattern.search(text)
+            if match is not None:
+                r = engine.format_with_context(text, {}, match.start())
+                assert r == reference.format(text), text
+
+    @pytest.mark.parametrize('count', [2, 3, 8])
+    def test_format_segments_same_as_bbcode(self, parsers, count):
+        reference, engine = parsers
+
+        for text in CORPUS + get_random_corpus(2000):
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+            segments = engine.split_tokens(engine.tokenize(text), count)
+            r = ''.join(engine.format_segment(segment, {}) for segment in segments)
+            assert r == reference.format(text), text
+            assert len(segments) <= count
+
+    def test_format_with_context_by_reference(self):
+        engine = bb_engine.BBEngine()
+        render_func = mock.Mock(return_value='r')
+        engine.add_formatter('tag', render_func)
+        context = {'key': 'value'}
+
+        engine.format_with_context('[tag]a[/tag]', context)
+
+        assert render_func.call_args[0][4] is context
+
+    def test_add_formatter_with_html_option(self):
+        engine = bb_engine.BBEngine()
+
+        with pytest.raises(ValueError):
+            engine.add_formatter('tag', mock.Mock(), escape_html=True)
+
+
+class TestCompileSimpleFormatter():
+    def test_value_only(self):
+        render = bb_engine.compile_simple_formatter('[b]%(value)s[/b]')
+
+        assert render('b', 'a', {}, None, {}) == '[b]a[/b]'
+
+    def test_with_options(self):
+        render = bb_engine.compile_simple_formatter('[c=%(c)s]%(value)s[/c] 100%%')
+
+        assert render('c', 'a', {'c': 'red'}, None, {}) == '[c=red]a[/c] 100%'
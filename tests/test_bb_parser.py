@@ -1,4 +1,7 @@
 import os
+import collections
+import pickle
+import threading
 from unittest import mock
 
 import pytest
@@ -6,6 +9,8 @@ import toml
 
 from nsadm import BBCode
 from nsadm import bb_parser
+from nsadm import filter_cache
+from nsadm import profiler
 
 
 class TestBBParserCore():
@@ -52,7 +57,7 @@ class TestBBRegistry():
 
     @mock.patch('nsadm.utils.load_module')
     def test_init_complex_formatters(self, mock):
-        ins = bb_parser.BBRegistry
+        ins = bb_parser.BBRegistry()
 
         class Formatter1():
             pass
@@ -60,8 +65,8 @@ class TestBBRegistry():
         class Formatter2():
             pass
 
-        ins.complex_formatters = [{'tag_name': 'test1', 'obj': Formatter1, 'john': True},
-                                  {'tag_name': 'test2', 'obj': Formatter2, 'john': False}]
+        bb_parser.BBRegistry.complex_formatters = [{'tag_name': 'test1', 'obj': Formatter1, 'john': True},
+                                                   {'tag_name': 'test2', 'obj': Formatter2, 'john': False}]
         config = {'test1': {'foo': 'bar', 'loo': 'var'},
                   'test2': {'foo2': 'bar2', 'loo2': 'var2'}}
 
@@ -72,7 +77,7 @@ class TestBBRegistry():
 
     @mock.patch('nsadm.utils.load_module')
     def test_init_complex_formatters_with_non_existent_config(self, mock):
-        ins = bb_parser.BBRegistry
+        ins = bb_parser.BBRegistry()
 
         class Formatter1():
             pass
@@ -80,8 +85,8 @@ class TestBBRegistry():
         class Formatter2():
             pass
 
-        ins.complex_formatters = [{'tag_name': 'test1', 'obj': Formatter1, 'john': True},
-                                  {'tag_name': 'test2', 'obj': Formatter2, 'john': False}]
+        bb_parser.BBRegistry.complex_formatters = [{'tag_name': 'test1', 'obj': Formatter1, 'john': True},
+                                                   {'tag_name': 'test2', 'obj': Formatter2, 'john': False}]
 
         r = ins.init_complex_formatters('test.py', {})
 
@@ -96,6 +101,27 @@ class TestBBRegistry():
             ins.init_complex_formatters('test.py', {})
 
 
+    def test_init_complex_formatters_reuses_formatters(self):
+        ins = bb_parser.BBRegistry()
+        config = {'complexcfg': {'testcfgkey': 'testcfgval'}}
+
+        r1 = ins.init_complex_formatters('tests/resources/bb_complex_formatters.py', config)
+        r2 = ins.init_complex_formatters('tests/resources/bb_complex_formatters.py', config)
+
+        assert [f['obj'] for f in r1] == [f['obj'] for f in r2]
+        assert r1[0] is not r2[0]
+
+    def test_init_complex_formatters_with_changed_config(self):
+        ins = bb_parser.BBRegistry()
+
+        r1 = ins.init_complex_formatters('tests/resources/bb_complex_formatters.py', {})
+        r2 = ins.init_complex_formatters('tests/resources/bb_complex_formatters.py',
+                                         {'complexcfg': {'testcfgkey': 'testcfgval'}})
+
+        assert r1[0]['obj'] is not r2[0]['obj']
+        assert r2[2]['obj'].config == {'testcfgkey': 'testcfgval'}
+
+
 class TestBBSimpelFormatters():
     @pytest.mark.usefixtures('toml_files')
     def test_load_simple_formatters_with_simple_formatter_file_exists(self, toml_files):
@@ -190,6 +216,17 @@ class TestBBComplexFormatters():
         mock_bb_registry.init_complex_formatters.assert_not_called()
 
 
+    def test_pickle_complex_formatters(self):
+        config = {'complexcfg': {'testcfgkey': 'testcfgval'}}
+        ins = bb_parser.BBComplexFormatters()
+        ins.init_formatters(bb_parser.default_registry, 'tests/resources/bb_complex_formatters.py', config)
+
+        r = pickle.loads(pickle.dumps(ins))
+
+        assert [f['tag_name'] for f in r.get_formatters()] == [f['tag_name'] for f in ins.get_formatters()]
+        assert r.get_formatters()[2]['func']('complexcfg', 'a', {}, None, {}) == '[complexcfgr=testcfgval]a[/complexcfgr]'
+
+
 class TestBBParserLoader():
     def test_load_simple_formatters_with_template_configured(self):
         mock_parser = mock.Mock(add_simple_formatter=mock.Mock())
@@ -266,6 +303,91 @@ class TestBBParserLoader():
         )
 
 
+class TestTagPrefilter():
+    def test_find_first_tag(self):
+        ins = bb_parser.TagPrefilter(['tag1', 'tag2'])
+
+        assert ins.find('[b]Text[/b] [ /TAG2]') == 12
+        assert ins.find('[b]Text [tag10][/b]') == -1
+
+    def test_find_without_tags(self):
+        ins = bb_parser.TagPrefilter([])
+
+        assert ins.find('[tag1]') == -1
+
+
+class TestBBParserAdapterPrefilter():
+    def test_format_with_context_without_registered_tag(self):
+        ins = bb_parser.BBParserAdapter()
+        ins.prefilter = bb_parser.TagPrefilter(['tag'])
+
+        with mock.patch.object(ins.parser, 'format_with_context') as format_with_context:
+            r = ins.format_with_context('[b]Text[/b]\r\nLine', {})
+
+        assert r == '[b]Text[/b]\nLine'
+        format_with_context.assert_not_called()
+
+    def test_format_with_context_with_registered_tag(self):
+        ins = bb_parser.BBParserAdapter()
+        ins.add_simple_formatter('tag', '[tagr]%(value)s[/tagr]')
+        ins.prefilter = bb_parser.TagPrefilter(['tag'])
+
+        r = ins.format_with_context('[b]Text[/b] [tag]Tag[/tag]', {})
+
+        assert r == '[b]Text[/b] [tagr]Tag[/tagr]'
+
+    def test_load_parser_sets_prefilter(self):
+        simple_formatters = mock.Mock(get_formatters=mock.Mock(
+            return_value=[{'tag_name': 'tag1', 'template': 'test1'}]))
+        complex_formatters = mock.Mock(get_formatters=mock.Mock(
+            return_value=[{'tag_name': 'tag2', 'func': mock.Mock()}]))
+        ins = bb_parser.BBParserLoader(bb_parser.BBParserAdapter())
+
+        r = ins.load_parser(simple_formatters, complex_formatters)
+
+        assert r.prefilter.find('[tag1]') == 0
+        assert r.prefilter.find('[tag2]') == 0
+
+
+class TestCacheFormatter():
+    def test_reuse_result(self):
+        render_func = mock.Mock(return_value='r')
+        cache = filter_cache.FilterCache()
+        ins = bb_parser.cache_formatter(render_func, 'tag', [], cache)
+
+        ins('tag', 'a', {'opt': '1'}, None, {'example': 1})
+        r = ins('tag', 'a', {'opt': '1'}, None, {'example': 2})
+
+        assert r == 'r'
+        render_func.assert_called_once()
+        assert cache.stats['tag'] == {'hits': 1, 'misses': 1}
+
+    def test_render_again_with_changed_inputs(self):
+        render_func = mock.Mock(return_value='r')
+        ins = bb_parser.cache_formatter(render_func, 'tag', ['example'], filter_cache.FilterCache())
+
+        ins('tag', 'a', {'opt': '1'}, None, {'example': {'foo': 'bar'}})
+        ins('tag', 'a', {'opt': '2'}, None, {'example': {'foo': 'bar'}})
+        ins('tag', 'b', {'opt': '2'}, None, {'example': {'foo': 'bar'}})
+        ins('tag', 'b', {'opt': '2'}, None, {'example': {'foo': 'baz'}})
+
+        assert render_func.call_count == 4
+
+    def test_load_cacheable_complex_formatter(self):
+        mock_parser = mock.Mock(add_complex_formatter=mock.Mock())
+        render_func = mock.Mock(return_value='r')
+        complex_formatters = [{'tag_name': 'tag1', 'func': render_func, 'cacheable': True}]
+        mock_complex_formatters = mock.Mock(get_formatters=mock.Mock(return_value=complex_formatters))
+        ins = bb_parser.BBParserLoader(mock_parser, filter_cache.FilterCache())
+
+        ins.load_complex_formatters(mock_complex_formatters)
+        loaded_func = mock_parser.add_complex_formatter.call_args[1]['render_func']
+        loaded_func('tag1', 'a', {}, None, {})
+        loaded_func('tag1', 'a', {}, None, {})
+
+        render_func.assert_called_once()
+
+
 class TestBBParserIntegration():
     def test_format(self):
         simple_formatter_path = 'tests/resources/bb_simple_formatters.toml'
@@ -282,4 +404,100 @@ class TestBBParserIntegration():
 
         assert r == ('[simple1r]Simple[/simple1r][simple2r]Simple [simple3]nested[/simple3][/simple2r]'
                      '[complexr]Complex[/complexr][complexctxr=bar]Complex context[/complexctxr]'
-                     '[complexcfgr=testcfgval]Complex config [complexoptr=test]option[/complexoptr][/complexcfgr]')
\ No newline at end of file
+                     '[complexcfgr=testcfgval]Complex config [complexoptr=test]option[/complexoptr][/complexcfgr]')
+    def test_format_with_context(self):
+        ins = bb_parser.BBParser(None, 'tests/resources/bb_complex_formatters.py', None)
+        ins.load_formatters()
+        context = collections.ChainMap({'example': {'foo': 'bar'}}, {'example': {'foo': 'baz'}})
+
+        r = ins.format_with_context('[complexctx]Complex context[/complexctx]', context)
+
+        assert r == '[complexctxr=bar]Complex context[/complexctxr]'
+
+
+class TestBBParserParallel():
+    def test_format_with_context_same_as_sequential(self):
+        simple_formatter_path = 'tests/resources/bb_simple_formatters.toml'
+        complex_formatter_path = 'tests/resources/bb_complex_formatters.py'
+        complex_formatter_config_path = 'tests/resources/bb_complex_formatter_config.toml'
+        sequential = bb_parser.BBParser(simple_formatter_path, complex_formatter_path,
+                                        complex_formatter_config_path)
+        sequential.load_formatters()
+        ins = bb_parser.BBParser(simple_formatter_path, complex_formatter_path,
+                                 complex_formatter_config_path, parallel_workers=2, parallel_min_size=0)
+        ins.load_formatters()
+        context = collections.ChainMap({'example': {'foo': 'bar'}})
+        texts = ['[simple1]Simple[/simple1]\r\n[simple2]Simple [simple3]nested[/simple3][/simple2]'
+                 '[complex]Complex[/complex]\n[complexctx]Complex context[/complexctx]',
+                 '[simple1]Unclosed [complex]Complex[/complex]', 'No tags', '']
+
+        try:
+            for text in texts:
+                assert ins.format_with_context(text * 5, context) == \
+                       sequential.format_with_context(text * 5, context)
+        finally:
+            ins.close()
+
+    def test_format_with_context_with_unpicklable_context(self):
+        ins = bb_parser.BBParser(None, 'tests/resources/bb_complex_formatters.py', None,
+                                 parallel_workers=2, parallel_min_size=0)
+        ins.load_formatters()
+        context = {'example': {'foo': 'bar'}, 'lock': threading.Lock()}
+
+        r = ins.format_with_context('[complexctx]A[/complexctx][complexctx]B[/complexctx]', context)
+
+        assert r == '[complexctxr=bar]A[/complexctxr][complexctxr=bar]B[/complexctxr]'
+        assert ins.pool is None
+
+    def test_format_with_context_with_profiler(self):
+        """Formatters in worker processes would not be profiled.
+        """
+
+        render_profiler = profiler.RenderProfiler()
+        ins = bb_parser.BBParser(None, 'tests/resources/bb_complex_formatters.py', None,
+                                 render_profiler, parallel_workers=2, parallel_min_size=0)
+        ins.load_formatters()
+
+        r = ins.format_with_context('[complex]A[/complex][complex]B[/complex]', {})
+
+        assert r == '[complexr]A[/complexr][complexr]B[/complexr]'
+        assert ins.pool is None
+        assert render_profiler.get_report()['bbcode']['complex']['calls'] == 2
+
+
+class TestBBParserOutputCache():
+    def test_format_with_context_reuses_cached_text(self, tmp_path):
+        ins = bb_parser.BBParser(None, 'tests/resources/bb_complex_formatters.py', None,
+                                 cache_path=tmp_path)
+        ins.load_formatters()
+        context = {'example': {'foo': 'bar'}}
+        ins.format_with_context('[complex]Test[/complex]', context, 'hash1')
+
+        with mock.patch.object(ins.parser, 'format_with_context') as format_with_context:
+            r = ins.format_with_context('[complex]Test[/complex]', context, 'hash1')
+
+        assert r == '[complexr]Test[/complexr]'
+        format_with_context.assert_not_called()
+        assert (ins.cache.hits, ins.cache.misses) == (1, 1)
+
+    def test_format_with_context_without_tags_skips_cache(self, tmp_path):
+        ins = bb_parser.BBParser(None, 'tests/resources/bb_complex_formatters.py', None,
+                                 cache_path=tmp_path)
+        ins.load_formatters()
+        text = 'No tags here'
+
+        r = ins.format_with_context(text, {}, 'hash1')
+
+        assert r is text
+        assert (ins.cache.hits, ins.cache.misses) == (0, 0)
+
+    def test_format_with_context_with_changed_context_hash(self, tmp_path):
+        ins = bb_parser.BBParser(None, 'tests/resources/bb_complex_formatters.py', None,
+                                 cache_path=tmp_path)
+        ins.load_formatters()
+        ins.format_with_context('[complexctx]Test[/complexctx]', {'example': {'foo': 'bar'}}, 'hash1')
+
+        r = ins.format_with_context('[complexctx]Test[/complexctx]', {'example': {'foo': 'baz'}}, 'hash2')
+
+        assert r == '[complexctxr=baz]Test[/complexctxr]'
+        assert ins.cache.misses == 2
@@ -0,0 +1,20 @@
+from nsadm import deps
+
+
+class TestDependencyStore():
+    def test_save_and_load(self, tmp_path):
+        ins = deps.DependencyStore(tmp_path / 'deps.json')
+        ins.set_input_hash('test1', 'abc')
+        ins.save()
+
+        ins = deps.DependencyStore(tmp_path / 'deps.json')
+        ins.load()
+
+        assert ins.is_unchanged('test1', 'abc')
+        assert not ins.is_unchanged('test1', 'def')
+
+    def test_is_unchanged_with_unknown_inputs(self, tmp_path):
+        ins = deps.DependencyStore(tmp_path / 'deps.json')
+        ins.set_input_hash('test1', None)
+
+        assert not ins.is_unchanged('test1', None)
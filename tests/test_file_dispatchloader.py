@@ -128,6 +128,24 @@ class TestIDStore():
         json_dump.assert_called_once()
 
 
+class TestDispatchManifest():
+    def test_init_with_no_manifest_path(self, tmp_path):
+        ins = file_dispatchloader.DispatchManifest(None, tmp_path)
+
+        assert ins.path == tmp_path / file_dispatchloader.DEFAULT_MANIFEST_FILENAME
+
+    def test_save_and_load(self, tmp_path):
+        manifest_path = tmp_path / 'manifest.json'
+        ins = file_dispatchloader.DispatchManifest(manifest_path, tmp_path)
+        ins['test1'] = 'abcdef'
+        ins.save()
+
+        r = file_dispatchloader.DispatchManifest(manifest_path, tmp_path)
+        r.load_from_json()
+
+        assert r == {'test1': 'abcdef'}
+
+
 class TestLoadDispatchConfig():
     @pytest.fixture
     def dispatch_config_files(self, toml_files):
@@ -312,6 +330,30 @@ class TestFileDispatchLoaderObj():
             obj.get_dispatch_text('test2')
 
 
+    def test_get_dispatch_version(self, text_files):
+        template_path = text_files({'test1.txt': 'Foo Bar'})
+        obj = file_dispatchloader.FileDispatchLoader({}, {}, template_path.parent, '.txt')
+
+        assert obj.get_dispatch_version('test1') == template_path.stat().st_mtime_ns
+
+    def test_get_dispatch_version_with_non_existing_file(self, tmp_path):
+        obj = file_dispatchloader.FileDispatchLoader({}, {}, tmp_path, '.txt')
+
+        assert obj.get_dispatch_version('test1') is None
+
+    def test_get_dispatch_hash_with_no_manifest(self, tmp_path):
+        obj = file_dispatchloader.FileDispatchLoader({}, {}, tmp_path, '.txt')
+
+        assert obj.get_dispatch_hash('test1') is None
+
+    def test_set_dispatch_hash(self, tmp_path):
+        obj = file_dispatchloader.FileDispatchLoader({}, {}, tmp_path, '.txt', {})
+
+        obj.set_dispatch_hash('test1', 'abcdef')
+
+        assert obj.get_dispatch_hash('test1') == 'abcdef'
+
+
 class TestFileDispatchLoader():
     @pytest.fixture
     def dispatch_files(self, text_files):
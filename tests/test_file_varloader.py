@@ -57,3 +57,27 @@ class TestFileVarLoader():
         """
 
         file_varloader.get_all_vars([])
+
+    def test_load_vars_with_names_skips_indexed_files(self, setup_vars_files, tmp_path):
+        key_index = file_varloader.VarKeyIndex(tmp_path / 'var_keys.json')
+        file_varloader.get_all_vars(['test1.toml', 'test2.toml'], {'foo1'}, key_index)
+        key_index.save()
+
+        key_index = file_varloader.VarKeyIndex(tmp_path / 'var_keys.json')
+        key_index.load()
+        r = file_varloader.get_all_vars(['test1.toml', 'test2.toml'], {'foo1'}, key_index)
+
+        assert r == {'foo1': {'bar1': 'john1'}}
+
+
+class TestVarKeyIndex():
+    def test_get_keys_of_changed_file(self, tmp_path):
+        var_path = tmp_path / 'vars.toml'
+        var_path.write_text('foo1 = 1')
+        key_index = file_varloader.VarKeyIndex(tmp_path / 'var_keys.json')
+        key_index.set_keys(var_path, ['foo1'])
+        assert key_index.get_keys(var_path) == {'foo1'}
+
+        var_path.write_text('foo1 = 1\nfoo2 = 2')
+
+        assert key_index.get_keys(var_path) is None
@@ -0,0 +1,148 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from nsadm import filter_cache
+
+
+@pytest.fixture
+def cache():
+    ins = filter_cache.FilterCache(max_size=2, clock=mock.Mock(return_value=0))
+    with mock.patch.object(filter_cache, 'default_cache', ins):
+        yield ins
+
+
+class TestFilterCache():
+    def test_get_missing_key(self):
+        ins = filter_cache.FilterCache()
+
+        with pytest.raises(KeyError):
+            ins.get(('f', (1,), ()))
+
+        assert ins.stats == {'f': {'hits': 0, 'misses': 1}}
+
+    def test_evict_least_recently_used(self):
+        ins = filter_cache.FilterCache(max_size=2)
+        ins.set(('f', 1), 'a')
+        ins.set(('f', 2), 'b')
+        ins.get(('f', 1))
+        ins.set(('f', 3), 'c')
+
+        assert list(ins.entries) == [('f', 1), ('f', 3)]
+
+    def test_get_expired_result(self):
+        clock = mock.Mock(return_value=0)
+        ins = filter_cache.FilterCache(clock=clock)
+        ins.set(('f', 1), 'a')
+        clock.return_value = 10
+
+        assert ins.get(('f', 1), ttl=20) == 'a'
+        with pytest.raises(KeyError):
+            ins.get(('f', 1), ttl=5)
+
+    def test_save_and_load_only_persistent_results(self, tmp_path):
+        ins = filter_cache.FilterCache()
+        ins.set(('f', 1), 'a', persist=True)
+        ins.set(('g', 1), 'b')
+        ins.save(tmp_path / 'cache.pickle')
+
+        ins = filter_cache.FilterCache()
+        ins.load(tmp_path / 'cache.pickle')
+
+        assert ins.get(('f', 1)) == 'a'
+        with pytest.raises(KeyError):
+            ins.get(('g', 1))
+
+    def test_load_non_existent_file(self, tmp_path):
+        ins = filter_cache.FilterCache()
+        ins.load(tmp_path / 'cache.pickle')
+
+        assert not ins.entries
+
+    def test_load_corrupted_file(self, tmp_path):
+        path = tmp_path / 'cache.pickle'
+        path.write_bytes(b'abc')
+        ins = filter_cache.FilterCache()
+        ins.load(path)
+
+        assert not ins.entries
+
+    def test_take_and_merge_changes(self):
+        worker_cache = filter_cache.FilterCache(clock=mock.Mock(return_value=5))
+        worker_cache.track_changes()
+        worker_cache.set(('f', 1), 'a', persist=True)
+        worker_cache.set(('g', 1), 'b')
+        worker_cache.set(('h', 1), lambda: None, persist=True)
+        worker_cache.get(('f', 1))
+        changes = worker_cache.take_changes()
+
+        ins = filter_cache.FilterCache()
+        ins.stats = {'f': {'hits': 1, 'misses': 1}}
+        ins.merge(*changes)
+
+        assert ins.entries == {('f', 1): ('a', 5, True)}
+        assert ins.stats == {'f': {'hits': 2, 'misses': 1}}
+        assert worker_cache.take_changes() == ({}, {})
+
+
+class TestCachedFilter():
+    def test_call_once_per_arguments(self, cache):
+        func = mock.Mock(side_effect=lambda value, sep=',': sep.join(value))
+        func.__module__ = 'filters'
+        func.__qualname__ = 'join'
+        cached = filter_cache.cached_filter(func)
+
+        assert cached(['a', 'b']) == 'a,b'
+        assert cached(['a', 'b']) == 'a,b'
+        assert cached(['a', 'b'], sep='-') == 'a-b'
+        assert func.call_count == 2
+        assert cache.stats == {'filters.join': {'hits': 1, 'misses': 2}}
+
+    def test_call_with_unkeyable_arguments_is_not_cached(self, cache):
+        class Item():
+            def __repr__(self):
+                return 'Item'
+
+        func = mock.Mock(side_effect=lambda items: id(items[0]))
+        func.__module__ = 'filters'
+        func.__qualname__ = 'get_id'
+        cached = filter_cache.cached_filter(func)
+        first, second = Item(), Item()
+
+        assert cached([first]) == id(first)
+        assert cached([second]) == id(second)
+        assert func.call_count == 2
+        assert not cache.entries
+
+    def test_make_key_with_equal_representations(self):
+        assert (filter_cache.make_key('f', (['a'],), {})
+                != filter_cache.make_key('f', (('a',),), {}))
+        assert (filter_cache.make_key('f', ({'a': 1, 'b': 2},), {})
+                == filter_cache.make_key('f', ({'b': 2, 'a': 1},), {}))
+
+    def test_ttl_and_persist(self, cache):
+        @filter_cache.cached_filter(ttl=5, persist=True)
+        def double(value):
+            return value * 2
+
+        assert double(1) == 2
+        cache.clock.return_value = 10
+        assert double(1) == 2
+
+        assert cache.stats[double.__module__ + '.' + double.__qualname__]['misses'] == 2
+        assert all(entry[2] for entry in cache.entries.values())
+
+    def test_coroutine_filter(self, cache):
+        calls = []
+
+        @filter_cache.cached_filter
+        async def fetch(value):
+            calls.append(value)
+            return value.upper()
+
+        async def run():
+            return [await fetch('a'), await fetch('a')]
+
+        assert asyncio.run(run()) == ['A', 'A']
+        assert calls == ['a']
@@ -0,0 +1,94 @@
+import asyncio
+import os
+from unittest import mock
+
+import jinja2
+
+from nsadm import fragment_cache
+
+
+def get_env(cache, templates, enable_async=False):
+    env = jinja2.Environment(loader=jinja2.DictLoader(templates), enable_async=enable_async,
+                             extensions=[fragment_cache.FragmentCacheExtension])
+    env.fragment_cache = cache
+    return env
+
+
+class TestFragmentCache():
+    def test_set_and_get(self, tmp_path):
+        ins = fragment_cache.FragmentCache(tmp_path)
+        ins.set('a', 'Test text')
+
+        assert ins.get('a') == 'Test text'
+        assert ins.get('b') is None
+
+    def test_evict_least_recently_used(self, tmp_path):
+        ins = fragment_cache.FragmentCache(tmp_path, max_size=10)
+        ins.set('a', '12345')
+        os.utime(ins.get_path('a'), (0, 0))
+        ins.set('b', '12345')
+        os.utime(ins.get_path('b'), (1, 1))
+        ins.get('a')
+        ins.set('c', '12345')
+
+        assert ins.get('a') == '12345'
+        assert ins.get('b') is None
+        assert ins.get('c') == '12345'
+
+    def test_set_only_scans_when_full(self, tmp_path):
+        ins = fragment_cache.FragmentCache(tmp_path, max_size=10)
+        ins.set('a', '12345')
+
+        with mock.patch.object(ins, 'evict', wraps=ins.evict) as evict:
+            ins.set('a', '1234')
+            ins.set('b', '123456')
+            evict.assert_not_called()
+            ins.set('c', '1')
+
+        evict.assert_called_once()
+        assert ins.size <= 10
+
+
+class TestFragmentCacheExtension():
+    def test_reuse_block_across_templates_and_runs(self, tmp_path):
+        func = mock.Mock(return_value='Ranking')
+        block = '{% cache "ranking", region %}{{ func() }}{% endcache %}'
+        templates = {'a': 'A ' + block, 'b': 'B ' + block}
+
+        env = get_env(fragment_cache.FragmentCache(tmp_path), templates)
+        assert env.get_template('a').render(func=func, region='r1') == 'A Ranking'
+        assert env.get_template('b').render(func=func, region='r1') == 'B Ranking'
+
+        env = get_env(fragment_cache.FragmentCache(tmp_path), templates)
+        assert env.get_template('a').render(func=func, region='r1') == 'A Ranking'
+        assert func.call_count == 1
+
+    def test_render_again_when_variables_change(self, tmp_path):
+        templates = {'a': '{% cache "name", name %}{{ name }}{% endcache %}'}
+        env = get_env(fragment_cache.FragmentCache(tmp_path), templates)
+
+        assert env.get_template('a').render(name='n1') == 'n1'
+        assert env.get_template('a').render(name='n2') == 'n2'
+
+    def test_render_again_when_block_changes(self, tmp_path):
+        cache = fragment_cache.FragmentCache(tmp_path)
+        env = get_env(cache, {'a': '{% cache "block" %}Old{% endcache %}'})
+        env.get_template('a').render()
+
+        env = get_env(cache, {'a': '{% cache "block" %}New{% endcache %}'})
+        assert env.get_template('a').render() == 'New'
+
+    def test_no_cache(self):
+        env = get_env(None, {'a': '{% cache "block" %}Test{% endcache %}'})
+
+        assert env.get_template('a').render() == 'Test'
+
+    def test_async_render(self, tmp_path):
+        func = mock.Mock(return_value='Ranking')
+        templates = {'a': '{% cache "ranking" %}{{ func() }}{% endcache %}'}
+        env = get_env(fragment_cache.FragmentCache(tmp_path), templates, enable_async=True)
+        template = env.get_template('a')
+
+        assert asyncio.run(template.render_async(func=func)) == 'Ranking'
+        assert asyncio.run(template.render_async(func=func)) == 'Ranking'
+        assert func.call_count == 1
@@ -0,0 +1,46 @@
+import json
+
+from nsadm import journal
+
+
+class TestUpdateJournal():
+    def test_record_and_load(self, tmp_path):
+        ins = journal.UpdateJournal(tmp_path / 'journal.jsonl')
+        ins.open()
+
+        ins.record('test1', 'create', '1234567', 'abc')
+        ins.record('test2', 'remove', '7890123')
+
+        r = journal.UpdateJournal(tmp_path / 'journal.jsonl').load()
+
+        assert r == {'test1': {'name': 'test1', 'action': 'create', 'id': '1234567', 'hash': 'abc'},
+                     'test2': {'name': 'test2', 'action': 'remove', 'id': '7890123', 'hash': None}}
+
+    def test_load_with_non_existing_file(self, tmp_path):
+        ins = journal.UpdateJournal(tmp_path / 'journal.jsonl')
+
+        assert ins.load() == {}
+
+    def test_open_with_incomplete_entry(self, tmp_path):
+        journal_path = tmp_path / 'journal.jsonl'
+        entry = json.dumps({'name': 'test1', 'action': 'edit', 'id': '1234567', 'hash': 'abc'})
+        journal_path.write_text(entry + '\n{"name": "tes')
+        ins = journal.UpdateJournal(journal_path)
+        ins.open()
+
+        ins.record('test2', 'edit', '7890123', 'def')
+
+        r = ins.load()
+
+        assert r['test1']['hash'] == 'abc'
+        assert r['test2']['hash'] == 'def'
+
+    def test_finish(self, tmp_path):
+        journal_path = tmp_path / 'journal.jsonl'
+        ins = journal.UpdateJournal(journal_path)
+        ins.open()
+        ins.record('test1', 'edit', '1234567', 'abc')
+
+        ins.finish()
+
+        assert not journal_path.exists()
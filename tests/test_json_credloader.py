@@ -79,3 +79,27 @@ class TestJSONLoader():
             r = json.load(f)
 
         assert 'nation2' not in r
+
+    def test_add_session_and_load_it(self, creds):
+        config = {'json_credloader': {'cred_path': creds}}
+        loader = json_credloader.init_cred_loader(config)
+
+        json_credloader.add_session(loader, 'nation1', '1234', 100)
+
+        json_credloader.cleanup_cred_loader(loader)
+
+        loader = json_credloader.init_cred_loader(config)
+        r = json_credloader.get_session(loader, 'nation1')
+
+        assert r == {'pin': '1234', 'timestamp': 100}
+
+    def test_save_only_writes_changes_once(self, creds):
+        config = {'json_credloader': {'cred_path': creds}}
+        loader = json_credloader.init_cred_loader(config)
+        json_credloader.add_session(loader, 'nation1', '1234', 100)
+        loader.save()
+
+        with mock.patch('builtins.open') as mock_open:
+            loader.save()
+
+        mock_open.assert_not_called()
@@ -0,0 +1,132 @@
+from unittest import mock
+
+import pytest
+
+from nsadm import exceptions
+from nsadm import filter_cache
+from nsadm import pipeline
+
+
+CONFIG = {'plugins': {'dispatch_loader': 'dispatchloader-test1',
+                      'var_loader': ['varloader-test1']},
+          'loader_config': {'dispatchloader-test1': {'key1': 'val1'},
+                            'varloader-test1': {'key1': 'val1'}},
+          'bbcode': {},
+          'template_renderer': {}}
+
+DISPATCH_CONFIG = {'nation1': {'test1': {'action': 'edit', 'ns_id': '123'},
+                               'test2': {'action': 'remove', 'ns_id': '456'}},
+                   'nation2': {'test3': {'action': 'create'},
+                               'test4': {'action': 'edit', 'ns_id': '789'}}}
+
+
+class TestGetRenderJobs():
+    def test_with_all_dispatches(self):
+        r = pipeline.get_render_jobs(DISPATCH_CONFIG, [])
+
+        assert r == [('nation1', 'test1'), ('nation2', 'test3'), ('nation2', 'test4')]
+
+    def test_with_selected_dispatches(self):
+        r = pipeline.get_render_jobs(DISPATCH_CONFIG, ['test2', 'test4'])
+
+        assert r == [('nation2', 'test4')]
+
+
+class TestInitRenderWorker():
+    def test_with_parallel_bbcode(self, monkeypatch):
+        config = dict(CONFIG, bbcode={'parallel_workers': 4})
+        monkeypatch.setattr(filter_cache, 'default_cache', filter_cache.FilterCache())
+        monkeypatch.setattr(pipeline, '_worker_renderer', None)
+        with mock.patch('nsadm.info.LOADER_DIR_PATH', 'tests/resources'):
+            pipeline.init_render_worker(config, DISPATCH_CONFIG)
+
+        assert pipeline._worker_renderer.bb_parser.parallel_workers == 0
+        assert pipeline.render_in_worker('test1')[0] == 'Dispatch content of test1'
+        assert pipeline._worker_renderer.bb_parser.pool is None
+
+
+class TestRenderPipeline():
+    @pytest.fixture
+    def render_pipeline(self):
+        with mock.patch('nsadm.info.LOADER_DIR_PATH', 'tests/resources'):
+            ins = pipeline.RenderPipeline(CONFIG, 2, 1)
+            ins.start(DISPATCH_CONFIG, [])
+            yield ins
+            ins.close()
+
+    def test_render(self, render_pipeline):
+        assert render_pipeline.render('test1') == 'Dispatch content of test1'
+        assert render_pipeline.render('test4') == 'Dispatch content of test4'
+
+    def test_render_after_nation_skipped_dispatches(self, render_pipeline):
+        """Buffer slots of skipped dispatches must be freed
+        so that later dispatches can still be rendered.
+        """
+
+        render_pipeline.finish_nation('nation1')
+
+        assert render_pipeline.render('test4') == 'Dispatch content of test4'
+
+    def test_render_with_not_scheduled_dispatch(self, render_pipeline):
+        with pytest.raises(exceptions.DispatchRenderingError):
+            render_pipeline.render('test2')
+
+    def test_render_with_oversized_dispatch(self):
+        """An oversized dispatch must fail alone without breaking the process pool.
+        """
+
+        config = dict(CONFIG, template_renderer={'max_template_size': 25})
+        dispatch_config = {'nation1': {'test_oversized': {'action': 'edit', 'ns_id': '123'},
+                                       'test1': {'action': 'edit', 'ns_id': '456'}}}
+        with mock.patch('nsadm.info.LOADER_DIR_PATH', 'tests/resources'):
+            ins = pipeline.RenderPipeline(config, 2, 1)
+            ins.start(dispatch_config, [])
+            try:
+                with pytest.raises(exceptions.DispatchTooLargeError):
+                    ins.render('test_oversized')
+                assert ins.render('test1') == 'Dispatch content of test1'
+            finally:
+                ins.close()
+
+    def test_render_with_skipped_sibling_dispatch(self):
+        """Dispatches skipped by the update must still be in dispatch_info of render processes.
+        """
+
+        loader_config = {'dispatchloader-test1': {'templates': {
+                             'test1': '{{ dispatch_info.test2.ns_id }}'}},
+                         'varloader-test1': {'key1': 'val1'}}
+        config = dict(CONFIG, loader_config=loader_config)
+        loaded_dispatch_config = {'nation1': {'test1': {'action': 'edit', 'ns_id': '123'},
+                                              'test2': {'action': 'edit', 'ns_id': '456'}}}
+        dispatch_config = {'nation1': {'test1': {'action': 'edit', 'ns_id': '123'}}}
+        with mock.patch('nsadm.info.LOADER_DIR_PATH', 'tests/resources'):
+            ins = pipeline.RenderPipeline(config, 1, 1)
+            ins.start(dispatch_config, [], loaded_dispatch_config)
+            try:
+                assert ins.render('test1') == '456'
+            finally:
+                ins.close()
+
+    def test_render_merges_filter_cache_of_workers(self, tmp_path):
+        filter_path = tmp_path / 'filters.py'
+        filter_path.write_text('from nsadm import cached_filter\n\n'
+                               '@cached_filter(persist=True)\n'
+                               'def double(value):\n'
+                               '    return value * 2\n')
+        loader_config = {'dispatchloader-test1': {'templates': {'test1': '{{ 2|double }}'}},
+                         'varloader-test1': {'key1': 'val1'}}
+        config = dict(CONFIG, loader_config=loader_config,
+                      template_renderer={'filter_path': str(filter_path)})
+        dispatch_config = {'nation1': {'test1': {'action': 'edit', 'ns_id': '123'}}}
+        cache = filter_cache.FilterCache()
+        with mock.patch('nsadm.info.LOADER_DIR_PATH', 'tests/resources'), \
+                mock.patch.object(filter_cache, 'default_cache', cache):
+            ins = pipeline.RenderPipeline(config, 1, 1)
+            ins.start(dispatch_config, [])
+            try:
+                assert ins.render('test1') == '4'
+            finally:
+                ins.close()
+
+        assert [entry[0] for entry in cache.entries.values()] == [4]
+        assert list(cache.stats.values()) == [{'hits': 0, 'misses': 1}]
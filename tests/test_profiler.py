@@ -0,0 +1,68 @@
+import asyncio
+import json
+from unittest import mock
+
+from nsadm import profiler
+from nsadm import renderer
+
+
+class TestRenderProfiler():
+    def test_wrap(self):
+        ins = profiler.RenderProfiler()
+        func = ins.wrap('filter', 'upper', lambda value: value.upper())
+
+        func('abc')
+        func('ééé')
+
+        stats = ins.get_report()['filter']['upper']
+        assert stats['calls'] == 2
+        assert stats['bytes'] == 9
+        assert stats['max'] <= stats['total']
+
+    def test_wrap_coroutine(self):
+        async def fetch(value):
+            return value
+
+        ins = profiler.RenderProfiler()
+        func = ins.wrap('filter', 'fetch', fetch)
+
+        r = asyncio.run(func('abc'))
+
+        assert r == 'abc'
+        assert ins.get_report()['filter']['fetch']['calls'] == 1
+
+    def test_save_report_and_format_summary(self, tmp_path):
+        ins = profiler.RenderProfiler()
+        ins.record('bbcode', 'b', 0.002, '[b]a[/b]')
+        ins.record('filter', 'upper', 0.001, 'A')
+        ins.record_dispatch('test1', {'template': 0.003, 'bbcode': 0.004})
+
+        ins.save_report(tmp_path / 'report.json')
+        r = ins.format_summary().splitlines()
+
+        with open(tmp_path / 'report.json') as f:
+            report = json.load(f)
+        assert report['dispatches']['test1'] == {'template': 0.003, 'bbcode': 0.004}
+        assert r[2].split()[:2] == ['bbcode', 'b']
+        assert r[3].split()[:2] == ['filter', 'upper']
+        assert r[-1] == 'Rendered 1 dispatches: Jinja 3.00 ms, BBCode 4.00 ms'
+
+
+class TestProfiledRender():
+    def test_render_records_filters_and_formatters(self):
+        dispatch_loader = mock.Mock(get_dispatch_text=mock.Mock(
+            return_value='{% for i in j %}[simple1]{{ i|filter1(0) }}[/simple1]{% endfor %}'))
+        var_loader = mock.Mock(get_all_vars=mock.Mock(return_value={'j': [1, 2]}))
+        template_config = {'filter_path': 'tests/resources/filters.py'}
+        bb_config = {'simple_formatter_path': 'tests/resources/bb_simple_formatters.toml'}
+        ins = profiler.RenderProfiler()
+        dispatch_renderer = renderer.DispatchRenderer(dispatch_loader, var_loader, bb_config,
+                                                      template_config, ins)
+        dispatch_renderer.load({'nation1': {'test1': {'title': 'ABC'}}})
+
+        dispatch_renderer.render('test1')
+
+        report = ins.get_report()
+        assert report['filter']['filter1']['calls'] == 2
+        assert report['bbcode']['simple1']['calls'] == 2
+        assert 'test1' in report['dispatches']
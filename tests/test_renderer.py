@@ -1,4 +1,6 @@
 import os
+import asyncio
+import time
 import shutil
 import logging
 from unittest import mock
@@ -7,6 +9,7 @@ import pytest
 import toml
 
 from nsadm import exceptions
+from nsadm import profiler
 from nsadm import renderer
 
 
@@ -37,6 +40,17 @@ class TestDispatchTemplateLoader():
             loader.get_source(mock.Mock(), 'Test')
 
 
+    def test_uptodate_with_changed_version(self):
+        loader_plugin = mock.Mock(get_dispatch_text=mock.Mock(return_value='Test text'),
+                                  get_dispatch_version=mock.Mock(return_value=1))
+        loader = renderer.DispatchJinjaLoader(loader_plugin)
+
+        r = loader.get_source(mock.Mock(), 'Test')
+        assert r[2]()
+        loader_plugin.get_dispatch_version.return_value = 2
+        assert not r[2]()
+
+
 class TestTemplateRenderer():
     def test_load_filters(self, get_mock_dispatch_loader):
         dispatch_loader = get_mock_dispatch_loader()
@@ -53,6 +67,29 @@ class TestTemplateRenderer():
         ins.load_filters()
         assert 'filter1' not in ins.env.filters
 
+    def test_render_with_bytecode_cache(self, get_mock_dispatch_loader, tmp_path):
+        dispatch_loader = get_mock_dispatch_loader('{{ key1 }}')
+        ins = renderer.TemplateRenderer(dispatch_loader, None, tmp_path / 'cache')
+        ins.render('template', context={'key1': 'val1'})
+        ins = renderer.TemplateRenderer(dispatch_loader, None, tmp_path / 'cache')
+
+        with mock.patch.object(ins.env, 'compile', wraps=ins.env.compile) as compile:
+            r = ins.render('template', context={'key1': 'val1'})
+
+        assert r == 'val1'
+        compile.assert_not_called()
+
+    def test_render_with_fragment_cache(self, get_mock_dispatch_loader, tmp_path):
+        dispatch_loader = get_mock_dispatch_loader('{% cache "block", key1 %}{{ key1 }}{% endcache %}')
+        ins = renderer.TemplateRenderer(dispatch_loader, None, fragment_cache_path=tmp_path)
+        ins.render('template', context={'key1': 'val1'})
+
+        with mock.patch.object(ins.env.fragment_cache, 'set') as cache_set:
+            r = ins.render('template', context={'key1': 'val1'})
+
+        assert r == 'val1'
+        cache_set.assert_not_called()
+
     def test_render_with_filters(self, get_mock_dispatch_loader):
         template_text = '{% for i in j %}{{ i|filter1(2) }} {{ i|filter2(3) }} {% endfor %}'
         dispatch_loader = get_mock_dispatch_loader(template_text)
@@ -87,3 +124,258 @@ class TestDispatchRenderer():
                     '[complexr]marrytest1[/complexr][complexcfgr=testcfgval]val1[/complexcfgr]')
         assert ins.render('test1') == expected
 
+
+    def test_render_does_not_change_global_context(self, get_mock_dispatch_loader):
+        dispatch_loader = get_mock_dispatch_loader('{% set x = 1 %}{{ current_dispatch }}')
+        var_loader = mock.Mock(get_all_vars=mock.Mock(return_value={'key1': 'val1'}))
+        ins = renderer.DispatchRenderer(dispatch_loader, var_loader, {}, {})
+        ins.load({'nation1': {'test1': {'ns_id': 1234567, 'title': 'ABC'},
+                              'test2': {'ns_id': 7890123, 'title': 'DEF'}}})
+
+        assert ins.render('test1') == 'test1'
+        assert ins.render('test2') == 'test2'
+        assert 'current_dispatch' not in ins.global_context
+        assert 'x' not in ins.global_context
+
+    def test_render_with_timings(self, get_mock_dispatch_loader):
+        dispatch_loader = get_mock_dispatch_loader('[b]{{ key1 }}[/b]')
+        var_loader = mock.Mock(get_all_vars=mock.Mock(return_value={'key1': 'val1'}))
+        ins = renderer.DispatchRenderer(dispatch_loader, var_loader, {}, {})
+        ins.load({'nation1': {'test1': {'ns_id': 1234567, 'title': 'ABC'}}})
+        timings = {}
+
+        r = ins.render('test1', timings)
+
+        assert r == '[b]val1[/b]'
+        assert set(timings) == {'load', 'template', 'bbcode'}
+
+    def test_load_used_vars_only(self):
+        templates = {'test1': '{{ key1 }}{% include "shared" %}', 'test2': '{{ key2 }}',
+                     'shared': '{{ key3 }}'}
+        dispatch_loader = mock.Mock(get_dispatch_text=mock.Mock(side_effect=templates.get))
+        var_loader = mock.Mock(get_all_vars=mock.Mock(return_value={}))
+        ins = renderer.DispatchRenderer(dispatch_loader, var_loader, {},
+                                        {'load_used_vars_only': True})
+
+        ins.load({'nation1': {'test1': {'ns_id': 1234567, 'title': 'ABC'},
+                              'test2': {'ns_id': 7890123, 'title': 'DEF'}}}, ['test1'])
+
+        var_loader.get_all_vars.assert_called_with({'key1', 'key3'})
+
+    def test_render_with_template_over_size_limit(self, get_mock_dispatch_loader):
+        template_text = '{% for i in range(100) %}{{ func(i) }}{% endfor %}'
+        dispatch_loader = get_mock_dispatch_loader(template_text)
+        func = mock.Mock(return_value='a' * 10)
+        var_loader = mock.Mock(get_all_vars=mock.Mock(return_value={'func': func}))
+        ins = renderer.DispatchRenderer(dispatch_loader, var_loader, {}, {'max_template_size': 50})
+        ins.load({'nation1': {'test1': {'ns_id': 1234567, 'title': 'ABC'}}})
+
+        with pytest.raises(exceptions.DispatchTooLargeError):
+            ins.render('test1')
+
+        assert func.call_count == 6
+
+    def test_render_with_output_over_size_limit(self, get_mock_dispatch_loader):
+        dispatch_loader = get_mock_dispatch_loader('{{ text }}')
+        var_loader = mock.Mock(get_all_vars=mock.Mock(return_value={'text': 'a' * 10}))
+        ins = renderer.DispatchRenderer(dispatch_loader, var_loader, {}, {})
+        ins.load({'nation1': {'test1': {'ns_id': 1234567, 'title': 'ABC'}}})
+
+        with mock.patch.object(renderer, 'DISPATCH_SIZE_LIMIT', 5):
+            with pytest.raises(exceptions.DispatchTooLargeError):
+                ins.render('test1')
+
+
+class TestRenderBuffer():
+    def test_reuse_buffer_on_thread(self):
+        with renderer.get_render_buffer() as buffer:
+            buffer.write('abc')
+            with renderer.get_render_buffer() as nested_buffer:
+                assert nested_buffer is not buffer
+            assert buffer.getvalue() == 'abc'
+
+        with renderer.get_render_buffer() as reused_buffer:
+            assert reused_buffer.getvalue() == ''
+
+
+class TestGetDependencies():
+    def test_get_dependencies(self):
+        templates = {'test1': '{% include "header" %}{{ key1 }}',
+                     'header': '{% import "macros" as m %}{{ m.title(key2) }}',
+                     'macros': '{% macro title(text) %}[b]{{ text }}[/b]{% endmacro %}'}
+        dispatch_loader = mock.Mock(get_dispatch_text=mock.Mock(side_effect=templates.get))
+        ins = renderer.TemplateRenderer(dispatch_loader, None)
+
+        sources, variables = ins.get_dependencies('test1')
+
+        assert set(sources) == {'test1', 'header', 'macros'}
+        assert variables == {'key1', 'key2'}
+
+    def test_get_dependencies_with_dynamic_include(self, get_mock_dispatch_loader):
+        dispatch_loader = get_mock_dispatch_loader('{% include header_name %}')
+        ins = renderer.TemplateRenderer(dispatch_loader, None)
+
+        assert ins.get_dependencies('test1') is None
+
+
+class TestGetInputHash():
+    def get_renderer(self, templates, vars):
+        dispatch_loader = mock.Mock(get_dispatch_text=mock.Mock(side_effect=templates.get))
+        var_loader = mock.Mock(get_all_vars=mock.Mock(return_value=vars))
+        ins = renderer.DispatchRenderer(dispatch_loader, var_loader, {}, {})
+        ins.load({'nation1': {'test1': {'title': 'ABC', 'action': 'edit'}}})
+        return ins
+
+    def test_get_input_hash_with_unused_var_changed(self):
+        templates = {'test1': '{{ key1 }}'}
+        ins1 = self.get_renderer(templates, {'key1': 'val1', 'key2': 'val2'})
+        ins2 = self.get_renderer(templates, {'key1': 'val1', 'key2': 'changed'})
+
+        r1 = ins1.get_input_hash('test1', {'title': 'ABC', 'action': 'edit'})
+        r2 = ins2.get_input_hash('test1', {'title': 'ABC', 'action': 'create'})
+
+        assert r1 == r2
+
+    def test_get_input_hash_with_include_changed(self):
+        vars = {'key1': 'val1'}
+        ins1 = self.get_renderer({'test1': '{% include "header" %}', 'header': 'A'}, vars)
+        ins2 = self.get_renderer({'test1': '{% include "header" %}', 'header': 'B'}, vars)
+
+        r1 = ins1.get_input_hash('test1', {'title': 'ABC'})
+        r2 = ins2.get_input_hash('test1', {'title': 'ABC'})
+
+        assert r1 != r2
+
+
+class TestCompileTemplates():
+    def test_compile_and_load_precompiled(self, tmp_path):
+        templates = {'test1': '{% include "header" %}{{ key1 }}', 'header': '[b]{{ key2 }}[/b]'}
+        dispatch_loader = mock.Mock(get_dispatch_text=mock.Mock(side_effect=templates.get))
+        ins = renderer.TemplateRenderer(dispatch_loader, None)
+
+        r = ins.compile_templates(['test1'], tmp_path)
+
+        assert r == 2
+        ins = renderer.TemplateRenderer(dispatch_loader, None, compiled_path=tmp_path)
+        with mock.patch.object(ins.env, 'compile') as compile:
+            assert ins.render('test1', {'key1': 'val1', 'key2': 'val2'}) == '[b]val2[/b]val1'
+        compile.assert_not_called()
+
+    def test_load_precompiled_with_changed_source(self, tmp_path):
+        templates = {'test1': '{{ key1 }}'}
+        dispatch_loader = mock.Mock(get_dispatch_text=mock.Mock(side_effect=templates.get))
+        ins = renderer.TemplateRenderer(dispatch_loader, None)
+        ins.compile_templates(['test1'], tmp_path)
+        templates['test1'] = 'changed {{ key1 }}'
+
+        ins = renderer.TemplateRenderer(dispatch_loader, None, compiled_path=tmp_path)
+
+        assert ins.render('test1', {'key1': 'val1'}) == 'changed val1'
+
+
+class TestAsyncRendering():
+    def test_render_with_async_filters_runs_them_concurrently(self, get_mock_dispatch_loader):
+        async def fetch(value):
+            await asyncio.sleep(0.2)
+            return 'fetched {}'.format(value)
+
+        dispatch_loader = get_mock_dispatch_loader('{{ "a"|fetch|upper }} {{ "b"|fetch }}')
+        ins = renderer.TemplateRenderer(dispatch_loader, None, enable_async=True)
+        ins.env.filters['fetch'] = renderer.wrap_async_filter('fetch', fetch)
+
+        start = time.perf_counter()
+        r = ins.render('template', {})
+        elapsed = time.perf_counter() - start
+
+        assert r == 'FETCHED A fetched b'
+        assert elapsed < 0.35
+
+    def test_render_in_running_event_loop(self, get_mock_dispatch_loader):
+        ins = renderer.TemplateRenderer(get_mock_dispatch_loader(), None, enable_async=True)
+
+        async def render():
+            return ins.render('template', {})
+
+        with pytest.raises(RuntimeError, match='render_async'):
+            asyncio.run(render())
+
+    def test_load_async_filter_without_async_mode(self, get_mock_dispatch_loader, tmp_path):
+        filter_path = tmp_path / 'filters.py'
+        filter_path.write_text('async def fetch(value):\n    return value\n')
+        ins = renderer.TemplateRenderer(get_mock_dispatch_loader(), str(filter_path))
+
+        ins.load_filters()
+
+        assert 'fetch' not in ins.env.filters
+
+    def test_dispatch_renderer_render_async(self, get_mock_dispatch_loader):
+        dispatch_loader = get_mock_dispatch_loader('[b]{{ key1 }} {{ current_dispatch }}[/b]')
+        var_loader = mock.Mock(get_all_vars=mock.Mock(return_value={'key1': 'val1'}))
+        ins = renderer.DispatchRenderer(dispatch_loader, var_loader, {}, {'enable_async': True})
+        ins.load({'nation1': {'test1': {'ns_id': 1234567, 'title': 'ABC'}}})
+
+        r = asyncio.run(ins.render_async('test1'))
+
+        assert r == '[b]val1 test1[/b]'
+
+    def test_render_with_async_filters_in_fragment_cache(self, get_mock_dispatch_loader, tmp_path):
+        """Placeholder output of the first pass must not be cached.
+        """
+
+        fetch_calls = []
+
+        async def fetch(value):
+            fetch_calls.append(value)
+            return 'fetched {}'.format(value)
+
+        dispatch_loader = get_mock_dispatch_loader('{% cache "k" %}<{{ "a"|fetch }}>{% endcache %}')
+        for _ in range(2):
+            ins = renderer.TemplateRenderer(dispatch_loader, None, enable_async=True,
+                                            fragment_cache_path=tmp_path)
+            ins.env.filters['fetch'] = renderer.wrap_async_filter('fetch', fetch)
+
+            assert ins.render('template', {}) == '<fetched a>'
+
+        assert fetch_calls == ['a']
+
+    def test_render_with_async_filters_runs_sync_filters_once(self, get_mock_dispatch_loader,
+                                                              tmp_path):
+        filter_path = tmp_path / 'filters.py'
+        filter_path.write_text('def shout(value):\n'
+                               '    return value.upper()\n\n'
+                               'async def fetch(value):\n'
+                               '    return "fetched " + value\n')
+        dispatch_loader = get_mock_dispatch_loader('{{ name|shout }} {{ "b"|fetch }}')
+        render_profiler = profiler.RenderProfiler()
+        ins = renderer.TemplateRenderer(dispatch_loader, str(filter_path), enable_async=True,
+                                        profiler=render_profiler)
+        ins.load_filters()
+
+        r = ins.render('template', {'name': 'a'})
+
+        assert r == 'A fetched b'
+        report = render_profiler.get_report()['filter']
+        assert report['shout']['calls'] == 1
+        assert report['fetch']['calls'] == 1
+
+    def test_render_with_async_filters_and_placeholder_error(self, get_mock_dispatch_loader,
+                                                             tmp_path):
+        filter_path = tmp_path / 'filters.py'
+        filter_path.write_text('def size(value):\n'
+                               '    return len(value)\n')
+        dispatch_loader = get_mock_dispatch_loader('{{ name|size + 1 }}')
+        ins = renderer.TemplateRenderer(dispatch_loader, str(filter_path), enable_async=True)
+        ins.load_filters()
+
+        assert ins.render('template', {'name': 'ab'}) == '3'
+
+    def test_render_with_async_filters_and_template_error(self, get_mock_dispatch_loader):
+        count = mock.Mock(return_value='')
+        dispatch_loader = get_mock_dispatch_loader('{{ count() }}{{ n // 0 }}{{ "a"|fetch }}')
+        ins = renderer.TemplateRenderer(dispatch_loader, None, enable_async=True)
+        ins.env.filters['fetch'] = renderer.wrap_async_filter('fetch', mock.AsyncMock())
+
+        with pytest.raises(ZeroDivisionError):
+            ins.render('template', {'count': count, 'n': 1})
+
+        count.assert_called_once()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import logging
 import json
@@ -23,6 +24,13 @@ class TestGetCategoryNumber():
         assert cat_num == '1' and subcat_num == '100'
 
 
+class TestLoggedParams():
+    def test_str_without_text(self):
+        params = {'title': 'test_title', 'text': 'test_text'}
+
+        assert str(updater.LoggedParams(params)) == "{'title': 'test_title', 'text': '<9 characters>'}"
+
+
 class TestDispatchUpdater():
     def test_login_owner_nations(self):
         login = mock.Mock()
@@ -41,25 +49,66 @@ class TestDispatchUpdater():
         login.assert_called_with('test_nation', autologin='12345')
         assert ins.dispatch_config == dispatch_config
 
+    def test_login_owner_nation_with_cached_session(self):
+        dispatch_api = mock.Mock()
+        creds = {'test_nation': '12345'}
+        sessions = mock.Mock(get_pin=mock.Mock(return_value='6789'))
+        mock_obj = mock.Mock()
+        ins = updater.DispatchUpdater(dispatch_api, creds, mock_obj, mock_obj, sessions=sessions)
+
+        ins.login_owner_nation('test_nation', {})
+
+        dispatch_api.resume_session.assert_called_with('test_nation', '12345', '6789')
+        dispatch_api.login.assert_not_called()
+
+    def test_login_owner_nation_with_no_cached_session(self):
+        dispatch_api = mock.Mock(get_pin=mock.Mock(return_value='6789'))
+        creds = {'test_nation': '12345'}
+        sessions = mock.Mock(get_pin=mock.Mock(return_value=None))
+        mock_obj = mock.Mock()
+        ins = updater.DispatchUpdater(dispatch_api, creds, mock_obj, mock_obj, sessions=sessions)
+
+        ins.login_owner_nation('test_nation', {})
+
+        dispatch_api.login.assert_called_with('test_nation', autologin='12345')
+        sessions.add.assert_called_with('test_nation', '6789')
+
+    def test_refresh_session_after_cached_session_expired(self):
+        dispatch_api = mock.Mock(get_pin=mock.Mock(return_value='6789'))
+        creds = {'test_nation': '12345'}
+        sessions = mock.Mock(get_pin=mock.Mock(return_value='6789'))
+        mock_obj = mock.Mock()
+        ins = updater.DispatchUpdater(dispatch_api, creds, mock_obj, mock_obj, sessions=sessions)
+        ins.login_owner_nation('test_nation', {})
+
+        ins.refresh_session()
+        sessions.add.assert_not_called()
+
+        dispatch_api.get_pin.return_value = '1011'
+        ins.refresh_session()
+        sessions.add.assert_called_once_with('test_nation', '1011')
+
     def test_create_dispatch(self):
         create_dispatch = mock.Mock(return_value='12345')
         dispatch_api = mock.Mock(create_dispatch=create_dispatch)
-        dispatch_loader = mock.Mock(add_dispatch_id=mock.Mock())
         mock_obj = mock.Mock()
-        ins = updater.DispatchUpdater(dispatch_api, mock_obj, mock_obj, dispatch_loader)
+        ins = updater.DispatchUpdater(dispatch_api, mock_obj, mock_obj, mock_obj)
         params = {'title': 'test_title',
                   'text': 'test_text',
                   'category': '1',
                   'subcategory': '100'}
 
-        ins.create_dispatch('test_name', params)
+        r = ins.create_dispatch(params)
 
-        dispatch_loader.add_dispatch_id.assert_called_with('test_name', '12345')
+        assert r == '12345'
+        create_dispatch.assert_called_with(title='test_title', text='test_text',
+                                           category='1', subcategory='100')
 
     def test_create_or_edit_dispatch_with_create_action(self):
         mock_obj = mock.Mock()
-        ins = updater.DispatchUpdater(mock_obj, mock_obj, mock_obj, mock_obj)
-        ins.create_dispatch = mock.Mock()
+        dispatch_loader = mock.Mock()
+        ins = updater.DispatchUpdater(mock_obj, mock_obj, mock_obj, dispatch_loader)
+        ins.create_dispatch = mock.Mock(return_value='12345')
         ins.get_dispatch_text = mock.Mock(return_value='test_text')
         this_dispatch_config = {'title': 'test_title',
                                 'category': '1',
@@ -68,11 +117,11 @@ class TestDispatchUpdater():
 
         ins.create_or_edit_dispatch('test_name', 'create', this_dispatch_config)
 
-        ins.create_dispatch.assert_called_with('test_name',
-                                               {'title': 'test_title',
+        ins.create_dispatch.assert_called_with({'title': 'test_title',
                                                 'text': 'test_text',
                                                 'category': '1',
                                                 'subcategory': '100'})
+        dispatch_loader.add_dispatch_id.assert_called_with('test_name', '12345')
 
     def test_create_or_edit_dispatch_with_edit_action(self):
         mock_obj = mock.Mock()
@@ -118,6 +167,18 @@ class TestDispatchUpdater():
 
         ins.remove_dispatch.assert_called_with('12345')
 
+    def test_update_dispatch_records_journal(self):
+        mock_obj = mock.Mock()
+        update_journal = mock.Mock()
+        ins = updater.DispatchUpdater(mock_obj, mock_obj, mock_obj, mock_obj,
+                                      journal=update_journal)
+        ins.dispatch_config = {'test_name': {'ns_id': '12345', 'action': 'remove'}}
+        ins.remove_dispatch = mock.Mock()
+
+        ins.update_dispatch('test_name')
+
+        update_journal.record.assert_called_with('test_name', 'remove', '12345', None)
+
     def test_update_dispatch_with_no_remove_action(self):
         mock_obj = mock.Mock()
         ins = updater.DispatchUpdater(mock_obj, mock_obj, mock_obj, mock_obj)
@@ -135,3 +196,115 @@ class TestDispatchUpdater():
                                                         'category': '1',
                                                         'subcategory': '100',
                                                         'ns_id': '12345'})
+
+    def test_update_dispatch_with_edit_action_returns_success(self):
+        mock_obj = mock.Mock()
+        ins = updater.DispatchUpdater(mock_obj, mock_obj, mock_obj, mock_obj)
+        ins.dispatch_config = {'test_name': {'title': 'test_title',
+                                             'category': '1',
+                                             'subcategory': '100',
+                                             'ns_id': '12345',
+                                             'action': 'edit'}}
+        ins.get_dispatch_text = mock.Mock(return_value='test_text')
+        ins.edit_dispatch = mock.Mock()
+
+        assert ins.update_dispatch('test_name')
+
+    def test_update_dispatch_with_api_error_returns_failure(self):
+        mock_obj = mock.Mock()
+        ins = updater.DispatchUpdater(mock_obj, mock_obj, mock_obj, mock_obj)
+        ins.dispatch_config = {'test_name': {'title': 'test_title',
+                                             'category': '1',
+                                             'subcategory': '100',
+                                             'ns_id': '12345',
+                                             'action': 'edit'}}
+        ins.get_dispatch_text = mock.Mock(return_value='test_text')
+        ins.edit_dispatch = mock.Mock(side_effect=exceptions.UnknownDispatchError)
+
+        assert not ins.update_dispatch('test_name')
+
+    def test_create_or_edit_dispatch_with_unchanged_content(self):
+        params = {'title': 'test_title', 'text': 'test_text',
+                  'category': '1', 'subcategory': '100'}
+        payload_hash = updater.get_payload_hash('12345', params)
+        dispatch_loader = mock.Mock(get_dispatch_hash=mock.Mock(return_value=payload_hash))
+        mock_obj = mock.Mock()
+        ins = updater.DispatchUpdater(mock_obj, mock_obj, mock_obj, dispatch_loader)
+        ins.edit_dispatch = mock.Mock()
+        ins.get_dispatch_text = mock.Mock(return_value='test_text')
+        this_dispatch_config = {'title': 'test_title',
+                                'category': '1',
+                                'subcategory': '100',
+                                'ns_id': '12345'}
+
+        r = ins.create_or_edit_dispatch('test_name', 'edit', this_dispatch_config)
+
+        assert r
+        ins.edit_dispatch.assert_not_called()
+
+    def test_create_or_edit_dispatch_with_unchanged_content_and_force(self):
+        params = {'title': 'test_title', 'text': 'test_text',
+                  'category': '1', 'subcategory': '100'}
+        payload_hash = updater.get_payload_hash('12345', params)
+        dispatch_loader = mock.Mock(get_dispatch_hash=mock.Mock(return_value=payload_hash))
+        mock_obj = mock.Mock()
+        ins = updater.DispatchUpdater(mock_obj, mock_obj, mock_obj, dispatch_loader, force=True)
+        ins.edit_dispatch = mock.Mock()
+        ins.get_dispatch_text = mock.Mock(return_value='test_text')
+        this_dispatch_config = {'title': 'test_title',
+                                'category': '1',
+                                'subcategory': '100',
+                                'ns_id': '12345'}
+
+        ins.create_or_edit_dispatch('test_name', 'edit', this_dispatch_config)
+
+        ins.edit_dispatch.assert_called_with('12345', params)
+        dispatch_loader.set_dispatch_hash.assert_called_with('test_name', payload_hash)
+
+
+class TestAsyncDispatchUpdater():
+    def test_update_dispatch_with_edit_action(self):
+        dispatch_api = mock.Mock(edit_dispatch=mock.AsyncMock())
+        renderer = mock.Mock(render_async=mock.AsyncMock(return_value='test_text'))
+        mock_obj = mock.Mock()
+        ins = updater.AsyncDispatchUpdater(dispatch_api, mock_obj, renderer, mock_obj)
+        ins.dispatch_config = {'test_name': {'title': 'test_title',
+                                             'category': '1',
+                                             'subcategory': '100',
+                                             'ns_id': '12345',
+                                             'action': 'edit'}}
+
+        r = asyncio.run(ins.update_dispatch('test_name'))
+
+        assert r
+        dispatch_api.edit_dispatch.assert_called_with(dispatch_id='12345', title='test_title',
+                                                      text='test_text', category='1',
+                                                      subcategory='100')
+
+    def test_update_dispatch_with_create_action(self):
+        dispatch_api = mock.Mock(create_dispatch=mock.AsyncMock(return_value='67890'))
+        renderer = mock.Mock(render_async=mock.AsyncMock(return_value='test_text'))
+        dispatch_loader = mock.Mock()
+        update_journal = mock.Mock()
+        mock_obj = mock.Mock()
+        ins = updater.AsyncDispatchUpdater(dispatch_api, mock_obj, renderer, dispatch_loader,
+                                           journal=update_journal)
+        ins.dispatch_config = {'test_name': {'title': 'test_title',
+                                             'category': '1',
+                                             'subcategory': '100',
+                                             'action': 'create'}}
+
+        r = asyncio.run(ins.update_dispatch('test_name'))
+
+        assert r
+        dispatch_loader.add_dispatch_id.assert_called_with('test_name', '67890')
+        update_journal.record.assert_called_once()
+
+    def test_update_dispatch_with_api_error_returns_failure(self):
+        dispatch_api = mock.Mock(remove_dispatch=mock.AsyncMock(
+            side_effect=exceptions.UnknownDispatchError))
+        mock_obj = mock.Mock()
+        ins = updater.AsyncDispatchUpdater(dispatch_api, mock_obj, mock_obj, mock_obj)
+        ins.dispatch_config = {'test_name': {'ns_id': '12345', 'action': 'remove'}}
+
+        assert not asyncio.run(ins.update_dispatch('test_name'))
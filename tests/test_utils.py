@@ -1,6 +1,7 @@
 import os
 import shutil
 import json
+import pickle
 import toml
 import logging
 from unittest import mock
@@ -73,6 +74,36 @@ class TestGetDispatchInfo():
                                    'subcategory': '100',
                                    'owner_nation': 'nation2'}}
 
+    def test_get_dispatch_info_does_not_change_dispatch_config(self):
+        dispatch_config = {'nation1': {'dispatch1': {'title': 'Test Title 1'}}}
+
+        r = utils.get_dispatch_info(dispatch_config)
+
+        assert r['dispatch1']['owner_nation'] == 'nation1'
+        assert dispatch_config == {'nation1': {'dispatch1': {'title': 'Test Title 1'}}}
+        with pytest.raises(TypeError):
+            r['dispatch1']['title'] = 'Test Title 2'
+
+    def test_get_dispatch_info_keeps_removed_dispatches(self):
+        dispatch_config = {'nation1': {'dispatch1': {'title': 'Test Title 1'}}}
+
+        r = utils.get_dispatch_info(dispatch_config)
+        del dispatch_config['nation1']
+
+        assert list(r) == ['dispatch1']
+        assert r['dispatch1']['title'] == 'Test Title 1'
+
+
+    def test_pickle_dispatch_info(self):
+        dispatch_config = {'nation1': {'dispatch1': {'title': 'Test Title 1'}}}
+        r = utils.get_dispatch_info(dispatch_config)
+        r['dispatch1']
+
+        r = pickle.loads(pickle.dumps(r))
+
+        assert r['dispatch1']['owner_nation'] == 'nation1'
+        assert r['dispatch1']['title'] == 'Test Title 1'
+
 
 class TestGetConfigFromEnv():
     def test_with_env(self, toml_files):
@@ -102,3 +133,58 @@ class TestGetConfigDefault():
 
         config_path = tmp_path / info.CONFIG_NAME
         assert config_path.exists()
+
+
+class TestLogUpdateResults():
+    def test_log_update_results(self):
+        results = {'nation1': {'dispatch1': True, 'dispatch2': False},
+                   'nation2': None,
+                   'nation3': {'dispatch3': True}}
+
+        r = utils.log_update_results(results)
+
+        assert r == (2, 3, 1)
+
+
+class TestSessionCache():
+    def test_get_pin_with_young_session(self):
+        session = {'pin': '1234', 'timestamp': 100}
+        cred_loader = mock.Mock(get_session=mock.Mock(return_value=session))
+        sessions = utils.SessionCache(cred_loader, 60, clock=lambda: 150)
+
+        assert sessions.get_pin('nation1') == '1234'
+
+    def test_get_pin_with_old_session(self):
+        session = {'pin': '1234', 'timestamp': 100}
+        cred_loader = mock.Mock(get_session=mock.Mock(return_value=session))
+        sessions = utils.SessionCache(cred_loader, 60, clock=lambda: 200)
+
+        assert sessions.get_pin('nation1') is None
+
+    def test_get_pin_with_reuse_disabled(self):
+        session = {'pin': '1234', 'timestamp': 100}
+        cred_loader = mock.Mock(get_session=mock.Mock(return_value=session))
+        sessions = utils.SessionCache(cred_loader, 0, clock=lambda: 100)
+
+        assert sessions.get_pin('nation1') is None
+
+    def test_add_session(self):
+        cred_loader = mock.Mock()
+        sessions = utils.SessionCache(cred_loader, 60, clock=lambda: 100)
+
+        sessions.add('nation1', '1234')
+
+        cred_loader.add_session.assert_called_with('nation1', '1234', 100)
+
+
+class TestFormatRenderTimings():
+    def test_format_render_timings(self):
+        results = {'dispatch1': {'load': 0.001, 'template': 0.002, 'bbcode': 0.003, 'size': 120},
+                   'dispatch2': None}
+
+        r = utils.format_render_timings(results).splitlines()
+
+        assert r[0].split() == ['Dispatch', 'Load', '(ms)', 'Template', '(ms)',
+                                'BBCode', '(ms)', 'Total', '(ms)', 'Size']
+        assert r[2].split() == ['dispatch1', '1.00', '2.00', '3.00', '6.00', '120']
+        assert r[3].split() == ['dispatch2', '-', '-', '-', '-', 'failed']